@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""
+Extract blueprint configuration from Docker image archives.
+"""
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+
+from .storage import read_json, write_json
+
+# Maximum size of file content buffered in memory during extraction (larger files are spooled to disk)
+SPOOL_SIZE = 1024 * 1024
+
+
+class IterStream(io.RawIOBase):
+    """
+    A read-only file object over an iterator of byte chunks (e.g. a Docker archive stream).
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk:
+            try:
+                self._chunk = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def member_path(member, strip_components=1):
+    """
+    Return the relative path of an archive member with leading components removed, or None if the path is empty or
+    would resolve outside the target directory.
+    """
+    parts = [part for part in member.name.split('/') if part not in ('', '.')][strip_components:]
+    if not parts or '..' in parts:
+        return None
+    return os.path.join(*parts)
+
+
+def extract_archive(chunks, target, manifest=None, strip_components=1, include=None):
+    """
+    Incrementally extract a tar stream to a target directory. Files with a content hash matching the manifest (and
+    that still exist in the target directory) are not rewritten. Returns a tuple of (written, skipped) paths, and
+    updates the manifest with the content hash of each extracted file.
+    """
+    manifest = manifest if manifest is not None else {}
+    written, skipped = [], []
+
+    with tarfile.open(fileobj=io.BufferedReader(IterStream(chunks), buffer_size=SPOOL_SIZE), mode='r|') as archive:
+        for member in archive:
+            path = member_path(member, strip_components)
+            if path is None or (include is not None and not member.isdir() and not include(path)):
+                continue
+
+            target_path = os.path.join(target, path)
+            if member.isdir():
+                os.makedirs(target_path, exist_ok=True)
+            elif member.issym():
+                if os.path.isabs(member.linkname) or '..' in member.linkname.split('/'):
+                    continue
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                if os.path.lexists(target_path):
+                    os.remove(target_path)
+                os.symlink(member.linkname, target_path)
+                written.append(path)
+            elif member.isfile():
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                digest = hashlib.sha256()
+                with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=os.path.dirname(target_path)) as content:
+                    source = archive.extractfile(member)
+                    for chunk in iter(lambda: source.read(SPOOL_SIZE), b''):
+                        digest.update(chunk)
+                        content.write(chunk)
+
+                    if manifest.get(path) == digest.hexdigest() and os.path.isfile(target_path):
+                        skipped.append(path)
+                        continue
+
+                    content.seek(0)
+                    temp_path = f'{target_path}.tmp{os.getpid()}'
+                    with open(temp_path, 'wb') as target_file:
+                        shutil.copyfileobj(content, target_file)
+                    os.chmod(temp_path, member.mode & 0o777)
+                    os.replace(temp_path, target_path)
+
+                manifest[path] = digest.hexdigest()
+                written.append(path)
+
+    return written, skipped
+
+
+def read_manifest(path):
+    return read_json(path)
+
+
+def save_manifest(path, manifest):
+    write_json(path, manifest)
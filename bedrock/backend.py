@@ -1,5 +1,141 @@
+import copy
+import hashlib
+import threading
+import time
+
+from .profile import span, traced
 from .utils import *
 
+# Arguments of a state migration (state is copied to the new backend without prompting)
+MIGRATE_ARGS = ['init', '-migrate-state', '-force-copy', '-input=false']
+
+
+class PolicyError(Exception):
+    pass
+
+
+def render_backend(backend_type, config=None):
+    """
+    Render backend configuration (backend.tf) from backend settings. Nested settings (e.g. remote workspaces) are
+    rendered as blocks.
+    """
+    def render_block(settings, indent):
+        lines = []
+        for key, value in settings.items():
+            if isinstance(value, dict):
+                lines.append(f'{indent}{key} {{')
+                lines += render_block(value, indent + '  ')
+                lines.append(f'{indent}}}')
+            else:
+                lines.append(f'{indent}{key} = {json.dumps(value)}')
+        return lines
+
+    return '\n'.join(['terraform {', f'  backend "{backend_type}" {{'] + render_block(config or {}, '    ') +
+                     ['  }', '}'])
+
+
+def default_backend(backend_type, blueprint_id, s3_bucket=None, organization=None):
+    """
+    Return the backend settings configured interactively for a blueprint.
+    """
+    if backend_type == 's3':
+        return {'bucket': s3_bucket, 'dynamodb_table': 'terraform-lock',
+                'key': f'blueprint/{blueprint_id}/terraform.tfstate'}
+    elif backend_type == 'remote':
+        return {'organization': organization, 'workspaces': {'prefix': f'{blueprint_id}-'}}
+    return {}
+
+
+class BackendPolicy:
+    """
+    A declarative backend policy: default backend settings, overridden by the settings of each rule matching a
+    blueprint (rules are applied in order). String settings may reference the blueprint identifier ({blueprint}), and
+    its namespace and name (e.g. {namespace}/{name} for aws/ecr-repository). For example:
+
+        defaults:
+          type: s3
+          config:
+            bucket: acme-terraform-state
+            key: "{namespace}/{name}/terraform.tfstate"
+            workspace_key_prefix: workspaces
+            dynamodb_table: terraform-lock
+        rules:
+          - match: "legacy/*"
+            config:
+              bucket: acme-legacy-state
+    """
+
+    def __init__(self, defaults=None, rules=()):
+        # Default backend type and settings
+        self.defaults = defaults or {}
+
+        # Backend type and settings overrides, for blueprints matching a glob pattern
+        self.rules = list(rules)
+
+    @staticmethod
+    def load(policy_path):
+        """
+        Load and validate a policy file (YAML or JSON).
+        """
+        import yaml
+
+        with open(policy_path, 'r') as policy_file:
+            try:
+                policy = yaml.safe_load(policy_file) or {}
+            except yaml.YAMLError as e:
+                raise PolicyError(str(e))
+        if not isinstance(policy, dict):
+            raise PolicyError("expected a mapping of defaults and rules")
+
+        errors = []
+        rules = policy.get('rules') or []
+        for index, rule in enumerate(rules):
+            if not isinstance(rule, dict) or 'match' not in rule:
+                errors.append(f"rule {index} requires a match pattern")
+            elif not isinstance(rule.get('config', {}), dict):
+                errors.append(f"rule {index} config must be a mapping")
+        if errors:
+            raise PolicyError('; '.join(errors))
+        return BackendPolicy(policy.get('defaults') or {}, rules)
+
+    @property
+    def digest(self):
+        return hashlib.sha256(json.dumps([self.defaults, self.rules], sort_keys=True).encode()).hexdigest()
+
+    def resolve(self, blueprint_id):
+        """
+        Return the backend type and settings of a blueprint, or None if the policy excludes it (type: none).
+        """
+        backend_type = self.defaults.get('type', 's3')
+        config = copy.deepcopy(self.defaults.get('config') or {})
+        for rule in self.rules:
+            if fnmatch.fnmatch(blueprint_id, rule['match']):
+                backend_type = rule.get('type', backend_type)
+                if rule.get('replace'):
+                    config = {}
+                config.update(copy.deepcopy(rule.get('config') or {}))
+        if backend_type == 'none':
+            return None
+
+        namespace, _, name = blueprint_id.rpartition('/')
+        placeholders = {'blueprint': blueprint_id, 'namespace': namespace, 'name': name}
+
+        def substitute(value):
+            if isinstance(value, dict):
+                return {key: substitute(item) for key, item in value.items()}
+            if isinstance(value, str):
+                try:
+                    return value.format(**placeholders)
+                except (KeyError, IndexError, ValueError) as e:
+                    raise PolicyError(f"invalid placeholder in {value!r}: {e}")
+            return value
+
+        return backend_type, substitute(config)
+
+    def render(self, blueprint_id):
+        resolved = self.resolve(blueprint_id)
+        return render_backend(*resolved) if resolved is not None else None
+
 
 class BackendSpec:
 
@@ -23,36 +159,195 @@ class BackendSpec:
         self.s3_bucket = s3_bucket
         self.organization = organization
 
+    @traced('backend')
+    def run(self):
+        if self.dry_run:
+            print("Dry run enabled. No changes will be made.")
+
+        backend = render_backend(self.backend_type, default_backend(self.backend_type, self.blueprint_id,
+                                                                    self.s3_bucket, self.organization))
+
+        if not self.dry_run:
+            with span('backend.write'):
+                write_backend(self.blueprint_id, self.blueprint_home, backend)
+
+
+class BackendApplySpec:
+    """
+    Render backend configuration for many blueprints from a policy, then migrate state of blueprints with a changed
+    backend (i.e. init -migrate-state) concurrently. Migrations are recorded in a journal, such that an interrupted
+    or failed run (or a run with migration disabled) is resumed by running again (completed migrations are skipped).
+    """
+
+    def __init__(self, policy_path, blueprint_ids, max_workers=4, dry_run=False, verbose=False):
+        # Location of the backend policy
+        self.policy_path = policy_path
+
+        # Blueprints to configure
+        self.blueprint_ids = blueprint_ids
+
+        # Maximum number of concurrent migrations
+        self.max_workers = max_workers
+
+        # Enable dry run (report changes without writing configuration or migrating state)
+        self.dry_run = dry_run
+
+        # Enable verbose logging
+        self.verbose = verbose
+
+        # Blueprint home directory
+        self.blueprint_home = '.'
+
+        # Registry entries of blueprints (image and role for migrations)
+        self.blueprints = {}
+
+        # Migrate state of blueprints with a changed backend
+        self.migrate = True
+
+        # Docker client (shared across migrations, or created if not specified)
+        self.client = None
+
+        self._journal_lock = threading.Lock()
+
+    @property
+    def journal_path(self):
+        home = os.path.abspath(os.path.expanduser(self.blueprint_home))
+        return os.path.expanduser(f'~/.bedrock/migrations/{hashlib.sha256(home.encode()).hexdigest()[:16]}.json')
+
+    def needs_migration(self, blueprint_id):
+        """
+        Whether a blueprint has been initialised or has local state (otherwise there's no state to migrate).
+        """
+        blueprint_path = os.path.expanduser(f'{self.blueprint_home}/{blueprint_id}')
+        return os.path.isdir(f'{blueprint_path}/.terraform') or os.path.exists(f'{blueprint_path}/terraform.tfstate') \
+            or os.path.isdir(f'{blueprint_path}/terraform.tfstate.d')
+
+    def render(self, policy):
+        """
+        Render backend configuration of each blueprint. Returns changed blueprints, as a map of blueprint identifier to
+        the rendered and current configuration (None if there is none).
+        """
+        changed = {}
+        unchanged = excluded = 0
+        for blueprint_id in self.blueprint_ids:
+            backend = policy.render(blueprint_id)
+            if backend is None:
+                excluded += 1
+                continue
+            backend_path = os.path.expanduser(f'{self.blueprint_home}/{blueprint_id}/backend.tf')
+            try:
+                with open(backend_path, 'r') as backend_file:
+                    current = backend_file.read()
+            except IOError:
+                current = None
+            if current is not None and current.strip() == backend.strip():
+                unchanged += 1
+                continue
+
+            changed[blueprint_id] = backend, current
+            if self.verbose or self.dry_run:
+                print(f"{'Create' if current is None else 'Update'} backend: {blueprint_id}")
+
+        print(f"Backend configuration: {len(changed)} changed, {unchanged} unchanged, {excluded} excluded")
+        return changed
+
+    def migrate_blueprint(self, blueprint_id, journal):
+        from .terraform import TerraformSpec
+
+        blueprint = self.blueprints.get(blueprint_id) or {}
+        spec = TerraformSpec(blueprint_id, None, verbose=self.verbose)
+        spec.blueprint_home = self.blueprint_home
+        if 'image' in blueprint:
+            from .blueprint import BlueprintSpec
+
+            spec.image = blueprint['image']
+            spec.image_registry = BlueprintSpec.get_blueprint_registry()
+            spec.image_tag = BlueprintSpec.get_blueprint_tag()
+        spec.role_arn = blueprint.get('role_arn')
+        spec.workspace_roles = blueprint.get('workspace_roles') or {}
+        spec.args = list(MIGRATE_ARGS)
+        spec.tty = False
+        spec.output_prefix = blueprint_id
+        spec.client = self.client
+        spec.concurrency = self.max_workers
+
+        start = time.monotonic()
+        try:
+            exit_code = spec.run()
+        except Exception as e:
+            print(f"[{blueprint_id}] {ANSIColors.FAIL}{e}{ANSIColors.ENDC}")
+            exit_code = 1
+        duration = time.monotonic() - start
+
+        with self._journal_lock:
+            journal[blueprint_id].update(status='succeeded' if exit_code == 0 else 'failed', exit_code=exit_code,
+                                         duration=duration)
+            write_json(self.journal_path, journal)
+        return blueprint_id, exit_code, duration
+
     def run(self):
         if self.dry_run:
             print("Dry run enabled. No changes will be made.")
 
-        if self.backend_type == 's3':
-            backend = """terraform {
-  backend "s3" {
-    bucket = "%s"
-    dynamodb_table = "terraform-lock"
-    key = "blueprint/%s/terraform.tfstate"
-  }
-}
-            """ % (self.s3_bucket, self.blueprint_id)
-        elif self.backend_type == 'remote':
-            backend = """terraform {
-  backend "remote" {
-    organization="%s"
-    workspaces {
-      prefix = "%s-"
-    }
-  }
-}
-            """ % (self.organization, self.blueprint_id)
-        else:
-            backend = """terraform {
-  backend "local" {
-    #path = "relative/path/to/terraform.tfstate"
-  }
-}
-"""
+        try:
+            policy = BackendPolicy.load(self.policy_path)
+            with span('backend.render', blueprints=len(self.blueprint_ids)):
+                changed = self.render(policy)
+        except (IOError, PolicyError) as e:
+            print(f"{ANSIColors.FAIL}Invalid backend policy: {e}{ANSIColors.ENDC}")
+            return 1
 
+        # record migrations (with the previous backend) before configuration is rewritten, such that a migration is
+        # never lost if the run is interrupted (or migration is skipped)..
+        journal = read_json(self.journal_path)
+        for blueprint_id, (_, current) in changed.items():
+            if self.needs_migration(blueprint_id):
+                entry = journal.get(blueprint_id)
+                if entry is not None and entry['status'] != 'succeeded':
+                    # changed again before migration completed (so state is still on the earlier backend)..
+                    current = entry.get('previous', current)
+                journal[blueprint_id] = {'status': 'pending', 'policy': policy.digest[:16], 'previous': current}
         if not self.dry_run:
-            write_backend(self.blueprint_id, self.blueprint_home, backend)
+            write_json(self.journal_path, journal)
+            with span('backend.write', blueprints=len(changed)):
+                for blueprint_id, (backend, _) in changed.items():
+                    write_backend(blueprint_id, self.blueprint_home, backend)
+
+        # resume migrations of a previous (interrupted, failed or skipped) run..
+        pending = [blueprint_id for blueprint_id, entry in journal.items()
+                   if entry['status'] != 'succeeded' and blueprint_id in self.blueprint_ids]
+        if not pending:
+            return 0
+        if not self.migrate:
+            print(f"State migration of {len(pending)} blueprints is pending.. run without --no-migrate to migrate")
+            return 0
+
+        print(f"Migrating state of {len(pending)} blueprints ({self.max_workers} concurrent)\n")
+        if self.dry_run:
+            for blueprint_id in pending:
+                print(f"Migrate state: {blueprint_id}")
+            return 0
+
+        if self.client is None:
+            import docker
+
+            # share a single client (and connection pool) between migrations..
+            self.client = docker.from_env(max_pool_size=self.max_workers)
+
+        from .fanout import print_summary, worker_pool
+
+        try:
+            with worker_pool(max(1, self.max_workers)) as executor:
+                results = list(executor.map(lambda blueprint_id: self.migrate_blueprint(blueprint_id, journal),
+                                            pending))
+        except KeyboardInterrupt:
+            # interrupted migrations remain pending in the journal..
+            return 130
+
+        print_summary(results, title='BLUEPRINT')
+
+        failed = [blueprint_id for blueprint_id, exit_code, _ in results if exit_code != 0]
+        if failed:
+            print(f"{ANSIColors.WARNING}{len(failed)} migrations failed.. run again to retry{ANSIColors.ENDC}")
+            return 1
+        return 0
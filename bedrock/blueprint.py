@@ -1,3 +1,7 @@
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from .utils import *
 
 
@@ -35,18 +39,109 @@ class BlueprintSpec:
         self.blueprint_id = blueprint_id
         self.blueprint_image = blueprint_image
 
+        # Pull blueprint images (all registered blueprints if blueprint_id is None)
+        self.pull = False
+
+        # Maximum number of concurrent image pulls (or registry requests)
+        self.max_workers = 4
+
+        # Synchronise registered blueprints with the registry catalog
+        self.sync = False
+
+        # Registry to synchronise (defaults to BLUEPRINT_REGISTRY)
+        self.registry = None
+
+        # Synchronise only repositories with the specified prefix
+        self.prefix = None
+
     def run(self):
         if self.dry_run:
             print("Dry run enabled. No changes will be made.")
 
-        blueprints = read_blueprints()
+        if self.pull:
+            return self.pull_images()
+        elif self.sync:
+            return self.sync_catalog()
 
         if self.blueprint_id is not None:
-            blueprints[self.blueprint_id] = {
-                'image': self.blueprint_image
-            }
-
             if not self.dry_run:
-                save_blueprints(blueprints)
+                update_blueprints({self.blueprint_id: {'image': self.blueprint_image}})
         else:
-            print(json.dumps(blueprints, indent=2))
+            from .registry import BlueprintRegistry
+
+            # registered blueprints, including namespaced registry files (but not default blueprints)..
+            print(json.dumps(BlueprintRegistry().all(), indent=2))
+
+    def pull_images(self):
+        """
+        Pull blueprint images concurrently, skipping images that are up to date with the registry.
+        """
+        from .images import ImageManager, image_name
+
+        if self.blueprint_id is not None:
+            images = [self.blueprint_image]
+        else:
+            from .registry import BlueprintRegistry
+
+            blueprints = BlueprintRegistry(defaults=BlueprintSpec.default_blueprints).all()
+            images = sorted({blueprint['image'] for blueprint in blueprints.values()})
+
+        registry = BlueprintSpec.get_blueprint_registry()
+        tag = BlueprintSpec.get_blueprint_tag()
+        if self.dry_run:
+            for image in images:
+                print(f"Pull image: {image_name(image, registry)}:{tag or 'latest'}")
+            return 0
+
+        import docker
+        import docker.errors
+
+        client = docker.from_env(max_pool_size=self.max_workers)
+        images_manager = ImageManager(client)
+        progress = {'completed': 0, 'failed': 0}
+        progress_lock = threading.Lock()
+
+        def pull_image(image):
+            image_ref = image_name(image, registry)
+            try:
+                status = 'pulled' if images_manager.ensure(image_ref, tag, pull=True) else 'up to date'
+            except docker.errors.APIError as e:
+                status = f'{ANSIColors.FAIL}failed: {e.explanation or e}{ANSIColors.ENDC}'
+                with progress_lock:
+                    progress['failed'] += 1
+            with progress_lock:
+                progress['completed'] += 1
+                print(f"[{progress['completed']}/{len(images)}] {image_ref}:{tag or 'latest'} - {status}")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(pull_image, images))
+
+        return 1 if progress['failed'] > 0 else 0
+
+    def sync_catalog(self):
+        """
+        Register blueprints (and available tags) discovered from the registry catalog.
+        """
+        from .catalog import RegistryCatalog, merge_catalog
+
+        registry = self.registry or BlueprintSpec.get_blueprint_registry()
+        if registry is None:
+            print("No registry specified. Use --registry or BLUEPRINT_REGISTRY.")
+            return 1
+
+        catalog = RegistryCatalog(registry, max_workers=self.max_workers)
+        repositories = catalog.sync(self.prefix)
+
+        if self.verbose:
+            print(f"Registry responses: {catalog.stats['modified']} modified, "
+                  f"{catalog.stats['not_modified']} not modified\n")
+
+        # merge under the registry lock, such that concurrent changes to registered blueprints are not lost..
+        registry_file = contextlib.nullcontext(read_blueprints()) if self.dry_run else modify_json(blueprints_path())
+        with registry_file as blueprints:
+            added = merge_catalog(blueprints, repositories, self.prefix)
+            for blueprint_id in added:
+                print(f"Adding blueprint: {blueprint_id} ({blueprints[blueprint_id]['image']})")
+        print(f"Synchronised {len(repositories)} repositories from {catalog.registry_url} ({len(added)} added)")
+
+        return 0
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Manage a Terraform provider plugin cache shared across blueprints and workspaces.
+"""
+import glob
+import shutil
+import time
+
+from .utils import *
+
+# Default maximum plugin cache size (in MB)
+DEFAULT_CACHE_SIZE = 2048
+
+
+class PluginCache:
+
+    # Location of the plugin cache in blueprint containers
+    container_path = '/bedrock/plugin-cache'
+
+    def __init__(self, root='~/.bedrock', max_size=None):
+        # Host location of the plugin cache
+        self.path = os.path.expanduser(f'{root}/plugin-cache')
+
+        # Maximum size of the cache (in bytes), after which least recently used providers are evicted
+        if max_size is None:
+            max_size = int(os.environ.get('BEDROCK_PLUGIN_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+        self.max_size = max_size * 1024 * 1024
+
+    def init(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    def in_use(self):
+        """
+        Hold a shared lock on the cache while a run may install or read providers (excluding eviction).
+        """
+        return locked(self.path, shared=True)
+
+    def entries(self):
+        """
+        List cached providers as tuples of (path, size, last used), ordered from least to most recently used. Each
+        provider version is stored under: <hostname>/<namespace>/<type>/<version>.
+        """
+        entries = []
+        for version_path in glob.glob(f'{self.path}/*/*/*/*'):
+            if os.path.isdir(version_path) and not os.path.islink(version_path):
+                entries.append((version_path, dir_size(version_path), os.stat(version_path).st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def touch(self, blueprint_path):
+        """
+        Mark providers installed in a blueprint working directory as recently used.
+        """
+        now = time.time()
+        providers_path = f'{os.path.expanduser(blueprint_path)}/.terraform/providers'
+        for version_path in glob.glob(f'{providers_path}/*/*/*/*'):
+            cache_path = os.path.join(self.path, os.path.relpath(version_path, providers_path))
+            if os.path.isdir(cache_path):
+                os.utime(cache_path, (now, now))
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'path': self.path,
+            'providers': len(entries),
+            'size': sum(size for _, size, _ in entries),
+            'max_size': self.max_size
+        }
+
+    def prune(self, max_size=None, dry_run=False, wait=True):
+        """
+        Evict least recently used providers until the cache is within the maximum size, once no run is using the
+        cache. Returns evicted paths (or an empty list if not waiting and the cache is in use).
+        """
+        try:
+            with locked(self.path, blocking=wait):
+                return self._evict(self.max_size if max_size is None else max_size, dry_run)
+        except BlockingIOError:
+            # another run is using the cache (and will prune when it completes)..
+            return []
+
+    def _evict(self, max_size, dry_run):
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+
+        evicted = []
+        for path, size, _ in entries:
+            if total_size <= max_size:
+                break
+            if not dry_run:
+                try:
+                    shutil.rmtree(path)
+                except OSError as e:
+                    print(f"{ANSIColors.WARNING}Unable to evict provider: {path} ({e}){ANSIColors.ENDC}")
+                    continue
+            evicted.append(path)
+            total_size -= size
+
+        return evicted
+
+
+def dir_size(path):
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            if not os.path.islink(file_path):
+                size += os.path.getsize(file_path)
+    return size
+
+
+class CacheSpec:
+
+    def __init__(self, command='stats', max_size=None, dry_run=False, verbose=False):
+        # Cache command (i.e. stats, prune)
+        self.command = command
+
+        # Maximum cache size override (in MB)
+        self.max_size = max_size
+
+        # Enable dry run (skip eviction)
+        self.dry_run = dry_run
+
+        # Enable verbose logging
+        self.verbose = verbose
+
+    def run(self):
+        if self.dry_run:
+            print("Dry run enabled. No changes will be made.")
+
+        cache = PluginCache(max_size=self.max_size)
+
+        if self.command == 'prune':
+            evicted = cache.prune(dry_run=self.dry_run)
+            for path in evicted:
+                print(f"Evicting provider: {os.path.relpath(path, cache.path)}")
+            print(f"Evicted {len(evicted)} providers")
+        else:
+            stats = cache.stats()
+            print(f"Plugin cache:  {stats['path']}")
+            print(f"Providers:     {stats['providers']}")
+            print(f"Size:          {stats['size'] / 1024 / 1024:.1f}MB / {stats['max_size'] / 1024 / 1024:.0f}MB")
+
+            if self.verbose:
+                for path, size, last_used in reversed(cache.entries()):
+                    print(f"  {os.path.relpath(path, cache.path)}  {size / 1024 / 1024:.1f}MB  "
+                          f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(last_used))}")
+
+        return 0
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+Discover blueprints from a Docker registry catalog.
+"""
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+from .storage import read_json, update_json
+from .utils import *
+
+
+class RegistryCatalog:
+
+    def __init__(self, registry, root='~/.bedrock', max_workers=8):
+        # Registry base URL (defaults to HTTPS, except for local registries)
+        if '://' not in registry:
+            local = registry.split(':')[0] in ['localhost', '127.0.0.1']
+            registry = f"{'http' if local else 'https'}://{registry}"
+        self.registry_url = registry.rstrip('/')
+
+        # Cached responses (keyed by URL) for conditional requests
+        self.cache_path = os.path.expanduser(f'{root}/catalog-cache.json')
+
+        # Maximum number of concurrent requests (and pooled connections)
+        self.max_workers = max_workers
+
+        # Response statistics (i.e. number of 200 and 304 responses)
+        self.stats = {'modified': 0, 'not_modified': 0}
+
+        self._session = None
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        if self._session is None:
+            import requests
+            import requests.adapters
+
+            # keep-alive connections are pooled and reused across concurrent requests..
+            self._session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+        return self._session
+
+    def get(self, path):
+        """
+        Fetch a JSON resource (following pagination links), using cached responses when not modified.
+        """
+        url = f'{self.registry_url}{path}'
+        pages = []
+        while url is not None:
+            cached = self.cache().get(url)
+            headers = {'Accept': 'application/json'}
+            if cached is not None:
+                headers['If-None-Match'] = cached['etag']
+
+            response = self.session().get(url, headers=headers, timeout=30)
+            with self._lock:
+                if response.status_code == 304 and cached is not None:
+                    self.stats['not_modified'] += 1
+                else:
+                    response.raise_for_status()
+                    self.stats['modified'] += 1
+                    cached = {'body': response.json(), 'next': next_link(response.headers.get('Link'))}
+                    if response.headers.get('ETag'):
+                        cached['etag'] = response.headers['ETag']
+                        self._cache[url] = cached
+
+            pages.append(cached['body'])
+            url = urljoin(url, cached['next']) if cached.get('next') else None
+        return pages
+
+    def repositories(self, prefix=None):
+        repositories = [repository for page in self.get('/v2/_catalog') for repository in page.get('repositories') or []]
+        return [repository for repository in repositories if prefix is None or repository.startswith(prefix)]
+
+    def tags(self, repository):
+        return sorted({tag for page in self.get(f'/v2/{repository}/tags/list') for tag in page.get('tags') or []})
+
+    def sync(self, prefix=None):
+        """
+        Return available tags for each repository in the registry catalog (optionally filtered by prefix).
+        """
+        repositories = self.repositories(prefix)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            tags = list(executor.map(self.tags, repositories))
+        self.save_cache()
+        return dict(zip(repositories, tags))
+
+    def cache(self):
+        if self._cache is None:
+            self._cache = read_json(self.cache_path)
+        return self._cache
+
+    def save_cache(self):
+        update_json(self.cache_path, self.cache())
+
+
+def next_link(link):
+    """
+    Parse the next page URL from a Link header (e.g. </v2/_catalog?last=b&n=100>; rel="next").
+    """
+    match = re.search(r'<([^>]+)>;\s*rel="?next"?', link or '')
+    return match.group(1) if match else None
+
+
+def merge_catalog(blueprints, catalog, prefix=None):
+    """
+    Merge registry repositories into registered blueprints. Existing blueprints referencing a repository are updated
+    with available tags, otherwise a new blueprint is registered (identified by the repository name without prefix).
+    """
+    images = {blueprint.get('image'): blueprint_id for blueprint_id, blueprint in blueprints.items()}
+    added = []
+    for repository, tags in catalog.items():
+        blueprint_id = images.get(repository)
+        if blueprint_id is None:
+            blueprint_id = repository[len(prefix):] if prefix and repository.startswith(prefix) else repository
+            blueprints[blueprint_id] = {'image': repository}
+            added.append(blueprint_id)
+        blueprints[blueprint_id]['tags'] = tags
+    return added
@@ -1,16 +1,40 @@
 #!/usr/bin/env python3
 import argparse
+import contextlib
 import sys
 import os
+import time
 
-from simple_term_menu import TerminalMenu
-
-from .terraform import TerraformSpec
-from .backend import BackendSpec
-from .config import ConfigSpec
+# NOTE: keep module-level imports lightweight, as the CLI is invoked frequently (e.g. shell completion, wrapper
+# scripts). Heavy dependencies (docker, dockerpty, simple_term_menu), and the modules of each command (e.g. terraform,
+# export), are imported only on the code paths that use them.
 from .blueprint import BlueprintSpec
-from .export import ExportSpec
-from .utils import read_blueprints, ANSIColors
+from .registry import BlueprintRegistry
+from .utils import list_workspaces, match_workspaces, ANSIColors, TF_COMMANDS
+
+
+def strip_args(args, options, flags=()):
+    """
+    Remove bedrock-specific options (and their values) and flags from arguments passed through to Terraform.
+    """
+    stripped = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in flags:
+            continue
+        elif arg in options:
+            skip = True
+        elif not arg.startswith(tuple(f'{option}=' for option in options)):
+            stripped.append(arg)
+    return stripped
+
+
+# Global options (and flags) parsed by the top-level parser, which may follow sub-command arguments
+GLOBAL_OPTIONS = ['-t', '--blueprint', '-var-file', '--workspaces', '--jobs', '--output', '--engine', '--hosts',
+                  '--profile-trace']
+GLOBAL_FLAGS = ['--pull', '--plan-cache', '--dryrun', '-v', '--verbose', '-q', '--quiet', '--record-log', '--profile']
 
 
 class BedrockCli(object):
@@ -19,18 +43,24 @@ class BedrockCli(object):
         parser = argparse.ArgumentParser(description='', usage=f'''bedrock <command> [<args>]
          Available commands:
             apply
-            {ANSIColors.BOLD}backend{ANSIColors.ENDC} - configure the backend
+            {ANSIColors.BOLD}backend{ANSIColors.ENDC} - configure the backend (apply a backend policy to blueprints)
             {ANSIColors.BOLD}blueprint{ANSIColors.ENDC} - configure available blueprints
+            {ANSIColors.BOLD}cache{ANSIColors.ENDC} - manage the provider plugin cache (stats, prune)
             {ANSIColors.BOLD}config{ANSIColors.ENDC} - configure instance variable overrides
             destroy
+            {ANSIColors.BOLD}drift{ANSIColors.ENDC} - detect drift across blueprint workspaces (serve, status)
             {ANSIColors.BOLD}export{ANSIColors.ENDC} - export blueprint configuration
+            {ANSIColors.BOLD}gc{ANSIColors.ENDC} - remove orphaned blueprint containers
             graph
+            {ANSIColors.BOLD}history{ANSIColors.ENDC} - query the run ledger (runs, stats, logs)
             import
             init
+            {ANSIColors.BOLD}inventory{ANSIColors.ENDC} - find resources and outputs across all blueprints and workspaces
             output
             plan
             providers
             refresh
+            {ANSIColors.BOLD}run{ANSIColors.ENDC} - execute a manifest of blueprint commands
             show
             state
             taint
@@ -42,12 +72,36 @@ class BedrockCli(object):
         parser.add_argument('-t', '--blueprint', metavar='<blueprint_id>',
                             help='optional blueprint identifier (bypass selection mode)')
         parser.add_argument('--pull', action='store_true', help='pull blueprint image prior to command execution')
+        parser.add_argument('--plan-cache', action='store_true',
+                            help='reuse cached plans when blueprint inputs and state are unchanged')
         parser.add_argument('--dryrun', action='store_true', help='simulate execution without making any changes')
         parser.add_argument('-v', '--verbose', action='store_true', help='output additional logs to stdout')
         parser.add_argument('-q', '--quiet', action='store_true', help='suppress execution output to stdout')
         parser.add_argument('-var-file', metavar='<var_file>', help='override default config')
-        parser.add_argument('command', help='Subcommand to run', choices=['apply', 'destroy', 'force-unlock', 'graph', 'import', 'init', 'output', 'plan', 'providers', 'refresh', 'show',
-                                                                          'state', 'taint', 'untaint', 'version', 'workspace'] + ['blueprint', 'backend', 'config', 'export'])
+        parser.add_argument('--workspaces', metavar='<workspaces>',
+                            help='comma-separated workspace names or glob patterns to run concurrently')
+        parser.add_argument('--jobs', metavar='<jobs>', type=int, default=4,
+                            help='maximum number of concurrent runs or image pulls (default: 4)')
+        parser.add_argument('--output', metavar='<output>', choices=['tty', 'stream', 'json'],
+                            help='output mode: tty (interactive), stream (plain text) or json (JSON lines). '
+                                 'Defaults to tty when attached to a terminal, otherwise stream')
+        parser.add_argument('--engine', metavar='<engine>', choices=['docker', 'native'],
+                            default=os.environ.get('BEDROCK_ENGINE', 'docker'),
+                            help='execution engine: docker (run in the blueprint container) or native (run a host '
+                                 'Terraform binary against configuration extracted from the blueprint image). '
+                                 'Defaults to BEDROCK_ENGINE, or docker')
+        parser.add_argument('--hosts', metavar='<hosts>',
+                            help='comma-separated Docker endpoints or contexts to schedule runs across (default: '
+                                 'BEDROCK_DOCKER_HOSTS). --jobs limits concurrent runs per host')
+        parser.add_argument('--record-log', action='store_true',
+                            help='record (non-interactive) command output in the run ledger (see history)')
+        parser.add_argument('--profile', action='store_true',
+                            help='print a breakdown of time spent in each phase of execution (to stderr)')
+        parser.add_argument('--profile-trace', metavar='<trace_file>',
+                            help='write profiled phases as a Chrome trace event file (implies --profile)')
+        parser.add_argument('command', help='Subcommand to run', choices=TF_COMMANDS + [
+                                'blueprint', 'backend', 'cache', 'config', 'drift', 'export', 'gc', 'history', 'inventory',
+                                'run'])
         parser.add_argument('cmd_args', metavar='<cmd_args>',
                             help='additional arguments for sub-commands', nargs='*')
 
@@ -55,9 +109,10 @@ class BedrockCli(object):
 
         for arg in unknown:
             if arg.startswith(("-", "--")):
-                # store true for args without assignment
+                # store true for args without assignment (consuming an optional value, which is parsed by the
+                # subcommand)..
                 if "=" not in arg:
-                    parser.add_argument(arg, action='store_true')
+                    parser.add_argument(arg, nargs='?', const=True)
                 else:
                     parser.add_argument(arg)
 
@@ -66,44 +121,109 @@ class BedrockCli(object):
         self.pull_image = args.pull
         self.dryrun = args.dryrun
         self.verbose = args.verbose
-
-        if args.command in TerraformSpec.tf_commands:
-            self.terraform(sys.argv[sys.argv.index(args.command):], var_file=args.var_file)
+        self.workspaces = args.workspaces
+        self.jobs = args.jobs
+        self.output = args.output
+        self.plan_cache = args.plan_cache
+        self.engine = args.engine
+        self.record_log = args.record_log
+        self.hosts = args.hosts
+
+        recorder = None
+        if args.profile or args.profile_trace:
+            from .profile import SpanRecorder, add_hook
+
+            recorder = SpanRecorder()
+            add_hook(recorder)
+
+        try:
+            exit_code = self.dispatch(args)
+        finally:
+            # write recorded runs in a single batch (runs are only recorded if the ledger has been imported)..
+            if 'bedrock.ledger' in sys.modules:
+                from .ledger import RunLedger
+
+                ledger = RunLedger.default()
+                if ledger is not None:
+                    ledger.flush()
+            if recorder is not None:
+                recorder.print_summary(sys.stderr)
+                if args.profile_trace:
+                    recorder.write_trace(args.profile_trace)
+
+        sys.exit(exit_code)
+
+    def dispatch(self, args):
+        exit_code = None
+        if args.command in TF_COMMANDS:
+            exit_code = self.terraform(strip_args(sys.argv[sys.argv.index(args.command):],
+                                                  ['--workspaces', '--jobs', '--output', '--engine', '--hosts',
+                                                   '--profile-trace'],
+                                                  ['--plan-cache', '--record-log', '--profile']),
+                                       var_file=args.var_file)
         elif args.command == 'backend':
-            self.backend(sys.argv[sys.argv.index(args.command) + 1:])
+            exit_code = self.backend(sys.argv[sys.argv.index(args.command) + 1:])
         elif args.command == 'config':
-            self.config(sys.argv[sys.argv.index(args.command) + 1:])
+            exit_code = self.config(sys.argv[sys.argv.index(args.command) + 1:])
         elif args.command == 'blueprint':
-            self.blueprint(sys.argv[sys.argv.index(args.command) + 1:])
+            exit_code = self.blueprint(sys.argv[sys.argv.index(args.command) + 1:])
+        elif args.command == 'drift':
+            exit_code = self.drift(sys.argv[sys.argv.index(args.command) + 1:])
         elif args.command == 'export':
-            self.export(sys.argv[sys.argv.index(args.command) + 1:])
-
-        sys.exit()
+            exit_code = self.export(sys.argv[sys.argv.index(args.command) + 1:])
+        elif args.command == 'cache':
+            exit_code = self.cache(sys.argv[sys.argv.index(args.command) + 1:])
+        elif args.command == 'gc':
+            exit_code = self.gc(sys.argv[sys.argv.index(args.command) + 1:])
+        elif args.command == 'history':
+            exit_code = self.history(sys.argv[sys.argv.index(args.command) + 1:])
+        elif args.command == 'inventory':
+            exit_code = self.inventory(sys.argv[sys.argv.index(args.command) + 1:])
+        elif args.command == 'run':
+            exit_code = self.run(sys.argv[sys.argv.index(args.command) + 1:])
+
+        return exit_code
 
     def get_blueprint(self):
-        blueprints = {**BlueprintSpec.default_blueprints, **read_blueprints()}
+        registry = BlueprintRegistry(defaults=BlueprintSpec.default_blueprints)
 
-        if self.blueprint_id in blueprints.keys():
-            return [self.blueprint_id, blueprints[self.blueprint_id]]
-        else:
-            blueprint_ids = list(blueprints.keys())
-            blueprint_menu = TerminalMenu(blueprint_ids, title="Select blueprint:", show_search_hint=True)
-            blueprint_index = blueprint_menu.show()
-            blueprint_id = blueprint_ids[blueprint_index]
-            return [blueprint_id, blueprints[blueprint_id]]
+        matches = None
+        if self.blueprint_id is not None:
+            blueprint = registry.get(self.blueprint_id)
+            if blueprint is not None:
+                return [self.blueprint_id, blueprint]
+
+            # pre-filter selection using partial blueprint identifier..
+            matches = registry.search(self.blueprint_id)
+            if len(matches) == 1:
+                return list(matches[0])
+
+        from simple_term_menu import TerminalMenu
+
+        blueprint_ids = [match[0] for match in matches] if matches else registry.ids()
+        blueprint_menu = TerminalMenu(blueprint_ids, title="Select blueprint:", show_search_hint=True)
+        blueprint_index = blueprint_menu.show()
+        blueprint_id = blueprint_ids[blueprint_index]
+        return [blueprint_id, registry.get(blueprint_id)]
 
     def get_backend_type(self):
+        from .backend import BackendSpec
+
         backends = BackendSpec.tf_backends
 
         if self.backend in backends:
             return self.backend
         else:
+            from simple_term_menu import TerminalMenu
+
             backend_menu = TerminalMenu(backends, show_search_hint=True)
             backend_index = backend_menu.show()
 
             return backends[backend_index]
 
     def terraform(self, args, var_file=None):
+        from .terraform import TerraformSpec
+
         spec = TerraformSpec(None, None, pull_image=self.pull_image, dry_run=self.dryrun, verbose=self.verbose)
         blueprint_home = BlueprintSpec.get_blueprint_home()
         blueprint = self.get_blueprint()
@@ -113,9 +233,19 @@ class BedrockCli(object):
         spec.image_registry = BlueprintSpec.get_blueprint_registry()
         spec.image_tag = BlueprintSpec.get_blueprint_tag()
         spec.var_file = var_file
+        spec.role_arn = blueprint[1].get('role_arn')
+        spec.workspace_roles = blueprint[1].get('workspace_roles') or {}
+        spec.resources = blueprint[1].get('resources', {})
+        spec.engine = self.engine
+        spec.record_log = self.record_log
+
+        if self.plan_cache:
+            from .plans import PlanCache
 
-        # instance_name = input("Instance name: ")
-        spec.instance_name = 'tf_run'
+            spec.plan_cache = PlanCache()
+
+        # instance name is generated per run (see utils.container_name)..
+        spec.instance_name = None
 
         # spec.command = f"workspace new {spec.instance_name}"
         spec.args = args
@@ -124,7 +254,29 @@ class BedrockCli(object):
         # else:
         #     spec.command = ' '.join(args)
 
-        spec.run()
+        output = self.output or ('tty' if sys.stdin.isatty() and sys.stdout.isatty() else 'stream')
+        spec.tty = output == 'tty'
+        if not spec.tty:
+            spec.output_format = output
+            spec.output_file = sys.stdout
+
+        # write status messages to stderr, such that stdout contains only JSON lines..
+        pool = None
+        if spec.engine == 'docker' and not self.dryrun:
+            from .hosts import HostPool
+
+            pool = HostPool.from_env(max_runs=self.jobs, hosts=self.hosts, verbose=self.verbose)
+
+        with contextlib.redirect_stdout(sys.stderr) if output == 'json' else contextlib.nullcontext():
+            if self.workspaces is not None:
+                from .fanout import FanoutSpec
+
+                workspaces = match_workspaces(self.workspaces.split(','),
+                                              list_workspaces(spec.blueprint_id, blueprint_home))
+                return FanoutSpec(spec, workspaces, max_workers=self.jobs, dry_run=self.dryrun,
+                                  verbose=self.verbose, pool=pool).run()
+
+            return spec.run() if pool is None else pool.run(spec)
 
     def backend(self, args):
         parser = argparse.ArgumentParser(description='', usage='backend [<args>]')
@@ -133,6 +285,11 @@ class BedrockCli(object):
         parser.add_argument('--organization', metavar='organization>',
                             help='optional organization identifier (for remote storage via Terraform Cloud)')
 
+        if len(args) > 0 and args[0] == 'apply':
+            return self.backend_apply(args[1:])
+
+        from .backend import BackendSpec
+
         spec = BackendSpec(None, dry_run=self.dryrun, verbose=self.verbose)
         blueprint_home = BlueprintSpec.get_blueprint_home()
         spec.blueprint_home = blueprint_home
@@ -146,39 +303,274 @@ class BedrockCli(object):
 
         spec.run()
 
+    def backend_apply(self, args):
+        parser = argparse.ArgumentParser(description='', usage='backend apply --policy <policy_file> [--all] [<args>]')
+        parser.add_argument('--policy', metavar='<policy_file>', required=True,
+                            help='backend policy (YAML or JSON) of default backend settings and per-blueprint rules')
+        parser.add_argument('--all', action='store_true',
+                            help='configure all registered blueprints (or those matching -t <pattern>)')
+        parser.add_argument('--no-migrate', action='store_true',
+                            help='only write backend configuration (skip state migration)')
+        apply_args, _ = parser.parse_known_args(args)
+
+        import fnmatch
+        from .backend import BackendApplySpec
+
+        blueprints = BlueprintRegistry(defaults=BlueprintSpec.default_blueprints).all()
+        if apply_args.all:
+            blueprint_ids = [blueprint_id for blueprint_id in blueprints
+                             if self.blueprint_id is None or fnmatch.fnmatch(blueprint_id, self.blueprint_id)]
+        else:
+            blueprint_ids = [self.get_blueprint()[0]]
+
+        spec = BackendApplySpec(apply_args.policy, blueprint_ids, max_workers=self.jobs, dry_run=self.dryrun,
+                                verbose=self.verbose)
+        spec.blueprint_home = BlueprintSpec.get_blueprint_home()
+        spec.blueprints = blueprints
+        spec.migrate = not apply_args.no_migrate
+
+        return spec.run()
+
     def config(self, args):
+        from .config import ConfigSpec
+
         spec = ConfigSpec(None, dry_run=self.dryrun, verbose=self.verbose)
         blueprint_home = BlueprintSpec.get_blueprint_home()
         spec.blueprint_home = blueprint_home
-        spec.blueprint_id = self.get_blueprint()[0]
+        blueprint = self.get_blueprint()
+        spec.blueprint_id = blueprint[0]
+        spec.image = blueprint[1]['image']
+        spec.image_registry = BlueprintSpec.get_blueprint_registry()
+        spec.image_tag = BlueprintSpec.get_blueprint_tag()
+        parser = argparse.ArgumentParser(description='',
+                                         usage='config [--from-file <file>] [--unset <key>] [<key>=<value> ...]')
+        parser.add_argument('--from-file', action='append', default=[], help='merge variables from a JSON file')
+        parser.add_argument('--unset', action='append', default=[], help='remove a variable')
+        # global options (e.g. -t <blueprint_id>) are parsed by the top-level parser..
+        config_args, cvars = parser.parse_known_args(strip_args(args, GLOBAL_OPTIONS, GLOBAL_FLAGS))
+
+        spec.from_files = config_args.from_file
+        spec.unset = config_args.unset
         spec.cvars = {}
-        for cnf in args:
-            cvar = cnf.split('=')
-            spec.cvars[cvar[0]] = cvar[1]
+        for cnf in cvars:
+            key, separator, value = cnf.partition('=')
+            if not separator or not key or key.startswith('-'):
+                print(f"{ANSIColors.FAIL}Invalid variable: {cnf} (expected <key>=<value>){ANSIColors.ENDC}")
+                return 1
+            spec.cvars[key] = value
 
-        spec.run()
+        return spec.run()
 
     def blueprint(self, args):
         spec = BlueprintSpec(None, None, dry_run=self.dryrun, verbose=self.verbose)
         if len(args) > 0 and args[0] == 'add':
             spec.blueprint_id = input("Blueprint ID: ")
             spec.blueprint_image = input("Blueprint Image: ")
-
-        spec.run()
+        elif len(args) > 0 and args[0] == 'pull':
+            parser = argparse.ArgumentParser(description='', usage='blueprint pull [--all] [<args>]')
+            parser.add_argument('--all', action='store_true', help='pull all registered blueprint images')
+            pull_args, _ = parser.parse_known_args(args[1:])
+
+            spec.pull = True
+            spec.max_workers = self.jobs
+            if not pull_args.all:
+                blueprint = self.get_blueprint()
+                spec.blueprint_id = blueprint[0]
+                spec.blueprint_image = blueprint[1]['image']
+        elif len(args) > 0 and args[0] == 'sync':
+            parser = argparse.ArgumentParser(description='', usage='blueprint sync [<args>]')
+            parser.add_argument('--registry', metavar='<registry>',
+                                help='registry to synchronise (defaults to BLUEPRINT_REGISTRY)')
+            parser.add_argument('--prefix', metavar='<prefix>', help='synchronise only repositories with prefix')
+            sync_args, _ = parser.parse_known_args(args[1:])
+
+            spec.sync = True
+            spec.registry = sync_args.registry
+            spec.prefix = sync_args.prefix
+            spec.max_workers = self.jobs
+
+        return spec.run()
 
     def export(self, args):
-        spec = ExportSpec(None, None, pull_image=self.pull_image, dry_run=self.dryrun, verbose=self.verbose)
-        blueprint_home = BlueprintSpec.get_blueprint_home()
-        blueprint = self.get_blueprint()
-        spec.blueprint_home = blueprint_home
-        spec.blueprint_id = blueprint[0]
-        spec.image = blueprint[1]['image']
-        spec.image_registry = BlueprintSpec.get_blueprint_registry()
-        spec.image_tag = BlueprintSpec.get_blueprint_tag()
+        parser = argparse.ArgumentParser(description='', usage='export [--all] [<args>]')
+        parser.add_argument('--all', action='store_true', help='export all registered blueprints')
+        export_args, _ = parser.parse_known_args(args)
 
-        spec.instance_name = 'tf_export'
+        from .export import ExportSpec
 
-        spec.run()
+        if export_args.all:
+            blueprints = BlueprintRegistry(defaults=BlueprintSpec.default_blueprints).all()
+        else:
+            blueprint = self.get_blueprint()
+            blueprints = {blueprint[0]: blueprint[1]}
+
+        client = None
+        if not self.dryrun and len(blueprints) > 1:
+            import docker
+
+            # share a single client (and connection pool) between exports..
+            client = docker.from_env(max_pool_size=self.jobs)
+
+        def export_blueprint(blueprint_id):
+            spec = ExportSpec(blueprint_id, None, pull_image=self.pull_image, dry_run=self.dryrun, verbose=self.verbose)
+            spec.blueprint_home = BlueprintSpec.get_blueprint_home()
+            spec.image = blueprints[blueprint_id]['image']
+            spec.image_registry = BlueprintSpec.get_blueprint_registry()
+            spec.image_tag = BlueprintSpec.get_blueprint_tag()
+            spec.client = client
+
+            start = time.monotonic()
+            try:
+                exit_code = spec.run()
+            except Exception as e:
+                # report a failed export, rather than aborting other exports..
+                print(f"[{blueprint_id}] {ANSIColors.FAIL}{e}{ANSIColors.ENDC}")
+                exit_code = 1
+            return blueprint_id, exit_code, time.monotonic() - start
+
+        from .fanout import print_summary, worker_pool
+
+        try:
+            with worker_pool(max(1, self.jobs)) as executor:
+                results = list(executor.map(export_blueprint, blueprints.keys()))
+        except KeyboardInterrupt:
+            return 130
+
+        if len(results) > 1:
+            print_summary(results, title='BLUEPRINT')
+
+        return next((exit_code for _, exit_code, _ in results if exit_code != 0), 0)
+
+    def cache(self, args):
+        parser = argparse.ArgumentParser(description='', usage='cache [stats|prune] [<args>]')
+        parser.add_argument('cache_command', nargs='?', choices=['stats', 'prune'], default='stats')
+        parser.add_argument('--max-size', metavar='<max_size>', type=int,
+                            help='maximum plugin cache size in MB (overrides BEDROCK_PLUGIN_CACHE_SIZE)')
+        cache_args, _ = parser.parse_known_args(args)
+
+        from .cache import CacheSpec
+
+        spec = CacheSpec(cache_args.cache_command, max_size=cache_args.max_size, dry_run=self.dryrun,
+                         verbose=self.verbose)
+
+        return spec.run()
+
+    def run(self, args):
+        parser = argparse.ArgumentParser(description='', usage='run <manifest> [<args>]')
+        parser.add_argument('manifest', metavar='<manifest>', help='location of manifest file')
+        parser.add_argument('--resume', action='store_true', help='skip steps completed in the previous run')
+        run_args, _ = parser.parse_known_args(args)
+
+        from .manifest import ManifestSpec
+
+        spec = ManifestSpec(run_args.manifest, max_workers=self.jobs, resume=run_args.resume, dry_run=self.dryrun,
+                            verbose=self.verbose)
+        spec.blueprint_home = BlueprintSpec.get_blueprint_home()
+
+        return spec.run()
+
+    def gc(self, args):
+        parser = argparse.ArgumentParser(description='', usage='gc [<args>]')
+        parser.add_argument('--force', action='store_true', help='also remove running blueprint containers')
+        gc_args, _ = parser.parse_known_args(args)
+
+        from .gc import GcSpec
+
+        spec = GcSpec(force=gc_args.force, dry_run=self.dryrun, verbose=self.verbose)
+
+        return spec.run()
+
+    def inventory(self, args):
+        parser = argparse.ArgumentParser(description='', usage='inventory [<query>] [<args>]')
+        parser.add_argument('query', metavar='<query>', nargs='?',
+                            help='resource address (or output name) substring or glob pattern')
+        parser.add_argument('--type', metavar='<type>', help='filter resources by type (e.g. aws_s3_bucket)')
+        parser.add_argument('--outputs', action='store_true', help='find outputs instead of resources')
+        parser.add_argument('--cached', action='store_true', help='query the index without checking for state changes')
+        parser.add_argument('--json', action='store_true', help='output results as JSON lines')
+        inventory_args, _ = parser.parse_known_args(args)
+
+        from .inventory import InventorySpec
+
+        spec = InventorySpec(BlueprintSpec.get_blueprint_home(), max_workers=self.jobs, dry_run=self.dryrun,
+                             verbose=self.verbose)
+        spec.query = inventory_args.query
+        spec.resource_type = inventory_args.type
+        spec.outputs = inventory_args.outputs
+        spec.refresh = not inventory_args.cached
+        spec.json_output = inventory_args.json
+
+        return spec.run()
+
+    def history(self, args):
+        parser = argparse.ArgumentParser(description='', usage='history [<args>]')
+        parser.add_argument('--workspace', '-w', metavar='<workspace>', help='filter by workspace (or glob pattern)')
+        parser.add_argument('--command', '-c', metavar='<command>', help='filter by command (e.g. plan, apply, export)')
+        parser.add_argument('--since', metavar='<period>', help='only include runs within a period (e.g. 30m, 12h, 7d)')
+        parser.add_argument('--failed', action='store_true', help='only list failed runs')
+        parser.add_argument('--limit', metavar='<limit>', type=int, default=20,
+                            help='maximum number of runs listed (default: 20)')
+        parser.add_argument('--stats', metavar='<group>', nargs='?', const='blueprint',
+                            choices=['blueprint', 'workspace', 'command', 'kind', 'engine', 'host'],
+                            help='aggregate durations (count, mean, p50, p95, max) by group (default: blueprint)')
+        parser.add_argument('--log', metavar='<run_id>', type=int, help='print the recorded log of a run')
+        parser.add_argument('--compact', action='store_true', help='remove runs older than the retention period')
+        parser.add_argument('--retention', metavar='<days>', type=int,
+                            help='retention period in days (default: BEDROCK_LEDGER_RETENTION, or 90)')
+        parser.add_argument('--json', action='store_true', help='output results as JSON lines')
+        history_args, _ = parser.parse_known_args(args)
+
+        from .ledger import HistorySpec
+
+        spec = HistorySpec(dry_run=self.dryrun, verbose=self.verbose)
+        # filter by blueprint identifier (or glob pattern) with -t..
+        spec.blueprint_id = self.blueprint_id
+        spec.workspace = history_args.workspace
+        spec.command = history_args.command
+        spec.since = history_args.since
+        spec.failed = history_args.failed
+        spec.limit = history_args.limit
+        spec.stats = history_args.stats
+        spec.log_id = history_args.log
+        spec.compact = history_args.compact
+        spec.retention_days = history_args.retention
+        spec.json_output = history_args.json
+
+        return spec.run()
+
+    def drift(self, args):
+        parser = argparse.ArgumentParser(description='', usage='drift [serve|status] [<args>]')
+        parser.add_argument('drift_command', nargs='?', choices=['serve', 'status'], default='status')
+        parser.add_argument('--interval', metavar='<period>',
+                            help='time between checks of each workspace, e.g. 30m, 6h (default: '
+                                 'BEDROCK_DRIFT_INTERVAL, or 6h)')
+        parser.add_argument('--jitter', metavar='<fraction>', type=float,
+                            help='random offset of checks as a fraction of the interval (default: 0.1)')
+        parser.add_argument('--rate', metavar='<rate>', type=int,
+                            help='maximum checks started per backend per minute (default: BEDROCK_DRIFT_RATE, or 10)')
+        parser.add_argument('--once', action='store_true', help='check each workspace once, then exit')
+        parser.add_argument('--drifted', action='store_true', help='only report drifted workspaces')
+        parser.add_argument('--json', action='store_true', help='output status as JSON lines')
+        drift_args, _ = parser.parse_known_args(args)
+
+        from .drift import DriftSpec
+
+        spec = DriftSpec(drift_args.drift_command, BlueprintSpec.get_blueprint_home(), max_workers=self.jobs,
+                         dry_run=self.dryrun, verbose=self.verbose)
+        # filter by blueprint identifier (or glob pattern) with -t, and workspaces with --workspaces..
+        spec.blueprint_pattern = self.blueprint_id
+        spec.workspace_patterns = self.workspaces.split(',') if self.workspaces is not None else None
+        if drift_args.interval is not None:
+            spec.interval = drift_args.interval
+        if drift_args.jitter is not None:
+            spec.jitter = drift_args.jitter
+        if drift_args.rate is not None:
+            spec.backend_rate = drift_args.rate
+        spec.once = drift_args.once
+        spec.drifted_only = drift_args.drifted
+        spec.json_output = drift_args.json
+
+        return spec.run()
 
 
 if __name__ == "__main__":
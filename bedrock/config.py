@@ -1,4 +1,7 @@
+from .images import image_name
+from .profile import span, traced
 from .utils import *
+from .variables import SchemaCache, validate_variables
 
 
 class ConfigSpec:
@@ -20,14 +23,79 @@ class ConfigSpec:
         # Command-line variables
         self.cvars = {}
 
+        # Variables to remove from existing config
+        self.unset = []
+
+        # Variable files (JSON) merged before command-line variables
+        self.from_files = []
+
+        # Blueprint image (variables are validated against the variables it declares, if specified and cached)
+        self.image = None
+        self.image_tag = None
+        self.image_registry = None
+
+        # Validate variables before writing (disabled with BEDROCK_VALIDATE_VARIABLES=0)
+        self.validate_variables = os.environ.get('BEDROCK_VALIDATE_VARIABLES') != '0'
+
+    def config_patch(self):
+        """
+        Combine variable files, command-line variables and removed variables into a single merge patch. Raises
+        ValueError if a variable file can't be read.
+        """
+        patch = {}
+        for from_file in self.from_files:
+            try:
+                with open(from_file, 'r') as f:
+                    variables = json.load(f)
+            except IOError as e:
+                raise ValueError(f"Unable to read variable file: {from_file} ({e.strerror})") from e
+            except ValueError as e:
+                raise ValueError(f"Invalid variable file: {from_file} ({e})") from e
+            if not isinstance(variables, dict):
+                raise ValueError(f"Invalid variable file (expected a JSON object): {from_file}")
+            patch.update(variables)
+        patch.update(self.cvars)
+        for key in self.unset:
+            patch[key] = None
+        return patch
+
+    @traced('config')
     def run(self):
         if self.dry_run:
             print("Dry run enabled. No changes will be made.")
 
+        with span('config.read'):
+            try:
+                patch = self.config_patch()
+            except ValueError as e:
+                print(f"{ANSIColors.FAIL}{e}{ANSIColors.ENDC}")
+                return 1
+
+        if self.validate_variables and self.image is not None:
+            # only a cached schema is used, such that config never requires a Docker daemon (or a container)..
+            image_ref = f"{image_name(self.image, self.image_registry)}:{self.image_tag or 'latest'}"
+            with span('config.validate'):
+                schema = SchemaCache().cached(image_ref)
+            if schema is None:
+                print(f"Variables not validated: blueprint variables are read on the first plan or apply ({image_ref})")
+            else:
+                try:
+                    # only changed variables are checked (required variables may be set later)..
+                    validate_variables(schema, [('config', {key: value for key, value in patch.items()
+                                                            if value is not None}, False)], check_required=False)
+                except ValueError as e:
+                    print(f"{ANSIColors.FAIL}Invalid variables:\n{e}{ANSIColors.ENDC}")
+                    return 1
+
         if not self.dry_run:
             workspace = current_workspace(self.blueprint_id, self.blueprint_home)
 
             if self.verbose:
                 print(f"Writing config changes to: {self.blueprint_home}/{self.blueprint_id}/{workspace}.tfvars.json\n")
 
-            write_config(self.blueprint_id, self.blueprint_home, workspace, self.cvars)
+            with span('config.write', keys=len(patch)):
+                write_config(self.blueprint_id, self.blueprint_home, workspace, patch)
+        elif self.verbose:
+            print(json.dumps(patch, indent=2))
+
+        return 0
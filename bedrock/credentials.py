@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""
+Assume AWS roles for blueprint runs, caching temporary credentials such that concurrent runs share a single session.
+"""
+import datetime
+import hashlib
+import time
+
+from .storage import atomic_write, locked, read_json
+from .utils import *
+
+# Default duration of assumed role sessions (in seconds)
+DEFAULT_ROLE_DURATION = 3600
+
+# Time before expiry (in seconds) at which cached credentials are refreshed
+DEFAULT_REFRESH_MARGIN = 300
+
+# Environment variables replaced by assumed role credentials
+CREDENTIAL_VARS = ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN', 'AWS_PROFILE']
+
+
+class CredentialCache:
+    """
+    Temporary credentials are cached (per role, session name and source identity) under ~/.bedrock/credentials, and
+    refreshed ahead of expiry. Refresh is serialised with a lock file, such that concurrent processes requiring the
+    same role make a single STS request.
+    """
+
+    def __init__(self, root='~/.bedrock', refresh_margin=None, sts_client=None):
+        # Location of cached credentials
+        self.path = os.path.expanduser(f'{root}/credentials')
+
+        # Time before expiry (in seconds) at which credentials are refreshed
+        if refresh_margin is None:
+            refresh_margin = int(os.environ.get('BEDROCK_CREDENTIAL_REFRESH', DEFAULT_REFRESH_MARGIN))
+        self.refresh_margin = refresh_margin
+
+        # STS client factory (defaults to boto3, with an optional endpoint override via BEDROCK_STS_ENDPOINT)
+        self.sts_client = sts_client
+
+        # Number of STS requests made
+        self.requests = 0
+
+    def cache_path(self, role_arn, session_name):
+        # source identity is included, such that credentials are never shared between different source profiles..
+        key = '\n'.join([role_arn, session_name, os.environ.get('AWS_PROFILE', ''),
+                         os.environ.get('AWS_ACCESS_KEY_ID', '')])
+        return f'{self.path}/{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}.json'
+
+    def valid(self, credentials):
+        return bool(credentials) and credentials.get('Expiration', 0) - time.time() > self.refresh_margin
+
+    def get(self, role_arn, session_name='bedrock', duration=DEFAULT_ROLE_DURATION, external_id=None):
+        """
+        Return credentials (AccessKeyId, SecretAccessKey, SessionToken and Expiration as a UNIX timestamp) for a role,
+        assuming the role only if no cached credentials are valid.
+        """
+        path = self.cache_path(role_arn, session_name)
+        credentials = read_json(path)
+        if self.valid(credentials):
+            return credentials
+
+        with locked(path):
+            # credentials may have been refreshed by a concurrent process while waiting for the lock..
+            credentials = read_json(path)
+            if not self.valid(credentials):
+                credentials = self.assume_role(role_arn, session_name, duration, external_id)
+                atomic_write(path, json.dumps(credentials), mode=0o600)
+        return credentials
+
+    def assume_role(self, role_arn, session_name, duration, external_id=None):
+        if self.sts_client is not None:
+            sts = self.sts_client()
+        else:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("Role assumption requires boto3 (pip install boto3)")
+            sts = boto3.client('sts', endpoint_url=os.environ.get('BEDROCK_STS_ENDPOINT'))
+
+        params = {'RoleArn': role_arn, 'RoleSessionName': session_name, 'DurationSeconds': duration}
+        if external_id is not None:
+            params['ExternalId'] = external_id
+        self.requests += 1
+        credentials = sts.assume_role(**params)['Credentials']
+
+        expiration = credentials['Expiration']
+        if isinstance(expiration, str):
+            expiration = datetime.datetime.fromisoformat(expiration.replace('Z', '+00:00'))
+        return {
+            'AccessKeyId': credentials['AccessKeyId'],
+            'SecretAccessKey': credentials['SecretAccessKey'],
+            'SessionToken': credentials['SessionToken'],
+            'Expiration': expiration.timestamp() if isinstance(expiration, datetime.datetime) else expiration,
+        }
+
+
+def role_for(workspace, role_arn=None, workspace_roles=None):
+    """
+    Return the role to assume for a workspace (BEDROCK_ROLE_ARN, a workspace-specific role, or the default role), or
+    None if no role is configured.
+    """
+    if os.environ.get('BEDROCK_ROLE_ARN'):
+        return os.environ['BEDROCK_ROLE_ARN']
+    return (workspace_roles or {}).get(workspace) or role_arn
+
+
+def role_environment(environment, credentials):
+    """
+    Replace credential environment variables with assumed role credentials.
+    """
+    environment[:] = [env for env in environment if env.split('=', 1)[0] not in CREDENTIAL_VARS]
+    environment += [f"AWS_ACCESS_KEY_ID={credentials['AccessKeyId']}",
+                    f"AWS_SECRET_ACCESS_KEY={credentials['SecretAccessKey']}",
+                    f"AWS_SESSION_TOKEN={credentials['SessionToken']}"]
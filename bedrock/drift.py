@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+
+"""
+Detect drift between blueprint configuration and infrastructure with scheduled plans across blueprint workspaces.
+"""
+import asyncio
+import io
+import random
+import signal
+import sqlite3
+import time
+
+from .fanout import worker_pool
+from .ledger import parse_period
+from .registry import BlueprintRegistry
+from .utils import *
+
+# Default time (in seconds) between checks of a workspace
+DEFAULT_INTERVAL = 6 * 3600
+
+# Default fraction of the interval by which checks are randomly offset (spreading checks of many workspaces)
+DEFAULT_JITTER = 0.1
+
+# Default maximum number of plans started per backend (e.g. S3 bucket) per minute
+DEFAULT_BACKEND_RATE = 10
+
+# Default number of checks retained per workspace
+DEFAULT_HISTORY = 100
+
+# Plan arguments of a check (state isn't locked, as plans are read-only)
+CHECK_ARGS = ['plan', '-detailed-exitcode', '-lock=false', '-input=false']
+
+PLAN_SUMMARY_PATTERN = re.compile(r'Plan: (\d+) to add, (\d+) to change, (\d+) to destroy')
+
+
+class DriftTarget:
+
+    def __init__(self, blueprint_id, workspace, blueprint, backend='local', interval=DEFAULT_INTERVAL):
+        # Blueprint identifier and workspace checked
+        self.blueprint_id = blueprint_id
+        self.workspace = workspace
+
+        # Registry entry of the blueprint
+        self.blueprint = blueprint
+
+        # State backend (plans against the same backend are rate limited)
+        self.backend = backend
+
+        # Time (in seconds) between checks
+        self.interval = interval
+
+    @property
+    def key(self):
+        return self.blueprint_id, self.workspace
+
+
+def backend_key(blueprint_id, blueprint_home):
+    """
+    Identify the state backend of a blueprint by type and location (e.g. s3:<bucket>, remote:<organization>).
+    """
+    try:
+        with open(f'{os.path.expanduser(f"{blueprint_home}/{blueprint_id}")}/backend.tf', 'r') as backend_file:
+            content = backend_file.read()
+    except IOError:
+        return 'local'
+    match = re.search(r'^\s*backend\s+"([^"]+)"', content, re.MULTILINE)
+    if match is None:
+        return 'local'
+    for attribute in ['bucket', 'organization', 'storage_account_name', 'address']:
+        location = re.search(rf'^\s*{attribute}\s*=\s*"([^"]*)"', content, re.MULTILINE)
+        if location is not None:
+            return f'{match.group(1)}:{location.group(1)}'
+    return match.group(1)
+
+
+def find_targets(blueprint_home, blueprints, blueprint_pattern=None, workspace_patterns=None,
+                 interval=DEFAULT_INTERVAL):
+    """
+    Find workspaces of initialised blueprints (i.e. with a backend.tf) to check. Blueprints may override the interval
+    ("drift": {"interval": "1h"}), or be excluded ("drift": false).
+    """
+    targets = []
+    for blueprint_id, blueprint in sorted(blueprints.items()):
+        if blueprint_pattern is not None and not fnmatch.fnmatch(blueprint_id, blueprint_pattern):
+            continue
+        drift = blueprint.get('drift', {})
+        if drift is True:
+            drift = {}
+        elif drift is not False and not isinstance(drift, dict):
+            raise ValueError(f"Invalid drift configuration for {blueprint_id}: {json.dumps(drift)} (expected true, "
+                             f"false or an object)")
+        if drift is False or not os.path.isfile(os.path.expanduser(f'{blueprint_home}/{blueprint_id}/backend.tf')):
+            continue
+
+        workspaces = list_workspaces(blueprint_id, blueprint_home)
+        if workspace_patterns is not None:
+            workspaces = [ws for ws in match_workspaces(workspace_patterns, workspaces) if ws in workspaces]
+        backend = backend_key(blueprint_id, blueprint_home)
+        target_interval = parse_period(drift['interval']) if 'interval' in drift else interval
+        targets += [DriftTarget(blueprint_id, workspace, blueprint, backend, target_interval)
+                    for workspace in workspaces]
+    return targets
+
+
+def plan_summary(output):
+    """
+    Return the number of resources to add, change and destroy reported by a plan, or None if not reported.
+    """
+    match = PLAN_SUMMARY_PATTERN.search(output)
+    return tuple(int(count) for count in match.groups()) if match else None
+
+
+def check_status(exit_code):
+    """
+    Return the status of a check by exit code (i.e. plan -detailed-exitcode: 0 in sync, 2 drifted, otherwise failed).
+    """
+    return {0: 'in-sync', 2: 'drifted'}.get(exit_code, 'failed')
+
+
+class DriftStore:
+    """
+    Results of drift checks. The latest result of each workspace is kept in a status table (such that status is
+    reported without scanning history), with a bounded history of checks per workspace.
+    """
+
+    def __init__(self, root='~/.bedrock', history_size=None):
+        # Location of the store
+        self.path = os.path.expanduser(f'{root}/drift.db')
+
+        # Number of checks retained per workspace
+        if history_size is None:
+            history_size = int(os.environ.get('BEDROCK_DRIFT_HISTORY', DEFAULT_HISTORY))
+        self.history_size = history_size
+
+        self._db = None
+
+    def db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=5)
+            self._db.executescript('''
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS status (blueprint TEXT, workspace TEXT, checked REAL, status TEXT,
+                                                   exit_code INTEGER, duration REAL, additions INTEGER,
+                                                   changes INTEGER, removals INTEGER, drifted_since REAL,
+                                                   PRIMARY KEY (blueprint, workspace));
+                CREATE TABLE IF NOT EXISTS checks (id INTEGER PRIMARY KEY AUTOINCREMENT, blueprint TEXT,
+                                                   workspace TEXT, checked REAL, status TEXT, exit_code INTEGER,
+                                                   duration REAL, additions INTEGER, changes INTEGER,
+                                                   removals INTEGER);
+                CREATE INDEX IF NOT EXISTS checks_workspace ON checks (blueprint, workspace, id);
+            ''')
+        return self._db
+
+    def record(self, blueprint_id, workspace, checked, exit_code, duration, summary=None):
+        """
+        Record the result of a check. Returns the status.
+        """
+        status = check_status(exit_code)
+        additions, changes, removals = summary or (None, None, None)
+        db = self.db()
+        with db:
+            previous = db.execute('SELECT status, drifted_since FROM status WHERE blueprint = ? AND workspace = ?',
+                                  (blueprint_id, workspace)).fetchone()
+            drifted_since = None
+            if status == 'drifted':
+                drifted_since = previous[1] if previous is not None and previous[0] == 'drifted' else checked
+            db.execute('INSERT OR REPLACE INTO status VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (blueprint_id, workspace, checked, status, exit_code, duration, additions, changes, removals,
+                        drifted_since))
+            db.execute('INSERT INTO checks (blueprint, workspace, checked, status, exit_code, duration, additions, '
+                       'changes, removals) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (blueprint_id, workspace, checked, status, exit_code, duration, additions, changes, removals))
+            db.execute('DELETE FROM checks WHERE blueprint = ? AND workspace = ? AND id <= (SELECT id FROM checks '
+                       'WHERE blueprint = ? AND workspace = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                       (blueprint_id, workspace, blueprint_id, workspace, self.history_size))
+        return status
+
+    def status(self, blueprint_id=None, workspace=None, status=None):
+        """
+        Return the latest result of each checked workspace matching the filters (blueprint and workspace may be glob
+        patterns), as dicts.
+        """
+        clauses, params = [], []
+        for column, value in [('blueprint', blueprint_id), ('workspace', workspace), ('status', status)]:
+            if value is not None:
+                clauses.append(f'{column} GLOB ?')
+                params.append(value)
+        sql = 'SELECT * FROM status' + (' WHERE ' + ' AND '.join(clauses) if clauses else '')
+        cursor = self.db().execute(sql + ' ORDER BY blueprint, workspace', params)
+        keys = [column[0] for column in cursor.description]
+        return [dict(zip(keys, row)) for row in cursor]
+
+    def checks(self, blueprint_id, workspace, limit=None):
+        """
+        Return the history of checks of a workspace (most recent first), as dicts.
+        """
+        sql = 'SELECT * FROM checks WHERE blueprint = ? AND workspace = ? ORDER BY id DESC'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        cursor = self.db().execute(sql, (blueprint_id, workspace))
+        keys = [column[0] for column in cursor.description]
+        return [dict(zip(keys, row)) for row in cursor]
+
+    def last_checked(self):
+        """
+        Return the time of the latest check of each workspace, keyed by (blueprint, workspace).
+        """
+        return {(blueprint_id, workspace): checked for blueprint_id, workspace, checked in
+                self.db().execute('SELECT blueprint, workspace, checked FROM status')}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class RateLimiter:
+    """
+    Limit the rate at which operations start, allowing bursts of up to `rate` operations per period (token bucket).
+    """
+
+    def __init__(self, rate, period=60):
+        self.rate = rate
+        self.period = period
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.period)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.period / self.rate)
+
+
+class DriftScheduler:
+    """
+    Checks are scheduled an interval after the previous check of each workspace (offset by random jitter, such that
+    checks of many workspaces don't coincide), limited by a global concurrency cap and a maximum rate of checks per
+    state backend. Checks are run in worker threads, and results recorded in the store.
+    """
+
+    def __init__(self, targets, store, check, max_concurrency=4, backend_rate=DEFAULT_BACKEND_RATE,
+                 jitter=DEFAULT_JITTER):
+        # Workspaces to check
+        self.targets = targets
+
+        # Store of check results
+        self.store = store
+
+        # Check a target, returning (exit code, plan summary)
+        self.check = check
+
+        # Maximum number of concurrent checks, and checks started per backend per minute
+        self.max_concurrency = max_concurrency
+        self.backend_rate = backend_rate
+
+        # Fraction of the interval by which checks are randomly offset
+        self.jitter = jitter
+
+        self._stop = None
+
+    def next_check(self, target, last_checked=None):
+        """
+        Return the time of the next check of a target (initial checks are spread across the jitter window).
+        """
+        spread = target.interval * self.jitter
+        if last_checked is None:
+            return time.time() + random.uniform(0, spread)
+        return last_checked + target.interval + random.uniform(-spread, spread)
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    async def serve(self, once=False):
+        """
+        Run checks until stopped (or until each target has been checked once). Returns the number of checks run.
+        """
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        limiters = {}
+        last_checked = {} if once else self.store.last_checked()
+        due = {target.key: time.time() if once else self.next_check(target, last_checked.get(target.key))
+               for target in self.targets}
+        running = {}
+        checked = 0
+
+        async def run(target, executor):
+            nonlocal checked
+            started = time.time()
+            try:
+                await limiters.setdefault(target.backend, RateLimiter(self.backend_rate)).acquire()
+                async with semaphore:
+                    if self._stop.is_set():
+                        return
+                    started = time.time()
+                    start = time.perf_counter()
+                    try:
+                        exit_code, summary = await loop.run_in_executor(executor, self.check, target)
+                    except Exception as e:
+                        print(f"[{target.blueprint_id}:{target.workspace}] {ANSIColors.FAIL}{e}{ANSIColors.ENDC}")
+                        exit_code, summary = 1, None
+                    duration = time.perf_counter() - start
+                    try:
+                        status = self.store.record(target.blueprint_id, target.workspace, started, exit_code,
+                                                   duration, summary)
+                    except sqlite3.Error as e:
+                        # e.g. the store is locked by a long-running status query..
+                        print(f"[{target.blueprint_id}:{target.workspace}] {ANSIColors.FAIL}Failed to record check: "
+                              f"{e}{ANSIColors.ENDC}")
+                        status = check_status(exit_code)
+                    checked += 1
+                    print(f"[{target.blueprint_id}:{target.workspace}] {status}"
+                          f"{' (+%d ~%d -%d)' % summary if summary else ''} in {duration:.1f}s")
+            finally:
+                due[target.key] = None if once else self.next_check(target, started)
+
+        # running checks are stopped when interrupted (rather than waiting for them to complete)..
+        with worker_pool(max(1, self.max_concurrency)) as executor:
+            try:
+                while not self._stop.is_set():
+                    now = time.time()
+                    for target in self.targets:
+                        if target.key not in running and due[target.key] is not None and due[target.key] <= now:
+                            running[target.key] = asyncio.ensure_future(run(target, executor))
+
+                    if once and not running:
+                        break
+
+                    pending = [due[target.key] for target in self.targets
+                               if target.key not in running and due[target.key] is not None]
+                    timeout = max(0.0, min(pending) - now) if pending else None
+                    stop_wait = asyncio.ensure_future(self._stop.wait())
+                    await asyncio.wait(list(running.values()) + [stop_wait], timeout=timeout,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    stop_wait.cancel()
+                    for key in [key for key, task in running.items() if task.done()]:
+                        running.pop(key).result()
+
+                if running:
+                    print(f"Stopping drift detection, waiting for {len(running)} running checks..")
+                    await asyncio.gather(*running.values())
+            except asyncio.CancelledError:
+                # asyncio.run() cancels the scheduler when interrupted (rather than raising KeyboardInterrupt)..
+                raise KeyboardInterrupt
+
+        return checked
+
+
+class DriftSpec:
+
+    def __init__(self, command, blueprint_home, max_workers=4, dry_run=False, verbose=False):
+        # Drift command (i.e. serve, status)
+        self.command = command
+
+        # Blueprint home directory
+        self.blueprint_home = blueprint_home
+
+        # Maximum number of concurrent checks
+        self.max_workers = max_workers
+
+        # Enable dry run (list scheduled workspaces without checking)
+        self.dry_run = dry_run
+
+        # Enable verbose logging
+        self.verbose = verbose
+
+        # Filters (blueprint may be a glob pattern, workspaces are names or glob patterns)
+        self.blueprint_pattern = None
+        self.workspace_patterns = None
+
+        # Time between checks of each workspace (e.g. 30m, 6h), and random offset as a fraction of the interval
+        self.interval = os.environ.get('BEDROCK_DRIFT_INTERVAL', f'{DEFAULT_INTERVAL}s')
+        self.jitter = DEFAULT_JITTER
+
+        # Maximum number of checks started per backend per minute
+        self.backend_rate = int(os.environ.get('BEDROCK_DRIFT_RATE', DEFAULT_BACKEND_RATE))
+
+        # Check each workspace once, then exit
+        self.once = False
+
+        # Only report drifted workspaces
+        self.drifted_only = False
+
+        # Output status as JSON lines
+        self.json_output = False
+
+        # Docker client (shared across checks) and cache of assumed role credentials
+        self.client = None
+        self.credential_cache = None
+
+    def check(self, target):
+        """
+        Plan a workspace, returning the exit code (0 in sync, 2 drifted) and plan summary.
+        """
+        from .blueprint import BlueprintSpec
+        from .terraform import TerraformSpec
+
+        spec = TerraformSpec(target.blueprint_id, None, verbose=self.verbose)
+        spec.blueprint_home = self.blueprint_home
+        spec.image = target.blueprint['image']
+        spec.image_registry = BlueprintSpec.get_blueprint_registry()
+        spec.image_tag = BlueprintSpec.get_blueprint_tag()
+        spec.role_arn = target.blueprint.get('role_arn')
+        spec.workspace_roles = target.blueprint.get('workspace_roles') or {}
+        spec.resources = target.blueprint.get('resources', {})
+        spec.credential_cache = self.credential_cache
+        spec.workspace = target.workspace
+        spec.args = list(CHECK_ARGS)
+        spec.tty = False
+        spec.output_file = io.StringIO()
+        spec.client = self.client
+        spec.concurrency = self.max_workers
+        spec.capture_outputs = False
+
+        exit_code = spec.run()
+        if spec.ledger is not None:
+            # the daemon runs indefinitely, so runs are written after each check (rather than on exit)..
+            spec.ledger.flush()
+        return exit_code, plan_summary(spec.output_file.getvalue())
+
+    def run(self):
+        try:
+            if self.command == 'status':
+                return self.status()
+            return self.serve()
+        except ValueError as e:
+            print(f"{ANSIColors.FAIL}{e}{ANSIColors.ENDC}")
+            return 1
+
+    def serve(self):
+        from .blueprint import BlueprintSpec
+
+        registry = BlueprintRegistry(defaults=BlueprintSpec.default_blueprints)
+        targets = find_targets(self.blueprint_home, registry.all(), self.blueprint_pattern, self.workspace_patterns,
+                               parse_period(self.interval))
+        if not targets:
+            print("No blueprint workspaces to check.")
+            return 1
+
+        if self.dry_run:
+            print("Dry run enabled. No changes will be made.")
+            for target in targets:
+                print(f"{target.blueprint_id}\t{target.workspace}\t{target.backend}\tevery {target.interval}s")
+            return 0
+
+        print(f"Checking {len(targets)} workspaces for drift ({self.max_workers} concurrent, "
+              f"{self.backend_rate} per backend per minute)\n")
+
+        if self.client is None:
+            import docker
+
+            # share a single client (and connection pool) between checks..
+            self.client = docker.from_env(max_pool_size=self.max_workers)
+        if self.credential_cache is None:
+            from .credentials import CredentialCache
+
+            self.credential_cache = CredentialCache()
+
+        store = DriftStore()
+        scheduler = DriftScheduler(targets, store, self.check, self.max_workers, self.backend_rate, self.jitter)
+
+        async def serve():
+            loop = asyncio.get_running_loop()
+            if self.once:
+                # running checks are stopped when interrupted (the loop's handler wakes it, unlike asyncio.run's)..
+                loop.add_signal_handler(signal.SIGINT, asyncio.current_task().cancel)
+            else:
+                for signum in [signal.SIGINT, signal.SIGTERM]:
+                    loop.add_signal_handler(signum, scheduler.stop)
+            return await scheduler.serve(once=self.once)
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            return 130
+        finally:
+            store.close()
+
+        if self.once:
+            return 2 if any(row['status'] == 'drifted' for row in self.current(store)) else 0
+        return 0
+
+    def current(self, store):
+        return [row for row in store.status(self.blueprint_pattern)
+                if self.workspace_patterns is None or any(fnmatch.fnmatch(row['workspace'], pattern)
+                                                          for pattern in self.workspace_patterns)]
+
+    def status(self):
+        store = DriftStore()
+        try:
+            rows = [row for row in self.current(store) if not self.drifted_only or row['status'] == 'drifted']
+        finally:
+            store.close()
+
+        if not self.json_output:
+            print(f"{'BLUEPRINT':<40} {'WORKSPACE':<20} {'STATUS':<10} {'CHANGES':<14} {'CHECKED':<20}")
+        for row in rows:
+            if self.json_output:
+                print(json.dumps(row))
+                continue
+            changes = f"+{row['additions']} ~{row['changes']} -{row['removals']}" \
+                if row['additions'] is not None else ''
+            color = {'drifted': ANSIColors.WARNING, 'failed': ANSIColors.FAIL}.get(row['status'], '')
+            checked = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['checked']))
+            print(f"{row['blueprint']:<40} {row['workspace']:<20} {color}{row['status']:<10}"
+                  f"{ANSIColors.ENDC if color else ''} {changes:<14} {checked:<20}")
+        return 0
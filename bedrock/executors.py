@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+
+"""
+Execute Terraform commands for a blueprint, either in a Docker container (default) or natively with a host Terraform
+binary against blueprint configuration extracted from the image.
+"""
+import contextlib
+import hashlib
+import itertools
+import selectors
+import shlex
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+
+from .archive import extract_archive
+from .hosts import HostUnavailable, connection_errors
+from .profile import span
+from .storage import locked
+from .stream import stream_container
+from .utils import *
+
+# Default number of extracted blueprint images retained in the cache
+DEFAULT_CACHE_ENTRIES = 20
+
+
+class Execution:
+    """
+    A Terraform command to execute, described in terms of the container layout (i.e. the command runs in /work with
+    configuration in /blueprint, and host paths bound to container paths by volumes).
+    """
+
+    def __init__(self, image, command, name, environment, volumes, labels=None, working_dir='/work', tty=False,
+                 output=None, limits=None):
+        # Blueprint image reference
+        self.image = image
+
+        # Terraform command (excluding the terraform executable)
+        self.command = command
+
+        # Unique instance name
+        self.name = name
+
+        # Environment variables (as NAME=value)
+        self.environment = environment
+
+        # Host paths mapped to container bindings (i.e. {'bind': <path>, 'mode': <mode>})
+        self.volumes = volumes
+
+        # Labels identifying the execution
+        self.labels = labels or {}
+
+        # Working directory (container path)
+        self.working_dir = working_dir
+
+        # Allocate a TTY for interactive execution (otherwise output is streamed)
+        self.tty = tty
+
+        # Output stream for non-TTY execution
+        self.output = output
+
+        # Container resource limits (i.e. create_host_config arguments, such as cpu_quota and mem_limit)
+        self.limits = limits or {}
+
+
+class ActiveRuns:
+    """
+    Containers and processes started by executors in this process. When runs in worker threads are interrupted (i.e.
+    Ctrl-C is received by the main thread), they are stopped such that workers finish (and clean up) promptly, and runs
+    that haven't started yet are aborted.
+    """
+
+    def __init__(self):
+        # Whether runs have been interrupted (until reset)
+        self.interrupted = False
+
+        self._stops = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def track(self, stop):
+        """
+        Track a started container or process until it exits, with a function that stops it. Raises KeyboardInterrupt
+        if runs have been interrupted.
+        """
+        with self._lock:
+            if self.interrupted:
+                raise KeyboardInterrupt
+            key = next(self._ids)
+            self._stops[key] = stop
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._stops[key]
+
+    def interrupt(self):
+        """
+        Stop all tracked runs (concurrently, as containers may take a while to stop). Returns the number stopped.
+        """
+        with self._lock:
+            self.interrupted = True
+            stops = list(self._stops.values())
+
+        def stop(fn):
+            try:
+                fn()
+            except Exception:
+                pass
+
+        threads = [threading.Thread(target=stop, args=(fn,)) for fn in stops]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(stops)
+
+    def reset(self):
+        with self._lock:
+            self.interrupted = False
+
+
+# Containers and processes started by this process
+active_runs = ActiveRuns()
+
+
+class DockerExecutor:
+
+    name = 'docker'
+
+    def __init__(self, client):
+        self.client = client
+
+    def run(self, execution):
+        import dockerpty
+
+        container = None
+        retain = False
+        try:
+            with span('container.create'):
+                try:
+                    container = self.client.api.create_container(
+                        execution.image, execution.command, execution.name, working_dir=execution.working_dir,
+                        host_config=self.client.api.create_host_config(binds=self.binds(execution),
+                                                                       network_mode='host', **execution.limits),
+                        labels=execution.labels, stdin_open=execution.tty, tty=execution.tty,
+                        environment=execution.environment)
+                except connection_errors() as e:
+                    raise HostUnavailable(str(e)) from e
+
+            self.before_start(container, execution)
+
+            with active_runs.track(lambda: self.client.api.stop(container)):
+                try:
+                    if execution.tty:
+                        with span('container.run'):
+                            dockerpty.start(self.client.api, container)
+                            exit_code = self.client.api.wait(container)['StatusCode']
+                    else:
+                        exit_code = stream_container(self.client, container, execution.output)
+                except BaseException:
+                    # stop the container (e.g. on interrupt), then collect files it has written (such as updated
+                    # state)..
+                    try:
+                        self.client.api.stop(container)
+                    except Exception:
+                        pass
+                    retain = not self.collect(container, execution)
+                    raise
+
+            retain = not self.collect(container, execution)
+            return exit_code or (1 if retain else 0)
+        finally:
+            if container is not None and not retain:
+                with span('container.remove'):
+                    remove_container(self.client, container)
+
+    def collect(self, container, execution):
+        """
+        Collect files written by an exited (or stopped) container. Returns False if files could not be collected, in
+        which case the container is retained (and reported) such that they can be recovered.
+        """
+        try:
+            self.after_exit(container, execution)
+            return True
+        except Exception as e:
+            print(f"{ANSIColors.FAIL}Failed to copy files from container {execution.name}: {e}{ANSIColors.ENDC}\n"
+                  f"The container has been retained, such that files (e.g. updated state) can be recovered with: "
+                  f"docker cp {execution.name}:/work <path>")
+            return False
+
+    def binds(self, execution):
+        return execution.volumes
+
+    def before_start(self, container, execution):
+        pass
+
+    def after_exit(self, container, execution):
+        pass
+
+
+class RemoteDockerExecutor(DockerExecutor):
+    """
+    Executes commands on a Docker daemon that doesn't share the local filesystem. Files bound to the working directory
+    and blueprint configuration are copied into the container before it starts, and the (writable) working directory
+    is copied back after exit (or after the container is stopped on interrupt). Other host paths are not available,
+    except the Docker socket (of the remote host).
+    """
+
+    name = 'remote'
+
+    # Container paths copied to the container (other bindings are host-specific)
+    synced_paths = ['/work', '/blueprint']
+
+    def __init__(self, client):
+        super().__init__(client)
+        # Content hash of each file copied to the container (such that unchanged files aren't rewritten)
+        self._manifest = {}
+
+    def binds(self, execution):
+        return {host_path: binding for host_path, binding in execution.volumes.items()
+                if binding['bind'] == '/var/run/docker.sock'}
+
+    def synced(self, execution):
+        return {host_path: binding for host_path, binding in execution.volumes.items()
+                if any(binding['bind'] == path or binding['bind'].startswith(f'{path}/') for path in self.synced_paths)
+                and os.path.exists(host_path)}
+
+    def before_start(self, container, execution):
+        with span('sync.upload'), tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as data:
+            self._manifest = write_archive(data, self.synced(execution))
+            data.seek(0)
+            self.client.api.put_archive(container, '/', data)
+
+    def after_exit(self, container, execution):
+        work_path = next((host_path for host_path, binding in execution.volumes.items()
+                          if binding['bind'] == '/work' and binding.get('mode') != 'ro'), None)
+        if work_path is None:
+            return
+
+        # files bound read-only to the working directory (e.g. a var file override) are never copied back..
+        readonly = {os.path.relpath(binding['bind'], '/work') for binding in execution.volumes.values()
+                    if binding['bind'].startswith('/work/') and binding.get('mode') == 'ro'}
+        manifest = {os.path.relpath(path, 'work'): digest for path, digest in self._manifest.items()
+                    if path.startswith('work/')}
+        with span('sync.download'):
+            chunks, _ = self.client.api.get_archive(container, '/work')
+            extract_archive(chunks, work_path, manifest, include=lambda path: path not in readonly)
+
+
+class NativeExecutor:
+    """
+    Executes commands with a host Terraform binary (BEDROCK_TERRAFORM, default: terraform). Blueprint configuration is
+    extracted once per image digest, and container paths in the command and environment are translated to the bound
+    host paths. Files bound into /blueprint (i.e. backend.tf) are overlaid on the extracted configuration for each run.
+    Container resource limits don't apply to native execution.
+    """
+
+    name = 'native'
+
+    def __init__(self, client, terraform=None, cache=None):
+        self.client = client
+
+        # Terraform executable
+        self.terraform = terraform or os.environ.get('BEDROCK_TERRAFORM', 'terraform')
+
+        # Cache of extracted blueprint configuration
+        self.cache = cache or BlueprintCache()
+
+    def run(self, execution):
+        # configuration is held for the run, such that it isn't evicted by concurrent runs..
+        with contextlib.ExitStack() as stack:
+            with span('blueprint.extract'):
+                config_path = stack.enter_context(self.cache.use(self.client, execution.image, execution.labels))
+
+            overlay = tempfile.mkdtemp(prefix=f'.{execution.name}.', dir=self.cache.path)
+            try:
+                # link extracted configuration into a per-run directory, such that bound files may be overlaid..
+                for entry in os.listdir(config_path):
+                    os.symlink(os.path.join(config_path, entry), os.path.join(overlay, entry))
+                paths = {'/blueprint': overlay}
+                for host_path, binding in execution.volumes.items():
+                    if binding['bind'].startswith('/blueprint/'):
+                        overlay_path = os.path.join(overlay, os.path.relpath(binding['bind'], '/blueprint'))
+                        if os.path.lexists(overlay_path):
+                            os.remove(overlay_path)
+                        os.symlink(os.path.abspath(host_path), overlay_path)
+                    else:
+                        paths[binding['bind']] = os.path.abspath(host_path)
+
+                command = [self.terraform] + [translate_arg(arg, paths) for arg in shlex.split(execution.command)]
+                environment = dict(os.environ)
+                for env_var in execution.environment:
+                    key, _, value = env_var.partition('=')
+                    environment[key] = translate_path(value, paths)
+
+                with span('terraform.run'):
+                    return self.execute(command, translate_path(execution.working_dir, paths), environment,
+                                        None if execution.tty else execution.output)
+            finally:
+                shutil.rmtree(overlay, ignore_errors=True)
+
+    def execute(self, command, cwd, environment, output=None):
+        if output is None:
+            # interactive execution inherits the terminal..
+            return subprocess.call(command, cwd=cwd, env=environment)
+
+        process = subprocess.Popen(command, cwd=cwd, env=environment, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            with active_runs.track(process.terminate), selectors.DefaultSelector() as selector:
+                selector.register(process.stdout, selectors.EVENT_READ, 'stdout')
+                selector.register(process.stderr, selectors.EVENT_READ, 'stderr')
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        chunk = os.read(key.fileobj.fileno(), 65536)
+                        if chunk:
+                            output.write(chunk, key.data)
+                        else:
+                            selector.unregister(key.fileobj)
+            return process.wait()
+        except KeyboardInterrupt:
+            process.terminate()
+            process.wait()
+            raise
+        finally:
+            output.close()
+            process.stdout.close()
+            process.stderr.close()
+
+
+class BlueprintCache:
+    """
+    Blueprint configuration (/blueprint) extracted from images, keyed by image digest such that configuration is only
+    extracted when an image changes.
+    """
+
+    def __init__(self, root='~/.bedrock', max_entries=None):
+        # Location of extracted blueprints
+        self.path = os.path.expanduser(f'{root}/extracted')
+
+        # Maximum number of extracted images retained (least recently used are evicted)
+        if max_entries is None:
+            max_entries = int(os.environ.get('BEDROCK_EXTRACT_CACHE_ENTRIES', DEFAULT_CACHE_ENTRIES))
+        self.max_entries = max_entries
+
+    def entry_path(self, image_id):
+        return os.path.join(self.path, re.sub(r'[^\w.-]', '_', image_id))
+
+    def ensure(self, client, image_ref, labels=None):
+        """
+        Return the location of extracted configuration for an image, extracting it if not already cached.
+        """
+        entry_path = self.entry_path(client.api.inspect_image(image_ref)['Id'])
+        if not os.path.isdir(entry_path):
+            with locked(entry_path):
+                if not os.path.isdir(entry_path):
+                    temp_path = tempfile.mkdtemp(prefix='.extract.', dir=self.path)
+                    try:
+                        extract_image(client, image_ref, temp_path, container_name('extract', 'default',
+                                                                                   prefix='bedrock_extract'), labels)
+                        os.replace(temp_path, entry_path)
+                    finally:
+                        shutil.rmtree(temp_path, ignore_errors=True)
+            os.utime(entry_path)
+            self.prune()
+        else:
+            # record last use for eviction..
+            os.utime(entry_path)
+        return entry_path
+
+    @contextlib.contextmanager
+    def use(self, client, image_ref, labels=None):
+        """
+        Hold extracted configuration for an image (extracting it if required), such that it isn't evicted while in use.
+        """
+        while True:
+            entry_path = self.ensure(client, image_ref, labels)
+            with locked(entry_path, shared=True):
+                # the entry may have been evicted before the lock was acquired..
+                if os.path.isdir(entry_path):
+                    yield entry_path
+                    return
+
+    def prune(self):
+        """
+        Evict least recently used extracted images in excess of the maximum, skipping images in use. Returns evicted
+        paths.
+        """
+        entries = sorted((entry for entry in os.scandir(self.path) if entry.is_dir() and not entry.name.startswith('.')),
+                         key=lambda entry: entry.stat().st_mtime, reverse=True)
+        evicted = []
+        for entry in entries[self.max_entries:]:
+            # lock files are retained, as a run may already be waiting on the lock..
+            try:
+                with locked(entry.path, blocking=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except BlockingIOError:
+                continue
+            if not os.path.exists(entry.path):
+                evicted.append(entry.path)
+        return evicted
+
+
+def extract_image(client, image_ref, target, name, labels=None, manifest=None):
+    """
+    Extract blueprint configuration (/blueprint) from an image to a target directory, using a container that is never
+    started. Returns a tuple of (written, skipped) paths.
+    """
+    container = None
+    try:
+        with span('container.create'):
+            container = client.api.create_container(image_ref, ['true'], name, entrypoint=[], labels=labels or {})
+
+        with span('archive.extract'):
+            chunks, _ = client.api.get_archive(container, '/blueprint')
+            return extract_archive(chunks, target, manifest)
+    finally:
+        if container is not None:
+            with span('container.remove'):
+                remove_container(client, container)
+
+
+def write_archive(f, volumes):
+    """
+    Write a tar archive of bound host paths (directories are added recursively) to a file, with members named by
+    container path. Returns the content hash of each file, by member name.
+    """
+    manifest = {}
+    with tarfile.open(fileobj=f, mode='w') as archive:
+        for host_path, binding in volumes.items():
+            for path, name in walk_paths(host_path, binding['bind'].lstrip('/')):
+                info = archive.gettarinfo(path, name)
+                if info.isfile():
+                    with open(path, 'rb') as content:
+                        digest = hashlib.sha256()
+                        for chunk in iter(lambda: content.read(1024 * 1024), b''):
+                            digest.update(chunk)
+                        content.seek(0)
+                        archive.addfile(info, content)
+                    manifest[name] = digest.hexdigest()
+                elif info.isdir() or info.issym():
+                    archive.addfile(info)
+    return manifest
+
+
+def walk_paths(host_path, name):
+    """
+    Yield (path, member name) tuples for a host path and its contents (symbolic links are not followed).
+    """
+    yield host_path, name
+    if os.path.isdir(host_path) and not os.path.islink(host_path):
+        for dirpath, dirnames, filenames in os.walk(host_path):
+            for entry in dirnames + filenames:
+                path = os.path.join(dirpath, entry)
+                yield path, f'{name}/{os.path.relpath(path, host_path)}'
+
+
+def translate_path(path, paths):
+    """
+    Translate a container path to a host path using the longest matching binding.
+    """
+    for container_path in sorted(paths, key=len, reverse=True):
+        if path == container_path or path.startswith(f'{container_path}/'):
+            return paths[container_path] + path[len(container_path):]
+    return path
+
+
+def translate_arg(arg, paths):
+    """
+    Translate container paths in a command argument (e.g. /blueprint or -var-file=/work/prod.tfvars.json).
+    """
+    option, separator, value = arg.partition('=')
+    if separator and option.startswith('-'):
+        return f'{option}={translate_path(value, paths)}'
+    return translate_path(arg, paths)
+
+
+# Available executors (by engine name)
+EXECUTORS = {executor.name: executor for executor in [DockerExecutor, NativeExecutor]}
+
+
+def create_executor(engine, client, remote=False):
+    """
+    Create an executor for an engine (containers on a remote Docker daemon copy files instead of bind mounting).
+    """
+    if engine not in EXECUTORS:
+        raise ValueError(f"Unknown engine: {engine} (expected one of: {', '.join(EXECUTORS)})")
+    if engine == 'docker' and remote:
+        return RemoteDockerExecutor(client)
+    return EXECUTORS[engine](client)
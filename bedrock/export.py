@@ -3,9 +3,13 @@
 """
 Export Terraform blueprints to the local filesystem.
 """
-import docker
-import docker.errors
-import dockerpty
+import time
+
+from .archive import read_manifest, save_manifest
+from .executors import extract_image
+from .images import ImageManager, image_name
+from .ledger import RunLedger
+from .profile import span, traced
 from .utils import *
 
 
@@ -35,7 +39,16 @@ class ExportSpec:
         # Name of blueprint instance
         self.instance_name = instance_name
 
+        # Docker client (shared across concurrent exports, or created per export if not specified)
+        self.client = None
+
+        # Ledger recording each export (disabled if None)
+        self.ledger = RunLedger.default()
+
+    @traced('export')
     def run(self):
+        started = time.time()
+        start = time.perf_counter()
 
         if self.dry_run:
             print("Dry run enabled. No changes will be made.")
@@ -43,58 +56,72 @@ class ExportSpec:
         # Configure variables..
         workspace = current_workspace(self.blueprint_id, self.blueprint_home)
 
-        run_command = ["cp","-R","/blueprint/.","/work"]
-
         # Initialise working directory
         if self.verbose:
             print(f"Initialising current workspace: {workspace}\n")
 
-        init_config(self.blueprint_id, self.blueprint_home, workspace)
+        with span('init_config'):
+            init_config(self.blueprint_id, self.blueprint_home, workspace)
 
-        # Configure container volumes..
-        volumes = {
-            os.path.expanduser(f'{self.blueprint_home}/{self.blueprint_id}'): {
-                'bind': '/work',
-                'mode': 'rw'
-            },
-        }
+        export_path = os.path.expanduser(f'{self.blueprint_home}/{self.blueprint_id}')
+        manifest_path = f'{export_path}/.bedrock/export.json'
 
-        # Run container..
+        # Export blueprint..
         if not self.dry_run:
-            container = None
+            # docker client libraries are slow to import, so only load them when a container is required..
+            with span('docker.import'):
+                import docker
+                import docker.errors
+
+            # Generate a unique instance name to avoid collisions with concurrent runs..
+            instance_name = self.instance_name or container_name(self.blueprint_id, workspace, prefix='bedrock_export')
+
+            client = None
+            image_manager = None
+            image_ref = image_name(self.image, self.image_registry)
+            image_key = f"{image_ref}:{self.image_tag or 'latest'}"
+            exit_code = 1
             try:
                 print("Initialising Docker..")
 
-                client = docker.from_env()
+                with span('docker.from_env'):
+                    client = self.client or docker.from_env()
 
-                if self.image_registry is not None:
-                    image_ref = self.image_registry + "/" + self.image
-                else:
-                    image_ref = self.image
-
-                if self.pull_image:
-                    client.api.pull(image_ref, self.image_tag)
+                # pull image if missing locally (or out of date when pull is requested)..
+                with span('image.ensure', image=image_ref):
+                    image_manager = ImageManager(client)
+                    pulled = image_manager.ensure(image_ref, self.image_tag, pull=self.pull_image)
+                if pulled and self.verbose:
+                    print(f"Pulled image: {image_ref}\n")
 
                 if self.image_tag is not None:
                     image_ref += ":" + self.image_tag
 
-                print(f"Running export command: {run_command}")
+                print(f"Exporting blueprint: {self.blueprint_id}")
 
                 if self.verbose:
                     print(f"Creating container from image: {image_ref}\n")
 
-                container = client.api.create_container(image_ref, run_command, self.instance_name,
-                                                        entrypoint=[],
-                                                        working_dir='/work',
-                                                        host_config=client.api.create_host_config(binds=volumes,
-                                                                                                  network_mode='host'),
-                                                        stdin_open=True, tty=True)
+                manifest = read_manifest(manifest_path)
+                written, skipped = extract_image(client, image_ref, export_path, instance_name,
+                                                 container_labels(self.blueprint_id, workspace), manifest)
+                save_manifest(manifest_path, manifest)
 
-                dockerpty.start(client.api, container)
+                print(f"Exported {len(written)} files to {export_path} ({len(skipped)} unchanged)")
+                exit_code = 0
 
             except KeyboardInterrupt:
                 print(f"Aborting {self.blueprint_id}..")
-                if container is not None:
-                    container.stop()
+                exit_code = 130
             except docker.errors.ImageNotFound:
-                print(f"Blueprint image not found {image_ref}.. did you run with --pull option?")
+                print(f"{ANSIColors.FAIL}Blueprint image could not be pulled: {image_ref} (check the image name, "
+                      f"tag and registry credentials){ANSIColors.ENDC}")
+            finally:
+                if self.ledger is not None:
+                    self.ledger.record('export', self.blueprint_id, workspace, ['export'], started,
+                                       time.perf_counter() - start, exit_code, image=image_ref,
+                                       image_id=image_manager.image_ids.get(image_key) if image_manager else None)
+
+            return exit_code
+
+        return 0
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""
+Execute a Terraform blueprint concurrently across multiple workspaces.
+"""
+import contextlib
+import copy
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .executors import active_runs
+from .utils import *
+
+
+@contextlib.contextmanager
+def worker_pool(max_workers):
+    """
+    A thread pool for concurrent runs. When interrupted, queued runs are cancelled and running containers are stopped
+    (such that workers remove them), before the interrupt is propagated.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        yield executor
+    except KeyboardInterrupt:
+        print(f"{ANSIColors.WARNING}Interrupted.. stopping running containers{ANSIColors.ENDC}")
+        executor.shutdown(wait=False, cancel_futures=True)
+        active_runs.interrupt()
+        executor.shutdown(wait=True)
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        active_runs.reset()
+
+
+class FanoutSpec:
+
+    def __init__(self, spec, workspaces, max_workers=4, dry_run=False, verbose=False, pool=None):
+        # Template TerraformSpec (copied for each workspace)
+        self.spec = spec
+
+        # Workspaces to execute
+        self.workspaces = workspaces
+
+        # Maximum number of concurrent containers
+        self.max_workers = max_workers
+
+        # Enable dry run (skip container creation)
+        self.dry_run = dry_run
+
+        # Enable verbose logging
+        self.verbose = verbose
+
+        # Pool of Docker hosts (runs are limited by the capacity of each host, rather than max_workers)
+        self.pool = pool
+
+    def run(self):
+        if not self.workspaces:
+            print("No matching workspaces.")
+            return 1
+
+        max_workers = max(1, min(self.max_workers if self.pool is None else self.pool.capacity, len(self.workspaces)))
+
+        if self.verbose:
+            print(f"Running {self.spec.args[0]} across {len(self.workspaces)} workspaces ({max_workers} workers)\n")
+
+        client = None
+        if not self.dry_run and self.pool is None:
+            import docker
+
+            # share a single client (and connection pool) between workers..
+            client = docker.from_env(max_pool_size=max_workers)
+
+        try:
+            with worker_pool(max_workers) as executor:
+                results = list(executor.map(lambda ws: self.run_workspace(ws, client, max_workers), self.workspaces))
+        except KeyboardInterrupt:
+            return 130
+
+        print_summary(results)
+
+        return next((exit_code for _, exit_code, _ in results if exit_code != 0), 0)
+
+    def run_workspace(self, workspace, client, concurrency=1):
+        spec = copy.copy(self.spec)
+        spec.workspace = workspace
+        spec.instance_name = None
+        spec.var_file = None
+        spec.tty = False
+        spec.output_prefix = workspace
+        spec.client = client
+        # workers share the host's resources (runs on a pool host share that host's instead)..
+        spec.concurrency = concurrency
+
+        start = time.monotonic()
+        try:
+            exit_code = spec.run() if self.pool is None or self.dry_run else self.pool.run(spec)
+        except Exception as e:
+            print(f"[{workspace}] {ANSIColors.FAIL}{e}{ANSIColors.ENDC}")
+            exit_code = 1
+
+        return workspace, exit_code, time.monotonic() - start
+
+
+def print_summary(results, title='WORKSPACE'):
+    """
+    Print a summary table of (name, exit code, duration) results.
+    """
+    width = max(len(title), *(len(name) for name, _, _ in results))
+    print(f"\n{ANSIColors.BOLD}{title.ljust(width)}  EXIT  DURATION{ANSIColors.ENDC}")
+    for name, exit_code, duration in results:
+        color = ANSIColors.OKGREEN if exit_code == 0 else ANSIColors.FAIL
+        exit_status = str(exit_code) if exit_code is not None else '-'
+        print(f"{name.ljust(width)}  {color}{exit_status.rjust(4)}{ANSIColors.ENDC}  {duration:7.1f}s")
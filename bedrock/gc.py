@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+"""
+Reap orphaned bedrock containers.
+"""
+from .utils import *
+
+
+class GcSpec:
+
+    # Container states considered orphaned (i.e. not attached to an active run)
+    orphan_states = ['created', 'exited', 'dead']
+
+    def __init__(self, force=False, dry_run=False, verbose=False):
+        # Also remove running containers
+        self.force = force
+
+        # Enable dry run (skip container removal)
+        self.dry_run = dry_run
+
+        # Enable verbose logging
+        self.verbose = verbose
+
+    def run(self):
+        if self.dry_run:
+            print("Dry run enabled. No changes will be made.")
+
+        import docker
+
+        client = docker.from_env()
+
+        filters = {'label': f'{MANAGED_LABEL}=true'}
+        if not self.force:
+            filters['status'] = self.orphan_states
+
+        containers = client.api.containers(all=True, filters=filters)
+
+        if self.verbose:
+            print(f"Found {len(containers)} orphaned containers\n")
+
+        for container in containers:
+            names = ','.join(name.lstrip('/') for name in container.get('Names', []))
+            print(f"Removing container: {names} ({container.get('State')})")
+            if not self.dry_run:
+                remove_container(client, container['Id'])
+
+        return 0
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+"""
+Schedule blueprint runs across a pool of Docker daemons.
+"""
+import copy
+import threading
+import time
+
+from .images import image_name
+from .resources import daemon_resources
+from .utils import *
+
+# Time (in seconds) before an unreachable host is retried
+DEFAULT_RETRY_INTERVAL = 60
+
+
+class HostUnavailable(Exception):
+    """
+    A Docker daemon could not be reached before a run was started (such that the run may be retried on another host).
+    """
+
+
+def connection_errors():
+    """
+    Exceptions raised by the Docker client when a daemon is unreachable.
+    """
+    import requests.exceptions
+
+    return ConnectionError, requests.exceptions.ConnectionError, requests.exceptions.Timeout
+
+
+class DockerHost:
+
+    def __init__(self, url, max_runs=4, client_factory=None):
+        # Docker endpoint (e.g. unix:///var/run/docker.sock, tcp://build2:2376), or a Docker context name
+        self.url = url
+
+        # Maximum number of concurrent runs on this host
+        self.max_runs = max_runs
+
+        # Docker client factory (defaults to a client for the endpoint or context)
+        self.client_factory = client_factory
+
+        # Runs started on this host (by this process), and containers already running (by other processes)
+        self.active = 0
+        self.external = 0
+
+        # Time at which the host was found to be unreachable (None if available)
+        self.failed_at = None
+
+        # Availability of images on this host (by image reference)
+        self.images = {}
+
+        # CPUs and memory (in bytes) of the host (divided between concurrent runs)
+        self.resources = None
+
+        self._client = None
+
+    @property
+    def remote(self):
+        """
+        Whether the host doesn't share the local filesystem (i.e. bind mounts would refer to the remote host).
+        """
+        return not self.base_url().startswith(('unix://', 'npipe://'))
+
+    @property
+    def load(self):
+        return (self.active + self.external) / self.max_runs
+
+    def base_url(self):
+        if '://' in self.url:
+            return self.url
+        from docker.context import ContextAPI
+
+        context = ContextAPI.get_context(self.url)
+        if context is None:
+            raise ValueError(f"Unknown Docker context: {self.url}")
+        return context.Host
+
+    def client(self):
+        if self._client is None:
+            if self.client_factory is not None:
+                self._client = self.client_factory(self.url)
+            else:
+                import docker
+
+                tls = None
+                if '://' not in self.url:
+                    from docker.context import ContextAPI
+
+                    tls = ContextAPI.get_context(self.url).TLSConfig
+                self._client = docker.DockerClient(base_url=self.base_url(), tls=tls, max_pool_size=self.max_runs)
+        return self._client
+
+    def has_image(self, image_ref):
+        if image_ref not in self.images:
+            import docker.errors
+
+            try:
+                self.client().api.inspect_image(image_ref)
+                self.images[image_ref] = True
+            except (docker.errors.ImageNotFound,) + connection_errors():
+                self.images[image_ref] = False
+        return self.images[image_ref]
+
+    def check(self):
+        """
+        Check the host is reachable, and count bedrock containers already running on it (and host resources). Returns
+        True if available.
+        """
+        try:
+            client = self.client()
+            client.api.ping()
+            self.external = len(client.api.containers(filters={'label': f'{MANAGED_LABEL}=true',
+                                                               'status': 'running'}))
+            if self.resources is None:
+                self.resources = daemon_resources(client)
+            self.failed_at = None
+            return True
+        except (ValueError,) + connection_errors():
+            self.failed_at = time.monotonic()
+            return False
+
+
+class HostPool:
+    """
+    Runs are placed on the host with the blueprint image already available (avoiding a pull), preferring the host
+    that previously ran the same blueprint, then the least loaded host. Hosts that are unreachable are skipped (and
+    retried after an interval), and runs that fail to start on a host are retried on another.
+    """
+
+    def __init__(self, urls, max_runs=4, client_factory=None, retry_interval=DEFAULT_RETRY_INTERVAL, verbose=False):
+        # Docker hosts
+        self.hosts = [DockerHost(url, max_runs, client_factory) for url in urls]
+
+        # Time (in seconds) before an unreachable host is retried
+        self.retry_interval = retry_interval
+
+        # Enable verbose logging
+        self.verbose = verbose
+
+        # Host each blueprint was last placed on
+        self.placements = {}
+
+        self._condition = threading.Condition()
+        self._check_lock = threading.Lock()
+        self._checked = False
+
+    @staticmethod
+    def from_env(max_runs=4, hosts=None, verbose=False):
+        """
+        Create a pool from a comma-separated list of Docker endpoints or contexts (default: BEDROCK_DOCKER_HOSTS), or
+        return None if no pool is configured.
+        """
+        hosts = hosts or os.environ.get('BEDROCK_DOCKER_HOSTS')
+        if not hosts:
+            return None
+        return HostPool([host.strip() for host in hosts.split(',') if host.strip()], max_runs, verbose=verbose)
+
+    @property
+    def capacity(self):
+        return sum(host.max_runs for host in self.hosts)
+
+    def available(self):
+        """
+        Hosts that are reachable (or due to be retried).
+        """
+        with self._check_lock:
+            if not self._checked:
+                for host in self.hosts:
+                    if not host.check() and self.verbose:
+                        print(f"Docker host unavailable: {host.url}")
+                self._checked = True
+
+            now = time.monotonic()
+            return [host for host in self.hosts if host.failed_at is None or
+                    (now - host.failed_at >= self.retry_interval and host.check())]
+
+    def acquire(self, blueprint_id, image_ref, exclude=()):
+        """
+        Reserve a host for a run, waiting for capacity if all hosts are busy. Returns None if no host is available.
+        """
+        while True:
+            # hosts are probed without holding the lock (such that slow hosts don't block releases by other runs)..
+            hosts = [host for host in self.available() if host not in exclude]
+            if not hosts:
+                return None
+            with self._condition:
+                candidates = [host for host in hosts if host.active < host.max_runs]
+                if not candidates:
+                    self._condition.wait()
+                    continue
+            images = {host: host.has_image(image_ref) for host in candidates}
+
+            # other runs may have claimed (or failed) candidates while probing..
+            with self._condition:
+                candidates = [host for host in candidates if host.active < host.max_runs and host.failed_at is None]
+                if candidates:
+                    host = min(candidates, key=lambda h: (not images[h], self.placements.get(blueprint_id) is not h,
+                                                          h.load))
+                    host.active += 1
+                    self.placements[blueprint_id] = host
+                    return host
+
+    def release(self, host, image_ref=None):
+        with self._condition:
+            host.active -= 1
+            if image_ref is not None:
+                host.images[image_ref] = True
+            self._condition.notify_all()
+
+    def mark_failed(self, host):
+        with self._condition:
+            host.failed_at = time.monotonic()
+            host.images.clear()
+            self._condition.notify_all()
+
+    def run(self, spec):
+        """
+        Run a TerraformSpec on a host from the pool, failing over to another host if the selected host is unreachable.
+        Returns the exit code.
+        """
+        image_ref = f"{image_name(spec.image, spec.image_registry)}:{spec.image_tag or 'latest'}"
+        failed = []
+        while True:
+            host = self.acquire(spec.blueprint_id, image_ref, exclude=failed)
+            if host is None:
+                print(f"{ANSIColors.FAIL}No Docker hosts available{ANSIColors.ENDC}")
+                return 1
+
+            host_spec = copy.copy(spec)
+            host_spec.client = host.client()
+            host_spec.docker_host = host.url
+            host_spec.remote = host.remote
+            host_spec.concurrency = host.max_runs
+            host_spec.host_resources = host.resources
+            if host.remote:
+                # host caches can't be bind mounted on a remote host..
+                host_spec.plugin_cache = None
+                host_spec.plan_cache = None
+            if self.verbose:
+                print(f"Running {spec.blueprint_id} on Docker host: {host.url}")
+            try:
+                exit_code = host_spec.run()
+            except HostUnavailable as e:
+                print(f"{ANSIColors.WARNING}Docker host unavailable: {host.url} ({e}){ANSIColors.ENDC}")
+                self.mark_failed(host)
+                self.release(host)
+                failed.append(host)
+                continue
+            except BaseException:
+                self.release(host)
+                raise
+            self.release(host, image_ref)
+            return exit_code
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""
+Manage blueprint images, pulling only when the local image is missing or out of date.
+"""
+import time
+
+from .storage import read_json, update_json
+from .utils import *
+
+# Default time (in seconds) to cache registry manifest digests
+DEFAULT_MANIFEST_TTL = 300
+
+
+class ImageManager:
+
+    def __init__(self, client, root='~/.bedrock', ttl=None):
+        # Docker client
+        self.client = client
+
+        # Cached registry manifest digests
+        self.manifest_path = os.path.expanduser(f'{root}/manifests.json')
+
+        # Time (in seconds) before a cached manifest digest is checked against the registry
+        self.ttl = ttl if ttl is not None else int(os.environ.get('BEDROCK_MANIFEST_TTL', DEFAULT_MANIFEST_TTL))
+
+        # Identifiers of inspected local images (by image reference)
+        self.image_ids = {}
+
+    def local_digests(self, image_ref):
+        """
+        Return the repository digests of a local image, or None if the image is not available locally.
+        """
+        import docker.errors
+
+        try:
+            image = self.client.api.inspect_image(image_ref)
+        except docker.errors.ImageNotFound:
+            return None
+        self.image_ids[image_ref] = image.get('Id')
+        return [digest.split('@')[-1] for digest in image.get('RepoDigests') or []]
+
+    def remote_digest(self, image_ref):
+        """
+        Return the registry manifest digest of an image, or None if the registry is unavailable.
+        """
+        import docker.errors
+
+        manifests = self.read_manifests()
+        cached = manifests.get(image_ref)
+        if cached is not None and time.time() - cached['checked'] < self.ttl:
+            return cached['digest']
+
+        try:
+            digest = self.client.api.inspect_distribution(image_ref)['Descriptor']['digest']
+        except docker.errors.APIError:
+            return None
+
+        self.save_manifest(image_ref, digest)
+        return digest
+
+    def ensure(self, image, tag=None, pull=False):
+        """
+        Ensure an image is available locally. Missing images are always pulled, and if pull is specified the local
+        image is updated when its digest differs from the registry. Returns True if the image was pulled.
+        """
+        tag = tag or 'latest'
+        image_ref = f'{image}:{tag}'
+
+        local_digests = self.local_digests(image_ref)
+        if local_digests is not None:
+            if not pull:
+                return False
+            remote_digest = self.remote_digest(image_ref)
+            if remote_digest is None or remote_digest in local_digests:
+                return False
+
+        self.client.api.pull(image, tag)
+
+        local_digests = self.local_digests(image_ref)
+        if local_digests:
+            self.save_manifest(image_ref, local_digests[0])
+        return True
+
+    def read_manifests(self):
+        return read_json(self.manifest_path)
+
+    def save_manifest(self, image_ref, digest):
+        update_json(self.manifest_path, {image_ref: {'digest': digest, 'checked': time.time()}})
+
+
+def image_name(image, registry=None):
+    return f'{registry}/{image}' if registry is not None else image
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+"""
+Index resources and outputs across all blueprints and workspaces in a blueprint home directory.
+"""
+import hashlib
+import json
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from .registry import like_escape
+from .state import iter_resources, resource_addresses, state_outputs
+from .storage import locked
+from .utils import *
+
+# Directories never searched for state files
+IGNORED_DIRS = ['.terraform', '.bedrock', '.git', 'terraform.tfstate.d']
+
+
+def find_states(blueprint_home, blueprint_ids=None):
+    """
+    Find local state files in a blueprint home directory, mapped by (blueprint, workspace) to the state file location.
+    If blueprint identifiers are specified, only their directories are searched (rather than the whole directory tree).
+    """
+    states = {}
+    if blueprint_ids is not None:
+        for blueprint_id in blueprint_ids:
+            states.update(blueprint_states(blueprint_home, blueprint_id))
+        return states
+
+    for dirpath, dirnames, _ in os.walk(blueprint_home):
+        dirnames[:] = [d for d in dirnames if d not in IGNORED_DIRS]
+        # the blueprint home itself isn't a blueprint..
+        if dirpath != blueprint_home:
+            blueprint_id = os.path.relpath(dirpath, blueprint_home).replace(os.sep, '/')
+            states.update(blueprint_states(blueprint_home, blueprint_id))
+    return states
+
+
+def blueprint_states(blueprint_home, blueprint_id):
+    states = {}
+    blueprint_path = os.path.join(blueprint_home, blueprint_id)
+    if os.path.isfile(os.path.join(blueprint_path, 'terraform.tfstate')):
+        states[(blueprint_id, 'default')] = os.path.join(blueprint_path, 'terraform.tfstate')
+    try:
+        workspaces = os.listdir(os.path.join(blueprint_path, 'terraform.tfstate.d'))
+    except OSError:
+        workspaces = []
+    for workspace in workspaces:
+        state_file = os.path.join(blueprint_path, 'terraform.tfstate.d', workspace, 'terraform.tfstate')
+        if os.path.isfile(state_file):
+            states[(blueprint_id, workspace)] = state_file
+    return states
+
+
+def scan_state(state_file):
+    """
+    Read the resources and outputs of a state file (run in a worker process), or None if the state file can't be read.
+    Sensitive output values are not indexed.
+    """
+    try:
+        resources = []
+        for resource in iter_resources(state_file):
+            for address in resource_addresses(resource):
+                resources.append((address, resource.get('module'), resource.get('mode'), resource['type'],
+                                  resource['name']))
+        outputs = [(name, None if output.get('sensitive') else json.dumps(output.get('value')),
+                    int(bool(output.get('sensitive'))))
+                   for name, output in state_outputs(state_file).items()]
+    except (IOError, ValueError, KeyError):
+        return None
+    return resources, outputs
+
+
+class InventoryIndex:
+    """
+    A persistent index of resources and outputs in local state. The index is updated incrementally, such that only
+    state files with a modified serial are read.
+    """
+
+    def __init__(self, blueprint_home, root='~/.bedrock', max_workers=4, blueprint_ids=None):
+        # Blueprint home directory
+        self.blueprint_home = os.path.abspath(os.path.expanduser(blueprint_home))
+
+        # Blueprints indexed (defaults to all blueprint directories under the blueprint home)
+        self.blueprint_ids = blueprint_ids
+
+        # Location of the index (one per blueprint home)
+        home_hash = hashlib.sha256(self.blueprint_home.encode('utf-8')).hexdigest()[:16]
+        self.index_path = os.path.expanduser(f'{root}/inventory/{home_hash}.db')
+
+        # Maximum number of state files read concurrently
+        self.max_workers = max_workers
+
+        self._db = None
+
+    def db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            self._db = sqlite3.connect(self.index_path)
+            self._db.executescript('''
+                CREATE TABLE IF NOT EXISTS states (blueprint TEXT, workspace TEXT, path TEXT, mtime INTEGER,
+                                                   serial INTEGER, PRIMARY KEY (blueprint, workspace));
+                CREATE TABLE IF NOT EXISTS resources (blueprint TEXT, workspace TEXT, address TEXT, module TEXT,
+                                                      mode TEXT, type TEXT, name TEXT);
+                CREATE TABLE IF NOT EXISTS outputs (blueprint TEXT, workspace TEXT, name TEXT, value TEXT,
+                                                    sensitive INTEGER);
+                CREATE INDEX IF NOT EXISTS resources_state ON resources (blueprint, workspace);
+                CREATE INDEX IF NOT EXISTS resources_address ON resources (address);
+                CREATE INDEX IF NOT EXISTS resources_type ON resources (type);
+                CREATE INDEX IF NOT EXISTS outputs_state ON outputs (blueprint, workspace);
+                CREATE INDEX IF NOT EXISTS outputs_name ON outputs (name);
+            ''')
+        return self._db
+
+    def update(self):
+        """
+        Update the index with added, modified and removed state files. Returns a tuple of (updated, unchanged, removed)
+        state counts.
+        """
+        with locked(self.index_path):
+            db = self.db()
+            indexed = {(row[0], row[1]): (row[2], row[3]) for row in
+                       db.execute('SELECT blueprint, workspace, mtime, serial FROM states')}
+            states = find_states(self.blueprint_home, self.blueprint_ids)
+
+            modified = {}
+            unchanged = 0
+            for key, state_file in states.items():
+                mtime = os.stat(state_file).st_mtime_ns
+                if key in indexed and indexed[key][0] == mtime:
+                    unchanged += 1
+                    continue
+                serial = read_serial(state_file)
+                if key in indexed and serial is not None and indexed[key][1] == serial:
+                    # state rewritten without changes (e.g. refresh)..
+                    db.execute('UPDATE states SET mtime = ? WHERE blueprint = ? AND workspace = ?', (mtime, *key))
+                    unchanged += 1
+                    continue
+                modified[key] = (state_file, mtime, serial)
+
+            # read modified state files concurrently (in-process when there is little to gain from a pool)..
+            paths = [state_file for state_file, _, _ in modified.values()]
+            if len(paths) > 1 and self.max_workers > 1:
+                with ProcessPoolExecutor(max_workers=min(self.max_workers, len(paths))) as executor:
+                    results = list(executor.map(scan_state, paths))
+            else:
+                results = [scan_state(path) for path in paths]
+
+            removed = [key for key in indexed if key not in states]
+            for key in removed + list(modified):
+                db.execute('DELETE FROM states WHERE blueprint = ? AND workspace = ?', key)
+                db.execute('DELETE FROM resources WHERE blueprint = ? AND workspace = ?', key)
+                db.execute('DELETE FROM outputs WHERE blueprint = ? AND workspace = ?', key)
+
+            for (key, (state_file, mtime, serial)), result in zip(modified.items(), results):
+                if result is None:
+                    # unreadable state is not indexed (and is retried on the next update)..
+                    print(f"Unable to read state file: {state_file}")
+                    continue
+                resources, outputs = result
+                db.execute('INSERT INTO states VALUES (?, ?, ?, ?, ?)', (*key, state_file, mtime, serial))
+                db.executemany('INSERT INTO resources VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               ((*key, *resource) for resource in resources))
+                db.executemany('INSERT INTO outputs VALUES (?, ?, ?, ?, ?)', ((*key, *output) for output in outputs))
+            db.commit()
+
+        return len(modified), unchanged, len(removed)
+
+    def resources(self, query=None, resource_type=None):
+        """
+        Find resources by address (substring or glob pattern) and/or resource type.
+        """
+        sql = 'SELECT blueprint, workspace, address, type FROM resources'
+        sql, params = self._filter(sql, 'address', query, [('type', resource_type)])
+        return self.db().execute(sql + ' ORDER BY blueprint, workspace, address', params).fetchall()
+
+    def outputs(self, query=None):
+        """
+        Find outputs by name (substring or glob pattern).
+        """
+        sql = 'SELECT blueprint, workspace, name, value, sensitive FROM outputs'
+        sql, params = self._filter(sql, 'name', query)
+        return self.db().execute(sql + ' ORDER BY blueprint, workspace, name', params).fetchall()
+
+    def _filter(self, sql, column, query, conditions=()):
+        clauses, params = [], []
+        if query is not None:
+            if any(c in query for c in '*?['):
+                clauses.append(f'{column} GLOB ?')
+                params.append(query)
+            else:
+                clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+                params.append(f'%{like_escape(query)}%')
+        for condition_column, value in conditions:
+            if value is not None:
+                clauses.append(f'{condition_column} = ?')
+                params.append(value)
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        return sql, params
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class InventorySpec:
+
+    def __init__(self, blueprint_home, max_workers=4, dry_run=False, verbose=False):
+        # Enable dry run (query the existing index without updating)
+        self.dry_run = dry_run
+
+        # Enable verbose logging
+        self.verbose = verbose
+
+        # Blueprint home directory
+        self.blueprint_home = blueprint_home
+
+        # Maximum number of state files read concurrently
+        self.max_workers = max_workers
+
+        # Resource address (or output name) filter, as a substring or glob pattern
+        self.query = None
+
+        # Resource type filter
+        self.resource_type = None
+
+        # Query outputs instead of resources
+        self.outputs = False
+
+        # Update the index prior to querying
+        self.refresh = True
+
+        # Output results as JSON lines
+        self.json_output = False
+
+    def run(self):
+        from .blueprint import BlueprintSpec
+        from .registry import BlueprintRegistry
+
+        # only registered blueprints are searched for state..
+        blueprint_ids = BlueprintRegistry(defaults=BlueprintSpec.default_blueprints).ids()
+        index = InventoryIndex(self.blueprint_home, max_workers=self.max_workers, blueprint_ids=blueprint_ids)
+        try:
+            if self.refresh and not self.dry_run:
+                updated, unchanged, removed = index.update()
+                if self.verbose:
+                    print(f"Indexed state files: {updated} updated, {unchanged} unchanged, {removed} removed\n")
+
+            if self.outputs:
+                for blueprint_id, workspace, name, value, sensitive in index.outputs(self.query):
+                    value = '<sensitive>' if sensitive else value
+                    if self.json_output:
+                        print(json.dumps({'blueprint': blueprint_id, 'workspace': workspace, 'name': name,
+                                          'value': json.loads(value) if not sensitive else None,
+                                          'sensitive': bool(sensitive)}))
+                    else:
+                        print(f'{blueprint_id}\t{workspace}\t{name} = {value}')
+            else:
+                for blueprint_id, workspace, address, resource_type in index.resources(self.query,
+                                                                                       self.resource_type):
+                    if self.json_output:
+                        print(json.dumps({'blueprint': blueprint_id, 'workspace': workspace, 'address': address,
+                                          'type': resource_type}))
+                    else:
+                        print(f'{blueprint_id}\t{workspace}\t{address}')
+        finally:
+            index.close()
+
+        return 0
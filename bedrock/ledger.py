@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+"""
+Record bedrock runs (blueprint, workspace, command, image, durations and exit code) in a persistent ledger.
+"""
+import atexit
+import math
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+from .storage import locked
+from .utils import *
+
+# Default number of days runs are retained by compaction
+DEFAULT_RETENTION_DAYS = 90
+
+# Columns of a ledger record (excluding id)
+COLUMNS = ['started', 'kind', 'blueprint', 'workspace', 'command', 'args', 'engine', 'image', 'image_id', 'host',
+           'docker_host', 'duration', 'setup_duration', 'run_duration', 'exit_code', 'log']
+
+# Ledgers (by location) shared by all runs in a process
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+class RunLedger:
+    """
+    Runs are buffered in memory and written in a single transaction when the ledger is flushed (at the latest, on
+    process exit), such that recording never delays a run. If the ledger database is unavailable (e.g. locked by a
+    long-running query), records are appended to a spool file and written on the next flush.
+    """
+
+    def __init__(self, root='~/.bedrock', retention_days=None):
+        # Location of the ledger
+        self.path = os.path.expanduser(f'{root}/ledger.db')
+        self.spool_path = os.path.expanduser(f'{root}/ledger.spool')
+
+        # Number of days runs are retained by compaction
+        if retention_days is None:
+            retention_days = int(os.environ.get('BEDROCK_LEDGER_RETENTION', DEFAULT_RETENTION_DAYS))
+        self.retention_days = retention_days
+
+        self._pending = []
+        self._lock = threading.Lock()
+        self._db = None
+
+    @staticmethod
+    def default(root='~/.bedrock'):
+        """
+        Return the ledger shared by all runs in this process (flushed on exit), or None if disabled (BEDROCK_LEDGER=0).
+        """
+        if os.environ.get('BEDROCK_LEDGER') == '0':
+            return None
+        path = os.path.expanduser(root)
+        with _ledgers_lock:
+            if path not in _ledgers:
+                _ledgers[path] = RunLedger(root)
+                atexit.register(_ledgers[path].flush)
+            return _ledgers[path]
+
+    def db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # runs may be flushed from worker threads (serialised by the spool lock)..
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._db.executescript('''
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY AUTOINCREMENT, started REAL, kind TEXT,
+                                                 blueprint TEXT, workspace TEXT, command TEXT, args TEXT, engine TEXT,
+                                                 image TEXT, image_id TEXT, host TEXT, docker_host TEXT, duration REAL,
+                                                 setup_duration REAL, run_duration REAL, exit_code INTEGER, log BLOB);
+                CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+                CREATE INDEX IF NOT EXISTS runs_blueprint ON runs (blueprint, workspace, started);
+            ''')
+        return self._db
+
+    def record(self, kind, blueprint_id, workspace, args, started, duration, exit_code, engine=None, image=None,
+               image_id=None, setup_duration=None, run_duration=None, log=None, docker_host=None):
+        """
+        Record a run (written when the ledger is flushed). An optional log (bytes) is stored compressed.
+        """
+        entry = {
+            'started': started,
+            'kind': kind,
+            'blueprint': blueprint_id,
+            'workspace': workspace,
+            'command': args[0] if args else kind,
+            'args': ' '.join(args),
+            'engine': engine,
+            'image': image,
+            'image_id': image_id,
+            'host': socket.gethostname(),
+            'docker_host': docker_host or os.environ.get('DOCKER_HOST'),
+            'duration': duration,
+            'setup_duration': setup_duration,
+            'run_duration': run_duration,
+            'exit_code': exit_code,
+            'log': zlib.compress(log) if log else None,
+        }
+        with self._lock:
+            self._pending.append(entry)
+
+    def flush(self):
+        """
+        Write recorded (and spooled) runs to the ledger. Returns the number of runs written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        with locked(self.spool_path):
+            spooled = self._read_spool()
+            entries = spooled + pending
+            if not entries:
+                return 0
+            try:
+                with self.db() as db:
+                    db.executemany(f"INSERT INTO runs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                                   ([entry[column] for column in COLUMNS] for entry in entries))
+            except sqlite3.Error:
+                # retain runs for the next flush..
+                if pending:
+                    with open(self.spool_path, 'a') as spool_file:
+                        for entry in pending:
+                            spool_file.write(json.dumps(dict(entry, log=entry['log'].hex() if entry['log'] else None))
+                                             + '\n')
+                return 0
+            if spooled:
+                os.remove(self.spool_path)
+        return len(entries)
+
+    def _read_spool(self):
+        try:
+            with open(self.spool_path, 'r') as spool_file:
+                entries = [json.loads(line) for line in spool_file if line.strip()]
+        except IOError:
+            return []
+        for entry in entries:
+            entry['log'] = bytes.fromhex(entry['log']) if entry['log'] else None
+        return entries
+
+    def runs(self, blueprint_id=None, workspace=None, command=None, since=None, failed=False, limit=None):
+        """
+        Return recorded runs (most recent first) matching the specified filters, as dicts (excluding logs).
+        """
+        self.flush()
+        sql, params = self._filter(f"SELECT id, {', '.join(c for c in COLUMNS if c != 'log')}, log IS NOT NULL "
+                                   f"FROM runs", blueprint_id, workspace, command, since, failed)
+        sql += ' ORDER BY started DESC'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        keys = ['id'] + [c for c in COLUMNS if c != 'log'] + ['has_log']
+        return [dict(zip(keys, row)) for row in self.db().execute(sql, params)]
+
+    def stats(self, group_by='blueprint', blueprint_id=None, workspace=None, command=None, since=None):
+        """
+        Aggregate run durations by a column (i.e. blueprint, workspace, command, kind or engine). Returns a list of
+        dicts with count, failures, mean, p50, p95 and max duration (in seconds).
+        """
+        if group_by not in ['blueprint', 'workspace', 'command', 'kind', 'engine', 'host']:
+            raise ValueError(f"Unsupported group: {group_by}")
+        self.flush()
+        sql, params = self._filter(f'SELECT {group_by}, duration, exit_code FROM runs', blueprint_id, workspace,
+                                   command, since)
+        groups = {}
+        for key, duration, exit_code in self.db().execute(sql + f' ORDER BY {group_by}, duration', params):
+            group = groups.setdefault(key, {'durations': [], 'failures': 0})
+            group['durations'].append(duration)
+            if exit_code not in [0, 2]:
+                group['failures'] += 1
+
+        return [{
+            group_by: key,
+            'count': len(group['durations']),
+            'failures': group['failures'],
+            'mean': sum(group['durations']) / len(group['durations']),
+            'p50': percentile(group['durations'], 50),
+            'p95': percentile(group['durations'], 95),
+            'max': group['durations'][-1],
+        } for key, group in groups.items()]
+
+    def log(self, run_id):
+        """
+        Return the recorded log of a run, or None if no log was recorded.
+        """
+        self.flush()
+        row = self.db().execute('SELECT log FROM runs WHERE id = ?', (run_id,)).fetchone()
+        return zlib.decompress(row[0]).decode('utf-8', errors='replace') if row is not None and row[0] else None
+
+    def compact(self, retention_days=None):
+        """
+        Remove runs older than the retention period, and reclaim unused space. Returns the number of runs removed.
+        """
+        self.flush()
+        retention_days = self.retention_days if retention_days is None else retention_days
+        db = self.db()
+        with db:
+            removed = db.execute('DELETE FROM runs WHERE started < ?',
+                                 (time.time() - retention_days * 86400,)).rowcount
+        if removed:
+            db.execute('VACUUM')
+        return removed
+
+    def _filter(self, sql, blueprint_id=None, workspace=None, command=None, since=None, failed=False):
+        clauses, params = [], []
+        for column, value in [('blueprint', blueprint_id), ('workspace', workspace)]:
+            if value is not None:
+                clauses.append(f'{column} GLOB ?' if any(c in value for c in '*?[') else f'{column} = ?')
+                params.append(value)
+        if command is not None:
+            clauses.append('command = ?')
+            params.append(command)
+        if since is not None:
+            clauses.append('started >= ?')
+            params.append(since)
+        if failed:
+            clauses.append('exit_code NOT IN (0, 2)')
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        return sql, params
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def percentile(values, p):
+    """
+    Return a percentile of sorted values (nearest rank).
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def parse_period(value):
+    """
+    Parse a time period (e.g. 30m, 12h, 7d) as a number of seconds.
+    """
+    match = re.fullmatch(r'(\d+)([smhd])', str(value))
+    if not match:
+        raise ValueError(f"Invalid time period: {value} (expected e.g. 30m, 12h, 7d)")
+    return int(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+
+
+def parse_since(value):
+    """
+    Parse a relative time (e.g. 30m, 12h, 7d) as a UNIX timestamp.
+    """
+    return time.time() - parse_period(value)
+
+
+class HistorySpec:
+
+    def __init__(self, dry_run=False, verbose=False):
+        # Enable dry run (skip compaction)
+        self.dry_run = dry_run
+
+        # Enable verbose logging
+        self.verbose = verbose
+
+        # Filters (blueprint and workspace may be glob patterns)
+        self.blueprint_id = None
+        self.workspace = None
+        self.command = None
+        self.since = None
+        self.failed = False
+
+        # Maximum number of runs listed
+        self.limit = 20
+
+        # Aggregate durations by a column (i.e. blueprint, workspace, command), instead of listing runs
+        self.stats = None
+
+        # Print the recorded log of a run
+        self.log_id = None
+
+        # Remove runs older than the retention period
+        self.compact = False
+        self.retention_days = None
+
+        # Output results as JSON lines
+        self.json_output = False
+
+    def run(self):
+        ledger = RunLedger()
+        try:
+            since = parse_since(self.since) if self.since is not None else None
+            if self.compact:
+                if self.dry_run:
+                    print("Dry run enabled. No changes will be made.")
+                    return 0
+                removed = ledger.compact(self.retention_days)
+                print(f"Removed {removed} runs older than {self.retention_days or ledger.retention_days} days")
+            elif self.log_id is not None:
+                log = ledger.log(self.log_id)
+                if log is None:
+                    print(f"No log recorded for run: {self.log_id}")
+                    return 1
+                sys.stdout.write(log)
+            elif self.stats is not None:
+                if not self.json_output:
+                    print(f"{self.stats.upper():<40} {'COUNT':>6} {'FAILED':>6} {'MEAN':>10} {'P50':>10} {'P95':>10} "
+                          f"{'MAX':>10}")
+                for row in ledger.stats(self.stats, self.blueprint_id, self.workspace, self.command, since):
+                    if self.json_output:
+                        print(json.dumps(row))
+                    else:
+                        print(f"{str(row[self.stats]):<40} {row['count']:>6} {row['failures']:>6} "
+                              f"{row['mean']:>9.2f}s {row['p50']:>9.2f}s {row['p95']:>9.2f}s {row['max']:>9.2f}s")
+            else:
+                for row in ledger.runs(self.blueprint_id, self.workspace, self.command, since, self.failed,
+                                       self.limit):
+                    if self.json_output:
+                        print(json.dumps(row))
+                    else:
+                        started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['started']))
+                        print(f"{row['id']:>6}  {started}  {row['blueprint']}\t{row['workspace']}\t{row['args']}\t"
+                              f"{row['exit_code']}\t{row['duration']:.2f}s{' *' if row['has_log'] else ''}")
+        except ValueError as e:
+            print(f"{ANSIColors.FAIL}{e}{ANSIColors.ENDC}")
+            return 1
+        finally:
+            ledger.close()
+
+        return 0
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+"""
+Execute a batch of blueprint commands declared in a manifest, in dependency order.
+
+Example manifest:
+
+    steps:
+      - name: ecr
+        blueprint: aws/ecr-repository
+        workspace: myapp-staging
+        command: apply -auto-approve
+      - name: task
+        blueprint: ecs/task-definition
+        command: apply -auto-approve
+        depends_on: [ecr]
+"""
+import hashlib
+import shlex
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from .blueprint import BlueprintSpec
+from .fanout import print_summary, worker_pool
+from .registry import BlueprintRegistry
+from .storage import read_json, write_json
+from .terraform import TerraformSpec
+from .utils import *
+
+
+class ManifestError(Exception):
+    pass
+
+
+class ManifestSpec:
+
+    def __init__(self, manifest_path, max_workers=4, resume=False, dry_run=False, verbose=False):
+        # Location of manifest file
+        self.manifest_path = manifest_path
+
+        # Maximum number of concurrent steps
+        self.max_workers = max_workers
+
+        # Skip steps that succeeded in the previous run of this manifest
+        self.resume = resume
+
+        # Enable dry run (skip container creation)
+        self.dry_run = dry_run
+
+        # Enable verbose logging
+        self.verbose = verbose
+
+        # Blueprint home directory
+        self.blueprint_home = '.'
+
+        # Docker client (shared across all steps)
+        self.client = None
+
+        # Cache of assumed role credentials (defaults to ~/.bedrock/credentials)
+        self.credential_cache = None
+
+    def run(self):
+        if self.dry_run:
+            print("Dry run enabled. No changes will be made.")
+
+        try:
+            steps = load_manifest(self.manifest_path)
+        except (IOError, ManifestError) as e:
+            print(f"{ANSIColors.FAIL}Invalid manifest: {e}{ANSIColors.ENDC}")
+            return 1
+
+        # resolve blueprints prior to execution..
+        registry = BlueprintRegistry(defaults=BlueprintSpec.default_blueprints)
+        unknown = sorted({step['blueprint'] for step in steps.values() if registry.get(step['blueprint']) is None})
+        if unknown:
+            print(f"{ANSIColors.FAIL}Unknown blueprints: {unknown}{ANSIColors.ENDC}")
+            return 1
+        for step in steps.values():
+            blueprint = registry.get(step['blueprint'])
+            step['image'] = blueprint['image']
+            step['role_arn'] = blueprint.get('role_arn')
+            step['workspace_roles'] = blueprint.get('workspace_roles') or {}
+            step['resources'] = blueprint.get('resources', {})
+
+        journal_path = os.path.expanduser(
+            f"~/.bedrock/runs/{hashlib.sha256(os.path.abspath(self.manifest_path).encode()).hexdigest()[:16]}.json")
+        journal = read_journal(journal_path) if self.resume else {}
+        completed = {name for name, result in journal.items() if result['status'] == 'succeeded'}
+        if self.verbose and completed:
+            print(f"Resuming manifest, skipping completed steps: {sorted(completed)}\n")
+
+        if not self.dry_run and self.client is None:
+            import docker
+
+            # share a single client (and connection pool) between steps..
+            self.client = docker.from_env(max_pool_size=self.max_workers)
+
+        results = {}
+        failed = set()
+        pending = {name: step for name, step in steps.items() if name not in completed}
+        running = {}
+        try:
+            with worker_pool(max(1, self.max_workers)) as executor:
+                while pending or running:
+                    # skip steps with failed dependencies..
+                    for name in [name for name, step in pending.items() if set(step['depends_on']) & failed]:
+                        print(f"[{name}] {ANSIColors.WARNING}Skipped due to failed dependencies{ANSIColors.ENDC}")
+                        del pending[name]
+                        failed.add(name)
+                        results[name] = (name, None, 0.0)
+                        journal[name] = {'status': 'skipped'}
+
+                    # schedule steps with completed dependencies..
+                    for name in [name for name, step in pending.items() if set(step['depends_on']) <= completed]:
+                        running[executor.submit(self.run_step, pending.pop(name))] = name
+
+                    if not running:
+                        break
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        results[name] = future.result()
+                        exit_code = results[name][1]
+                        (completed if exit_code == 0 else failed).add(name)
+                        journal[name] = {'status': 'succeeded' if exit_code == 0 else 'failed', 'exit_code': exit_code,
+                                         'duration': results[name][2]}
+                        save_journal(journal_path, journal)
+        except KeyboardInterrupt:
+            # steps that were running are not recorded as succeeded, so they are run again on resume..
+            save_journal(journal_path, journal)
+            return 130
+
+        save_journal(journal_path, journal)
+        print_summary([results[name] for name in steps if name in results], title='STEP')
+
+        return 1 if failed else 0
+
+    def run_step(self, step):
+        spec = TerraformSpec(step['blueprint'], None, dry_run=self.dry_run, verbose=self.verbose)
+        spec.blueprint_home = self.blueprint_home
+        spec.image = step['image']
+        spec.image_registry = BlueprintSpec.get_blueprint_registry()
+        spec.image_tag = BlueprintSpec.get_blueprint_tag()
+        spec.args = step['command']
+        spec.var_file = step.get('var_file')
+        spec.workspace = step.get('workspace')
+        spec.role_arn = step['role_arn']
+        spec.workspace_roles = step['workspace_roles']
+        spec.credential_cache = self.credential_cache
+        spec.resources = step['resources']
+        spec.concurrency = self.max_workers
+        spec.tty = False
+        spec.output_prefix = step['name']
+        spec.client = self.client
+
+        start = time.monotonic()
+        try:
+            exit_code = spec.run()
+        except Exception as e:
+            print(f"[{step['name']}] {ANSIColors.FAIL}{e}{ANSIColors.ENDC}")
+            exit_code = 1
+
+        return step['name'], exit_code, time.monotonic() - start
+
+
+def load_manifest(manifest_path):
+    """
+    Load and validate manifest steps, returning steps (keyed by name) in topological order.
+    """
+    import yaml
+
+    with open(manifest_path, 'r') as manifest_file:
+        manifest = yaml.safe_load(manifest_file) or {}
+
+    steps = {}
+    for index, step in enumerate(manifest.get('steps') or []):
+        if 'blueprint' not in step or 'command' not in step:
+            raise ManifestError(f"step {index} requires blueprint and command")
+        step = dict(step, name=str(step.get('name', index)))
+        if step['name'] in steps:
+            raise ManifestError(f"duplicate step name: {step['name']}")
+        if isinstance(step['command'], str):
+            step['command'] = shlex.split(step['command'])
+        step['depends_on'] = [str(name) for name in step.get('depends_on') or []]
+        steps[step['name']] = step
+
+    for step in steps.values():
+        unknown = set(step['depends_on']) - set(steps)
+        if unknown:
+            raise ManifestError(f"step {step['name']} depends on unknown steps: {sorted(unknown)}")
+
+    # order steps topologically (and detect cycles)..
+    ordered = {}
+    while len(ordered) < len(steps):
+        ready = [name for name, step in steps.items() if name not in ordered and set(step['depends_on']) <= set(ordered)]
+        if not ready:
+            raise ManifestError(f"dependency cycle between steps: {sorted(set(steps) - set(ordered))}")
+        for name in ready:
+            ordered[name] = steps[name]
+
+    return ordered
+
+
+def read_journal(path):
+    return read_json(path)
+
+
+def save_journal(path, journal):
+    write_json(path, journal)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+Capture blueprint outputs after apply, and resolve references to them (i.e. ${bedrock:<blueprint_id>/<output>}) in
+var files of dependent blueprints without running a container.
+"""
+import hashlib
+import time
+
+from .state import local_backend, state_outputs
+from .storage import atomic_write, locked, read_json
+from .utils import *
+
+# Reference to a blueprint output, with an optional workspace (defaults to the workspace of the dependent run)
+REFERENCE_PATTERN = re.compile(r'\$\{bedrock:(?P<blueprint>[^}@]+?)(?:@(?P<workspace>[^}/]+))?/(?P<output>[^}/]+)\}')
+
+
+class OutputIndex:
+    """
+    Outputs of each blueprint workspace (per blueprint home), recorded with the state serial at which they were
+    captured. Outputs of local state are refreshed from the state file when its serial is newer than the index.
+    """
+
+    def __init__(self, blueprint_home, root='~/.bedrock'):
+        # Blueprint home directory
+        self.blueprint_home = blueprint_home
+
+        # Location of the index (outputs may be sensitive, so files are only readable by the owner)
+        home_key = hashlib.sha256(os.path.abspath(os.path.expanduser(blueprint_home)).encode('utf-8')).hexdigest()
+        self.path = os.path.expanduser(f'{root}/outputs/{home_key[:16]}')
+
+    def index_file(self, blueprint_id):
+        return f'{self.path}/{blueprint_id}.json'
+
+    def save(self, blueprint_id, workspace, serial, outputs):
+        """
+        Record the outputs (as returned by `terraform output -json`) of a blueprint workspace.
+        """
+        path = self.index_file(blueprint_id)
+        with locked(path):
+            index = read_json(path)
+            index[workspace] = {'serial': serial, 'captured': time.time(), 'outputs': outputs}
+            atomic_write(path, f'{json.dumps(index, indent=2)}\n', mode=0o600)
+
+    def get(self, blueprint_id, workspace):
+        """
+        Return the outputs of a blueprint workspace, or None if outputs were never captured (and no local state exists).
+        """
+        entry = read_json(self.index_file(blueprint_id)).get(workspace)
+        if local_backend(blueprint_id, self.blueprint_home):
+            state_file = state_path(blueprint_id, self.blueprint_home, workspace)
+            serial = read_serial(state_file)
+            if serial and (entry is None or entry['serial'] is None or serial > entry['serial']):
+                outputs = state_outputs(state_file)
+                self.save(blueprint_id, workspace, serial, outputs)
+                return outputs
+        return entry['outputs'] if entry is not None else None
+
+    def capture(self, blueprint_id, workspace):
+        """
+        Capture outputs from local state. Returns False if outputs can't be read locally (i.e. a remote backend).
+        """
+        if not local_backend(blueprint_id, self.blueprint_home):
+            return False
+        state_file = state_path(blueprint_id, self.blueprint_home, workspace)
+        self.save(blueprint_id, workspace, read_serial(state_file), state_outputs(state_file))
+        return True
+
+
+def find_references(value):
+    """
+    Return all output references in a var file value, as (blueprint_id, workspace, output) tuples.
+    """
+    if isinstance(value, dict):
+        return [ref for v in value.values() for ref in find_references(v)]
+    elif isinstance(value, list):
+        return [ref for v in value for ref in find_references(v)]
+    elif isinstance(value, str):
+        return [match.group('blueprint', 'workspace', 'output') for match in REFERENCE_PATTERN.finditer(value)]
+    return []
+
+
+def resolve_references(value, lookup):
+    """
+    Replace output references in a var file value, using lookup(blueprint_id, workspace, output) to obtain output
+    values. A string consisting of a single reference is replaced by the output value (which may be a list or map),
+    otherwise references are interpolated.
+    """
+    if isinstance(value, dict):
+        return {k: resolve_references(v, lookup) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [resolve_references(v, lookup) for v in value]
+    elif isinstance(value, str):
+        match = REFERENCE_PATTERN.fullmatch(value)
+        if match:
+            return lookup(*match.group('blueprint', 'workspace', 'output'))
+
+        def interpolate(m):
+            resolved = lookup(*m.group('blueprint', 'workspace', 'output'))
+            if isinstance(resolved, (dict, list)):
+                raise ValueError(f"Unable to interpolate non-primitive output: {m.group(0)}")
+            return json.dumps(resolved) if isinstance(resolved, bool) else str(resolved)
+        return REFERENCE_PATTERN.sub(interpolate, value)
+    return value
+
+
+def resolve_var_file(var_file, workspace, index):
+    """
+    Resolve output references in a var file. Returns the resolved variables, or None if the var file has no references.
+    Raises ValueError listing all unresolved references.
+    """
+    variables = read_json(var_file)
+    references = find_references(variables)
+    if not references:
+        return None
+
+    outputs = {}
+    errors = []
+    for blueprint_id, ref_workspace, output in references:
+        ref_workspace = ref_workspace or workspace
+        if (blueprint_id, ref_workspace) not in outputs:
+            outputs[(blueprint_id, ref_workspace)] = index.get(blueprint_id, ref_workspace)
+        blueprint_outputs = outputs[(blueprint_id, ref_workspace)]
+        if blueprint_outputs is None:
+            errors.append(f"No outputs captured for {blueprint_id} (workspace: {ref_workspace}).. "
+                          f"apply the blueprint first")
+        elif output not in blueprint_outputs:
+            errors.append(f"Output not found: {output} ({blueprint_id}, workspace: {ref_workspace})")
+    if errors:
+        raise ValueError('\n'.join(dict.fromkeys(errors)))
+
+    return resolve_references(variables, lambda blueprint_id, ref_workspace, output: outputs[
+        (blueprint_id, ref_workspace or workspace)][output]['value'])
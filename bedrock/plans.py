@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+"""
+Cache Terraform plans by the content of their inputs, such that redundant plans may be skipped.
+"""
+import hashlib
+import shutil
+import time
+
+from .storage import read_json, write_json
+from .utils import *
+
+# Default maximum plan cache size (in MB)
+DEFAULT_CACHE_SIZE = 512
+
+# Default maximum age of cached plans (in hours)
+DEFAULT_CACHE_AGE = 24
+
+# Options that don't affect the content of a plan
+PLAN_NEUTRAL_OPTIONS = ['-auto-approve', '-input=false', '-no-color', '-detailed-exitcode', '-compact-warnings']
+
+
+class PlanCache:
+
+    # Location of the plan cache in blueprint containers
+    container_path = '/bedrock/plans'
+
+    def __init__(self, root='~/.bedrock', max_size=None, max_age=None):
+        # Host location of the plan cache
+        self.path = os.path.expanduser(f'{root}/plans')
+
+        # Maximum size of the cache (in bytes), after which least recently created plans are evicted
+        if max_size is None:
+            max_size = int(os.environ.get('BEDROCK_PLAN_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+        self.max_size = max_size * 1024 * 1024
+
+        # Maximum age of cached plans (in seconds)
+        if max_age is None:
+            max_age = float(os.environ.get('BEDROCK_PLAN_CACHE_AGE', DEFAULT_CACHE_AGE))
+        self.max_age = max_age * 3600
+
+    @staticmethod
+    def fingerprint(image_id, input_files, environment, workspace, args):
+        """
+        Calculate a fingerprint of all plan inputs: blueprint image, variable and backend files, variable overrides
+        (i.e. TF_VAR_*), workspace and plan options.
+        """
+        digest = hashlib.sha256()
+        digest.update(f'image={image_id}\nworkspace={workspace}\n'.encode('utf-8'))
+        for input_file in input_files:
+            digest.update(f'file={os.path.basename(input_file)}\n'.encode('utf-8'))
+            try:
+                with open(input_file, 'rb') as f:
+                    for chunk in iter(lambda: f.read(65536), b''):
+                        digest.update(chunk)
+            except IOError:
+                digest.update(b'<missing>')
+        for env_var in sorted(env for env in environment if env.startswith(('TF_VAR_', 'TF_ARGS='))):
+            digest.update(f'env={env_var}\n'.encode('utf-8'))
+        for arg in args[1:]:
+            if arg not in PLAN_NEUTRAL_OPTIONS:
+                digest.update(f'arg={arg}\n'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def entry_path(self, fingerprint):
+        return f'{self.path}/{fingerprint}'
+
+    def plan_file(self, fingerprint, container=True):
+        return f'{self.container_path if container else self.path}/{fingerprint}/plan.tfplan'
+
+    def log_file(self, fingerprint):
+        return f'{self.entry_path(fingerprint)}/output.log'
+
+    def init(self, fingerprint):
+        os.makedirs(self.entry_path(fingerprint), exist_ok=True)
+
+    def get(self, fingerprint, serial):
+        """
+        Return metadata for a cached plan, if the plan was created from the same state serial and has not expired.
+        """
+        if serial is None:
+            return None
+        meta = read_json(f'{self.entry_path(fingerprint)}/meta.json')
+        if not meta:
+            return None
+
+        if meta.get('serial') != serial or time.time() - meta['created'] > self.max_age \
+                or not os.path.exists(self.plan_file(fingerprint, container=False)):
+            return None
+        return meta
+
+    def save(self, fingerprint, serial, exit_code, workspace, args):
+        meta = {
+            'fingerprint': fingerprint,
+            'serial': serial,
+            'exit_code': exit_code,
+            'workspace': workspace,
+            'args': args,
+            'created': time.time()
+        }
+        write_json(f'{self.entry_path(fingerprint)}/meta.json', meta)
+
+    def replay(self, fingerprint, output):
+        """
+        Write the output of a cached plan to an output stream.
+        """
+        try:
+            with open(self.log_file(fingerprint), 'rb') as log_file:
+                for chunk in iter(lambda: log_file.read(65536), b''):
+                    output.write(chunk)
+        except IOError:
+            pass
+        output.close()
+
+    def remove(self, fingerprint):
+        shutil.rmtree(self.entry_path(fingerprint), ignore_errors=True)
+
+    def prune(self):
+        """
+        Evict expired plans, and the oldest plans until the cache is within the maximum size. Returns evicted paths.
+        """
+        entries = []
+        for entry in os.scandir(self.path) if os.path.isdir(self.path) else []:
+            if entry.is_dir():
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                entries.append((entry.path, size, entry.stat().st_mtime))
+        entries.sort(key=lambda e: e[2])
+
+        total_size = sum(size for _, size, _ in entries)
+        evicted = []
+        for path, size, created in entries:
+            if total_size <= self.max_size and time.time() - created <= self.max_age:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            evicted.append(path)
+            total_size -= size
+
+        return evicted
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+Instrument bedrock commands with named spans (e.g. image pull, container creation), reported to pluggable hooks.
+
+Spans are no-ops unless a hook is registered, such that instrumentation has negligible cost when profiling is disabled.
+A hook is any object implementing span_start(name, attrs) (returning a token) and span_end(token).
+"""
+import functools
+import os
+import threading
+import time
+
+from .storage import write_json
+
+# Registered span hooks
+_hooks = []
+
+
+def add_hook(hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+class Span:
+    __slots__ = ('name', 'attrs', 'tokens')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.tokens = None
+
+    def __enter__(self):
+        self.tokens = [(hook, hook.span_start(self.name, self.attrs)) for hook in _hooks]
+        return self
+
+    def __exit__(self, *exc_info):
+        for hook, token in reversed(self.tokens):
+            hook.span_end(token)
+        return False
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name, **attrs):
+    """
+    Return a context manager measuring a named phase.
+    """
+    return Span(name, attrs) if _hooks else NULL_SPAN
+
+
+def traced(name):
+    """
+    Decorate a function to measure each call as a named span.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return fn(*args, **kwargs)
+            with Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SpanRecorder:
+    """
+    A span hook that records completed spans, for a phase breakdown or export as Chrome trace events.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def span_start(self, name, attrs):
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        return name, attrs, depth, time.perf_counter()
+
+    def span_end(self, token):
+        name, attrs, depth, start = token
+        end = time.perf_counter()
+        self._local.depth = depth
+        with self._lock:
+            self.events.append({'name': name, 'attrs': attrs, 'depth': depth, 'start': start, 'end': end,
+                                'thread': threading.get_ident()})
+
+    def summary(self):
+        """
+        Aggregate spans by name (in order of first occurrence), returning a list of (name, depth, count, total
+        seconds) tuples.
+        """
+        phases = {}
+        for event in sorted(self.events, key=lambda e: e['start']):
+            phase = phases.setdefault(event['name'], [event['name'], event['depth'], 0, 0.0])
+            phase[1] = min(phase[1], event['depth'])
+            phase[2] += 1
+            phase[3] += event['end'] - event['start']
+        return [tuple(phase) for phase in phases.values()]
+
+    def print_summary(self, out=None):
+        if not self.events:
+            return
+        elapsed = max(e['end'] for e in self.events) - min(e['start'] for e in self.events)
+        print(f"\n{'PHASE':<40} {'COUNT':>6} {'TIME':>10} {'%':>6}", file=out)
+        for name, depth, count, total in self.summary():
+            percent = 100 * total / elapsed if elapsed > 0 else 0
+            print(f"{'  ' * depth + name:<40} {count:>6} {total * 1000:>8.1f}ms {percent:>6.1f}", file=out)
+
+    def write_trace(self, path):
+        """
+        Write recorded spans as Chrome trace events (viewable with chrome://tracing or Perfetto).
+        """
+        origin = min((e['start'] for e in self.events), default=0)
+        threads = {}
+        trace_events = [{
+            'name': e['name'],
+            'ph': 'X',
+            'ts': round((e['start'] - origin) * 1e6, 3),
+            'dur': round((e['end'] - e['start']) * 1e6, 3),
+            'pid': os.getpid(),
+            'tid': threads.setdefault(e['thread'], len(threads) + 1),
+            'args': {key: str(value) for key, value in e['attrs'].items()}
+        } for e in sorted(self.events, key=lambda e: e['start'])]
+        write_json(path, {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, indent=None)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+Indexed registry of available blueprints.
+"""
+import glob
+import json
+import sqlite3
+import uuid
+
+from .storage import read_json
+from .utils import *
+
+
+class BlueprintRegistry:
+    """
+    Blueprints are merged from (in order of precedence): ~/.bedrock/blueprints.json, namespaced registry files
+    (~/.bedrock/blueprints.d/*.json) and default blueprints. Merged blueprints are stored in an on-disk index that is
+    rebuilt only when a registry file is modified, such that lookups don't need to parse every registry file.
+    """
+
+    def __init__(self, root='~/.bedrock', defaults=None):
+        # Registry location
+        self.root = os.path.expanduser(root)
+
+        # Default blueprints (lowest precedence)
+        self.defaults = defaults or {}
+
+        # Location of the registry index
+        self.index_path = f'{self.root}/blueprints.idx'
+
+        self._db = None
+        self._signature = None
+        self._namespaced = None
+
+    def sources(self):
+        """
+        Registry files in order of increasing precedence, mapped to last modified time. Namespaced registry files are
+        only listed (and checked for modification) again when the blueprints.d directory is modified, i.e. when a file
+        is added, removed or replaced (as with an atomic write).
+        """
+        namespaced_path = f'{self.root}/blueprints.d'
+        try:
+            directory_mtime = os.stat(namespaced_path).st_mtime_ns
+        except OSError:
+            directory_mtime = None
+        if self._namespaced is None or self._namespaced[0] != directory_mtime:
+            paths = sorted(glob.glob(f'{namespaced_path}/*.json')) if directory_mtime is not None else []
+            self._namespaced = directory_mtime, file_mtimes(paths)
+        return {**self._namespaced[1], **file_mtimes([f'{self.root}/blueprints.json'])}
+
+    def get(self, blueprint_id):
+        row = self.db().execute('SELECT entry FROM blueprints WHERE id = ?', (blueprint_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def ids(self):
+        return [row[0] for row in self.db().execute('SELECT id FROM blueprints ORDER BY id')]
+
+    def all(self):
+        return {row[0]: json.loads(row[1]) for row in self.db().execute('SELECT id, entry FROM blueprints ORDER BY id')}
+
+    def search(self, query, limit=None):
+        """
+        Find blueprints matching a partial identifier, in order of preference: identifier prefix, identifier or image
+        substring, then fuzzy (subsequence) match. Returns a list of (blueprint_id, blueprint) tuples.
+        """
+        escaped = like_escape(query)
+        fuzzy = '%' + '%'.join(like_escape(c) for c in query) + '%'
+        queries = [
+            ('SELECT id, entry FROM blueprints WHERE id >= ? AND id < ? ORDER BY id', (query, query + '\uffff')),
+            ("SELECT id, entry FROM blueprints WHERE id LIKE ? ESCAPE '\\' OR image LIKE ? ESCAPE '\\' ORDER BY id",
+             (f'%{escaped}%', f'%{escaped}%')),
+            ("SELECT id, entry FROM blueprints WHERE id LIKE ? ESCAPE '\\' ORDER BY length(id), id", (fuzzy,)),
+        ]
+        for sql, params in queries:
+            if limit is not None:
+                sql += f' LIMIT {int(limit)}'
+            matches = [(row[0], json.loads(row[1])) for row in self.db().execute(sql, params)]
+            if matches:
+                return matches
+        return []
+
+    def db(self):
+        """
+        Open the registry index, rebuilding the index if registry files have been modified since it was created.
+        """
+        signature = json.dumps({'sources': self.sources(), 'defaults': self.defaults}, sort_keys=True)
+        if self._db is not None and self._signature == signature:
+            return self._db
+
+        self.close()
+        try:
+            db = sqlite3.connect(self.index_path)
+            row = db.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+            if row is not None and row[0] == signature:
+                self._db, self._signature = db, signature
+                return db
+            db.close()
+        except sqlite3.Error:
+            pass
+
+        self._db, self._signature = self.build_index(signature), signature
+        return self._db
+
+    def build_index(self, signature):
+        blueprints = dict(self.defaults)
+        for path in self.sources():
+            blueprints.update(read_blueprint_file(path))
+
+        try:
+            # build index in a temporary location, such that concurrent readers never see a partial index..
+            os.makedirs(self.root, exist_ok=True)
+            temp_path = f'{self.index_path}.{uuid.uuid4().hex}.tmp'
+            db = sqlite3.connect(temp_path)
+        except (OSError, sqlite3.Error):
+            temp_path = None
+            db = sqlite3.connect(':memory:')
+
+        db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        db.execute('CREATE TABLE IF NOT EXISTS blueprints (id TEXT PRIMARY KEY, image TEXT, entry TEXT)')
+        db.execute('DELETE FROM blueprints')
+        db.executemany('INSERT INTO blueprints VALUES (?, ?, ?)',
+                       ((blueprint_id, blueprint.get('image'), json.dumps(blueprint))
+                        for blueprint_id, blueprint in blueprints.items()))
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('signature', ?)", (signature,))
+        db.commit()
+
+        if temp_path is not None:
+            db.close()
+            os.replace(temp_path, self.index_path)
+            db = sqlite3.connect(self.index_path)
+
+        return db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def file_mtimes(paths):
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+    return mtimes
+
+
+def like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def read_blueprint_file(path):
+    return read_json(path)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""
+Derive container resource limits and Terraform parallelism from the resources of a host.
+"""
+import functools
+import weakref
+
+from .utils import *
+
+# CPU scheduling period (in microseconds) of container CPU quotas
+CPU_PERIOD = 100000
+
+# Terraform operations (i.e. -parallelism) per CPU, and bounds of derived parallelism
+OPERATIONS_PER_CPU = 4
+MIN_PARALLELISM = 2
+MAX_PARALLELISM = 64
+
+# Terraform's default parallelism (a single run is never limited below the default)
+TERRAFORM_PARALLELISM = 10
+
+# Memory required per concurrent Terraform operation (bounds parallelism when memory is constrained)
+MEMORY_PER_OPERATION = 128 * 1024 ** 2
+
+# Minimum memory limit of a container, and fraction of host memory retained for the host
+MIN_MEMORY = 512 * 1024 ** 2
+HOST_MEMORY_RESERVE = 0.1
+
+# Commands that accept -parallelism
+PARALLEL_COMMANDS = ['plan', 'apply', 'refresh', 'destroy']
+
+MEMORY_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+@functools.lru_cache(maxsize=None)
+def host_resources():
+    """
+    Return the CPUs and memory (in bytes) available to this process, respecting CPU affinity and cgroup limits.
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    quota = _read_cgroup('/sys/fs/cgroup/cpu.max')
+    if quota is not None and quota.split()[0] != 'max':
+        cpus = min(cpus, int(quota.split()[0]) / int(quota.split()[1]))
+    else:
+        quota, period = _read_cgroup('/sys/fs/cgroup/cpu/cpu.cfs_quota_us'), \
+            _read_cgroup('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+        if quota is not None and period is not None and int(quota) > 0:
+            cpus = min(cpus, int(quota) / int(period))
+
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        memory = None
+    for path in ['/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes']:
+        limit = _read_cgroup(path)
+        if limit is not None and limit.isdigit() and (memory is None or int(limit) < memory):
+            memory = int(limit)
+
+    return cpus, memory
+
+
+def _read_cgroup(path):
+    try:
+        with open(path, 'r') as cgroup_file:
+            return cgroup_file.read().strip()
+    except IOError:
+        return None
+
+
+# Resources of Docker daemons (by client), queried once per client
+_daemon_resources = weakref.WeakKeyDictionary()
+
+
+def daemon_resources(client):
+    """
+    Return the CPUs and memory (in bytes) of a Docker daemon (which may differ from the local host, e.g. a VM).
+    """
+    if client not in _daemon_resources:
+        info = client.api.info()
+        _daemon_resources[client] = info['NCPU'], info['MemTotal']
+    return _daemon_resources[client]
+
+
+def parse_memory(value):
+    """
+    Parse a memory size (e.g. 512m, 4g, or bytes) as a number of bytes.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([bkmgt]?)(?:i?b)?', str(value).strip().lower())
+    if not match:
+        raise ValueError(f"Invalid memory size: {value} (expected e.g. 512m, 4g)")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+
+def resource_budget(cpus, memory, concurrency=1, overrides=None):
+    """
+    Divide host resources between concurrent runs. Returns container limits (i.e. create_host_config arguments) and
+    Terraform parallelism for a run, applying (per-blueprint) overrides of cpus, memory and parallelism.
+    """
+    overrides = overrides or {}
+    concurrency = max(1, concurrency)
+
+    run_cpus = min(float(overrides.get('cpus', cpus / concurrency)), cpus)
+    limits = {'cpu_period': CPU_PERIOD, 'cpu_quota': max(1000, int(run_cpus * CPU_PERIOD))}
+
+    run_memory = None
+    if 'memory' in overrides:
+        run_memory = parse_memory(overrides['memory'])
+    elif memory:
+        run_memory = max(MIN_MEMORY, int(memory * (1 - HOST_MEMORY_RESERVE) / concurrency))
+    if run_memory is not None:
+        limits['mem_limit'] = run_memory
+
+    parallelism = overrides.get('parallelism')
+    if parallelism is None:
+        parallelism = max(MIN_PARALLELISM, min(MAX_PARALLELISM, round(run_cpus * OPERATIONS_PER_CPU)))
+        if run_memory is not None:
+            parallelism = max(MIN_PARALLELISM, min(parallelism, run_memory // MEMORY_PER_OPERATION))
+        if concurrency == 1:
+            parallelism = max(TERRAFORM_PARALLELISM, parallelism)
+
+    return limits, int(parallelism)
+
+
+def with_parallelism(args, parallelism):
+    """
+    Append -parallelism to Terraform args (for commands that support it), unless already specified.
+    """
+    if parallelism is None or not args or args[0] not in PARALLEL_COMMANDS \
+            or any(arg.startswith('-parallelism') for arg in args):
+        return list(args)
+    return list(args) + [f'-parallelism={parallelism}']
+
+
+def limits_enabled(overrides):
+    """
+    Whether resource limits apply (disabled with BEDROCK_RESOURCE_LIMITS=0, or per blueprint with resources: false).
+    """
+    return overrides is not False and os.environ.get('BEDROCK_RESOURCE_LIMITS') != '0'
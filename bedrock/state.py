@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+
+"""
+Answer read-only Terraform commands (workspace list/show, output, state list) natively from local state, without
+starting a blueprint container.
+"""
+import json
+import re
+
+from .utils import *
+
+# Size of chunks read from state files
+CHUNK_SIZE = 64 * 1024
+
+# Whitespace characters skipped between JSON tokens
+WHITESPACE = ' \t\n\r'
+
+# Characters that delimit objects, arrays and strings (and escapes within strings), scanned to find the end of a value
+VALUE_DELIMITERS = re.compile(r'["{}\[\]]')
+STRING_DELIMITERS = re.compile(r'["\\]')
+
+
+class JSONStream:
+    """
+    An incremental JSON parser over a file. Objects and arrays may be iterated one member at a time, such that only a
+    single member (e.g. one resource of a state file) is held in memory at once.
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Return the next non-whitespace character (without consuming it), or an empty string at end of file.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError(f"Invalid JSON: expected {' or '.join(chars)} at offset {self.pos}")
+        self.pos += 1
+        return c
+
+    def _scan(self):
+        """
+        Buffer the object, array or string at the current position until it is complete. Each character is scanned
+        once, and chunks are joined once, such that large values are buffered in linear time.
+        """
+        depth, in_string, escaped = 0, False, False
+        chunk, i = self.buffer, self.pos
+        chunks = []
+        while True:
+            if escaped:
+                # the escaped character begins the chunk..
+                i, escaped = i + 1, False
+            while True:
+                match = (STRING_DELIMITERS if in_string else VALUE_DELIMITERS).search(chunk, i)
+                if match is None:
+                    break
+                c, i = match.group(), match.end()
+                if c == '\\':
+                    if i == len(chunk):
+                        escaped = True
+                        break
+                    i += 1
+                    continue
+                if c == '"':
+                    in_string = not in_string
+                else:
+                    depth += 1 if c in '{[' else -1
+                if depth == 0 and not in_string:
+                    if chunks:
+                        self.buffer = self.buffer[self.pos:] + ''.join(chunks)
+                        self.pos = 0
+                    return
+
+            chunk, i = self.f.read(self.chunk_size), 0
+            if not chunk:
+                raise ValueError("Invalid JSON: unexpected end of file")
+            chunks.append(chunk)
+
+    def value(self):
+        """
+        Decode the next complete value.
+        """
+        if self.peek() in ('{', '[', '"'):
+            self._scan()
+            value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+            return value
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number at the end of the buffer may continue in the next chunk..
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def items(self):
+        """
+        Iterate the keys of an object. The value of each key must be consumed (e.g. with value(), items(), elements()
+        or skip()) before the next key is read.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """
+        Iterate the elements of an array. Each element must be consumed before the next element is read.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(',]') == ']':
+                return
+
+    def skip(self):
+        """
+        Skip the next value, decoding at most one member of an object or array at a time.
+        """
+        c = self.peek()
+        if c == '{':
+            for _ in self.items():
+                self.value()
+        elif c == '[':
+            for _ in self.elements():
+                self.value()
+        else:
+            self.value()
+
+
+def local_backend(path, root):
+    """
+    Determine whether a blueprint uses local state in the default location.
+    """
+    if backend_type(path, root) != 'local':
+        return False
+    try:
+        with open(f'{os.path.expanduser(f"{root}/{path}")}/backend.tf', 'r') as backend_file:
+            return re.search(r'^\s*(path|workspace_dir)\s*=', backend_file.read(), re.MULTILINE) is None
+    except IOError:
+        return True
+
+
+def read_state(state_file, sections):
+    """
+    Stream the top-level sections of a state file (version 4), yielding (section, stream) tuples for requested sections
+    (the section value must be consumed by the caller). Stops once all requested sections have been read.
+    """
+    with open(state_file, 'r') as f:
+        stream = JSONStream(f)
+        remaining = set(sections)
+        for key in stream.items():
+            if key == 'version':
+                version = stream.value()
+                if version < 4:
+                    raise ValueError(f"Unsupported state version: {version}")
+            elif key in remaining:
+                yield key, stream
+                remaining.discard(key)
+                if not remaining:
+                    return
+            else:
+                stream.skip()
+
+
+def state_outputs(state_file):
+    """
+    Return the outputs of a state file (empty if no state exists).
+    """
+    outputs = {}
+    if not os.path.exists(state_file):
+        return outputs
+    for _, stream in read_state(state_file, ['outputs']):
+        for name in stream.items():
+            outputs[name] = stream.value()
+    return outputs
+
+
+def resource_addresses(resource):
+    """
+    Return the addresses of all instances of a state resource (e.g. module.vpc.aws_subnet.private["a"]).
+    """
+    address = f"{resource['type']}.{resource['name']}"
+    if resource.get('mode') == 'data':
+        address = f'data.{address}'
+    if resource.get('module'):
+        address = f"{resource['module']}.{address}"
+
+    addresses = []
+    for instance in resource.get('instances') or []:
+        index_key = instance.get('index_key')
+        if index_key is None:
+            addresses.append(address)
+        else:
+            addresses.append(f'{address}[{json.dumps(index_key)}]')
+    return addresses
+
+
+def iter_resources(state_file):
+    """
+    Iterate the resources of a state file, reading one resource at a time.
+    """
+    if not os.path.exists(state_file):
+        return
+    for _, stream in read_state(state_file, ['resources']):
+        for _ in stream.elements():
+            yield stream.value()
+
+
+def state_resources(state_file):
+    """
+    Iterate the resource instance addresses of a state file.
+    """
+    for resource in iter_resources(state_file):
+        yield from resource_addresses(resource)
+
+
+def match_address(address, filters):
+    """
+    Match a resource address against address filters (a filter matches the resource itself, all of its instances, or
+    all resources in a module).
+    """
+    return not filters or any(address == f or address.startswith((f'{f}.', f'{f}[')) for f in filters)
+
+
+def format_output(value):
+    """
+    Format a primitive output value as rendered by Terraform, or return None for complex values.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (str, int, float)):
+        return json.dumps(value)
+    elif value is None:
+        return 'null'
+    return None
+
+
+class NativeStateSpec:
+
+    # Commands that may be answered natively
+    commands = [['workspace', 'list'], ['workspace', 'show'], ['output'], ['state', 'list']]
+
+    def __init__(self, blueprint_id, blueprint_home, workspace, verbose=False):
+
+        # Enable verbose logging
+        self.verbose = verbose
+
+        # Blueprint identifier
+        self.blueprint_id = blueprint_id
+
+        # Blueprint home directory
+        self.blueprint_home = blueprint_home
+
+        # Selected workspace
+        self.workspace = workspace
+
+    @staticmethod
+    def supports(args):
+        return any(args[:len(command)] == command for command in NativeStateSpec.commands)
+
+    def run(self, args, output):
+        """
+        Write the output of a read-only command, returning the exit code, or None if the command can't be answered
+        natively (e.g. remote backends or unsupported options).
+        """
+        if not self.supports(args) or not local_backend(self.blueprint_id, self.blueprint_home):
+            return None
+
+        try:
+            if args[0] == 'workspace':
+                return self.workspace_command(args[1], args[2:], output)
+            elif args[0] == 'output':
+                return self.output_command(args[1:], output)
+            else:
+                return self.state_list_command(args[2:], output)
+        except ValueError as e:
+            if self.verbose:
+                print(f"Unable to read state natively ({e}), falling back to container..")
+            return None
+
+    def workspace_command(self, command, args, output):
+        if args:
+            return None
+
+        if command == 'show':
+            output.write(f'{self.workspace}\n'.encode('utf-8'))
+        else:
+            blueprint_path = os.path.expanduser(f'{self.blueprint_home}/{self.blueprint_id}')
+            workspaces = {'default', self.workspace}
+            workspaces.update(os.path.basename(p) for p in glob.glob(f'{blueprint_path}/terraform.tfstate.d/*')
+                              if os.path.isdir(p))
+            for workspace in sorted(workspaces):
+                output.write(f"{'*' if workspace == self.workspace else ' '} {workspace}\n".encode('utf-8'))
+            output.write(b'\n')
+        output.close()
+        return 0
+
+    def output_command(self, args, output):
+        options = [arg for arg in args if arg.startswith('-')]
+        names = [arg for arg in args if not arg.startswith('-')]
+        if any(option not in ['-json', '-raw', '-no-color'] for option in options) or len(names) > 1 \
+                or ('-json' in options and '-raw' in options):
+            return None
+
+        outputs = state_outputs(state_path(self.blueprint_id, self.blueprint_home, self.workspace))
+        if names:
+            if names[0] not in outputs:
+                output.write(f'Error: Output "{names[0]}" not found\n'.encode('utf-8'), 'stderr')
+                output.close()
+                return 1
+            value = outputs[names[0]]['value']
+            if '-json' in options:
+                lines = [json.dumps(value, indent=2)]
+            elif '-raw' in options:
+                if isinstance(value, (dict, list)):
+                    return None
+                lines = [value if isinstance(value, str) else format_output(value)]
+            else:
+                lines = [format_output(value)]
+        elif '-json' in options:
+            # state omits sensitive when false, but Terraform always reports it..
+            lines = [json.dumps({name: {'sensitive': bool(entry.get('sensitive')), 'type': entry.get('type'),
+                                        'value': entry['value']} for name, entry in sorted(outputs.items())},
+                                indent=2)]
+        elif '-raw' in options:
+            return None
+        else:
+            lines = []
+            for name, output_value in sorted(outputs.items()):
+                value = '<sensitive>' if output_value.get('sensitive') else format_output(output_value['value'])
+                lines.append(f'{name} = {value}')
+
+        # complex values are rendered by Terraform (in HCL syntax)..
+        if None in lines:
+            return None
+
+        if not lines and not outputs:
+            output.write(b'Warning: No outputs found\n', 'stderr')
+        elif '-raw' in options:
+            output.write(lines[0].encode('utf-8'))
+        else:
+            output.write(''.join(f'{line}\n' for line in lines).encode('utf-8'))
+        output.close()
+        return 0
+
+    def state_list_command(self, args, output):
+        if any(arg.startswith('-') for arg in args):
+            return None
+
+        for address in state_resources(state_path(self.blueprint_id, self.blueprint_home, self.workspace)):
+            if match_address(address, args):
+                output.write(f'{address}\n'.encode('utf-8'))
+        output.close()
+        return 0
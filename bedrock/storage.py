@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+"""
+Concurrency-safe storage of bedrock configuration files.
+
+All writes are atomic (via a temporary file renamed over the target), such that readers never see a partial file,
+and read-modify-write updates are serialised with an advisory lock file.
+"""
+import contextlib
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # advisory locking is not supported on this platform..
+    fcntl = None
+
+
+@contextlib.contextmanager
+def locked(path, shared=False, blocking=True):
+    """
+    Hold an advisory lock associated with a file (using a separate lock file, as the target file itself is replaced on
+    write). Shared locks may be held concurrently, excluding only exclusive locks. Raises BlockingIOError if not
+    blocking and the lock is held.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{path}.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                        | (0 if blocking else fcntl.LOCK_NB))
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write(path, content, mode=None):
+    """
+    Write content to a file atomically.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=directory, prefix=f'.{os.path.basename(path)}.', delete=False) as f:
+        try:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            os.remove(f.name)
+            raise
+    if mode is not None:
+        os.chmod(f.name, mode)
+    elif os.path.exists(path):
+        os.chmod(f.name, os.stat(path).st_mode & 0o777)
+    else:
+        os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+    except (IOError, ValueError):
+        return {} if default is None else default
+
+
+def write_json(path, data, indent=2):
+    atomic_write(path, f'{json.dumps(data, indent=indent)}\n')
+
+
+def merge_patch(target, patch):
+    """
+    Apply a JSON merge patch (RFC 7386): objects are merged recursively, and null values remove keys.
+    """
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def update_json(path, patch):
+    """
+    Apply a JSON merge patch to a file, serialised with concurrent updates. Returns the updated content.
+    """
+    with locked(path):
+        data = merge_patch(read_json(path), patch)
+        write_json(path, data)
+        return data
+
+
+@contextlib.contextmanager
+def modify_json(path, default=None):
+    """
+    Read-modify-write a JSON file, serialised with concurrent updates. The yielded content may be modified in place,
+    and is written when the context exits without error.
+    """
+    with locked(path):
+        data = read_json(path, default)
+        yield data
+        write_json(path, data)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""
+Stream container output without a TTY.
+"""
+import codecs
+import datetime
+import json
+import sys
+import threading
+
+from .profile import span
+
+# Serialise writes from concurrent streams, such that lines are never interleaved..
+output_lock = threading.Lock()
+
+# Supported output formats
+OUTPUT_FORMATS = ['stream', 'json']
+
+
+class OutputStream:
+
+    # Maximum length of a buffered partial line before it is flushed (bounds memory for very long lines)
+    max_line_length = 64 * 1024
+
+    def __init__(self, prefix=None, out=None, err=None, output_format='stream', log=None, raw=False):
+        # Optional prefix for each output line (e.g. workspace name)
+        self.prefix = prefix
+
+        # Output files (defaults to stdout/stderr)
+        self.out = out
+        self.err = err
+
+        # Output format (stream: plain text lines, json: one JSON object per line)
+        self.output_format = output_format
+
+        # Optional (binary) file to record unformatted output
+        self.log = log
+
+        # Pass output through unchanged, rather than as complete lines (e.g. output -raw, unless prefixed or JSON)
+        self.raw = raw
+
+        self._decoders = {}
+        self._buffers = {}
+
+    def write(self, chunk, stream='stdout'):
+        """
+        Write a chunk of raw container output. Multi-byte characters split across chunks are decoded correctly, and
+        only complete lines are written.
+        """
+        if stream not in self._decoders:
+            self._decoders[stream] = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            self._buffers[stream] = ''
+
+        if self.raw and not self.prefix and self.output_format == 'stream':
+            self._write_raw(self._decoders[stream].decode(chunk), stream)
+            return
+
+        lines = (self._buffers[stream] + self._decoders[stream].decode(chunk)).split('\n')
+        self._buffers[stream] = lines.pop()
+        if len(self._buffers[stream]) > self.max_line_length:
+            lines.append(self._buffers[stream])
+            self._buffers[stream] = ''
+
+        self._write_lines(lines, stream)
+
+    def close(self):
+        for stream, decoder in self._decoders.items():
+            remaining = self._buffers[stream] + decoder.decode(b'', final=True)
+            self._buffers[stream] = ''
+            if self.raw and not self.prefix and self.output_format == 'stream':
+                self._write_raw(remaining, stream)
+            elif remaining:
+                self._write_lines([remaining], stream)
+
+    def _write_raw(self, text, stream):
+        if not text:
+            return
+
+        if self.log is not None:
+            self.log.write(text.encode('utf-8'))
+
+        out = (self.err or sys.stderr) if stream == 'stderr' else (self.out or sys.stdout)
+        with output_lock:
+            out.write(text)
+            out.flush()
+
+    def _write_lines(self, lines, stream):
+        if not lines:
+            return
+
+        if self.log is not None:
+            self.log.write(''.join(f'{line}\n' for line in lines).encode('utf-8'))
+
+        if self.output_format == 'json':
+            out = self.out or sys.stdout
+            timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            source = {'source': self.prefix} if self.prefix else {}
+            lines = [json.dumps({'ts': timestamp, 'stream': stream, **source, 'line': line}) for line in lines]
+        else:
+            out = (self.err or sys.stderr) if stream == 'stderr' else (self.out or sys.stdout)
+            if self.prefix:
+                lines = [f'[{self.prefix}] {line}' for line in lines]
+
+        with output_lock:
+            for line in lines:
+                out.write(f'{line}\n')
+            out.flush()
+
+
+class TeeFile:
+    """
+    A (binary) file that writes to multiple files, e.g. to record output in more than one log.
+    """
+
+    def __init__(self, *files):
+        self.files = files
+
+    def write(self, data):
+        for f in self.files:
+            f.write(data)
+
+
+def stream_container(client, container, output):
+    """
+    Start a (non-TTY) container and stream its output until exit, returning the container exit code.
+    """
+    # attach prior to start to ensure no output is missed..
+    with span('container.start'):
+        logs = client.api.attach(container, stdout=True, stderr=True, stream=True, logs=True, demux=True)
+        client.api.start(container)
+    with span('container.output'):
+        try:
+            for stdout, stderr in logs:
+                if stdout:
+                    output.write(stdout, 'stdout')
+                if stderr:
+                    output.write(stderr, 'stderr')
+        finally:
+            output.close()
+
+        return client.api.wait(container)['StatusCode']
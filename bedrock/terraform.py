@@ -1,20 +1,23 @@
 #!/usr/bin/env python3
 
 """
-Execute Terraform blueprints as Docker containers.
+Execute Terraform blueprints as Docker containers (or natively, see executors).
 """
-import docker
-import docker.errors
-import dockerpty
-from .utils import *
+import contextlib
+import io
+import time
 
+from .profile import span, traced
+from .utils import *
 
 class TerraformSpec:
 
-    tf_commands = ['apply', 'destroy', 'force-unlock', 'graph', 'import', 'init', 'output', 'plan', 'providers', 'refresh', 'show',
-                   'state', 'taint', 'untaint', 'version', 'workspace']
+    tf_commands = TF_COMMANDS
 
     def __init__(self, blueprint_id, instance_name, pull_image=False, dry_run=False, verbose=False):
+        from .cache import PluginCache
+        from .ledger import RunLedger
+
         # Docker image
         self.image = 'hashicorp/terraform'
         self.image_tag = None
@@ -53,7 +56,99 @@ class TerraformSpec:
         # Command string passed to the container
         self.args = ['workspace', 'new']
 
+        # Workspace override (defaults to the current workspace)
+        self.workspace = None
+
+        # Allocate a TTY for interactive execution (otherwise output is streamed)
+        self.tty = True
+
+        # Prefix for streamed output lines
+        self.output_prefix = None
+
+        # Format of streamed output (i.e. stream, json)
+        self.output_format = 'stream'
+
+        # Destination of streamed output (defaults to stdout)
+        self.output_file = None
+
+        # Docker client (shared across concurrent runs, or created per run if not specified)
+        self.client = None
+
+        # Provider plugin cache shared across blueprints (disabled if None)
+        self.plugin_cache = PluginCache()
+
+        # Cache of plans by input fingerprint (disabled if None)
+        self.plan_cache = None
+
+        # Role assumed for the run (per-workspace roles override the default role)
+        self.role_arn = None
+        self.workspace_roles = {}
+
+        # Cache of assumed role credentials (shared across runs)
+        self.credential_cache = None
+
+        # Capture outputs after apply, for reference by other blueprints (i.e. ${bedrock:<blueprint_id>/<output>})
+        self.capture_outputs = True
+
+        # Ledger recording each run (disabled if None)
+        self.ledger = RunLedger.default()
+
+        # Record (non-TTY) output in the ledger
+        self.record_log = False
+
+        # Docker endpoint of the client (if not the default), and whether the daemon doesn't share the local filesystem
+        # (files are copied to and from containers instead of being bind mounted, so host caches should be disabled)
+        self.docker_host = None
+        self.remote = False
+
+        # Execution engine (i.e. docker, or native to run a host Terraform binary against extracted configuration)
+        self.engine = 'docker'
+
+        # Answer read-only commands (e.g. output, state list) from local state without a container where possible
+        self.native_state = True
+
+        # Resource overrides from the registry entry (i.e. cpus, memory, parallelism), or False to disable limits
+        self.resources = {}
+
+        # Number of concurrent runs sharing the host (host resources are divided between them)
+        self.concurrency = 1
+
+        # CPUs and memory (in bytes) of the Docker host (queried from the daemon if None)
+        self.host_resources = None
+
+        # Validate variables against the blueprint's variable declarations before running (disabled with
+        # BEDROCK_VALIDATE_VARIABLES=0)
+        self.validate_variables = os.environ.get('BEDROCK_VALIDATE_VARIABLES') != '0'
+
+    def build_command(self, workspace, args=None, var_file=None):
+        args = args or self.args
+        if var_file is None:
+            var_file = f'/work/{os.path.basename(self.var_file)}' if self.var_file is not None \
+                else f'{workspace}.tfvars.json'
+        if args[0] in ['plan', 'apply', 'refresh', 'destroy']:
+            return ' '.join(args) + f' -var-file="{var_file}" /blueprint'
+        elif args[0] in ['import']:
+            return args[0] + f' -config=/blueprint -var-file="{var_file}" ' + ' '.join(args[1:])
+        elif args[0] not in ['output', 'show', 'state', 'taint', 'untaint', 'version', 'workspace']:
+            return ' '.join(args) + ' /blueprint'
+        else:
+            return ' '.join(args)
+
+    @traced('terraform')
     def run(self):
+        from .cache import PluginCache
+        from .credentials import CredentialCache, role_environment, role_for
+        from .executors import Execution, create_executor
+        from .hosts import HostUnavailable, connection_errors
+        from .images import ImageManager, image_name
+        from .plans import PlanCache
+        from .resources import with_parallelism
+        from .state import NativeStateSpec
+        from .stream import OutputStream, TeeFile
+        from .variables import VALIDATED_COMMANDS, plan_file_arg
+
+        started = time.time()
+        start = time.perf_counter()
 
         if self.dry_run:
             print("Dry run enabled. No changes will be made.")
@@ -64,15 +159,16 @@ class TerraformSpec:
 
         imported_vars = []
         environment = []
-        for env_var in self.evars:
-            if append_env(environment, env_var, True):
-                imported_vars.append(env_var)
+        with span('environment'):
+            for env_var in self.evars:
+                if append_env(environment, env_var, True):
+                    imported_vars.append(env_var)
 
-        # Append optional environment variables..
-        for env_var in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN', 'AWS_PROFILE', 'TF_ARGS',
-                        'http_proxy', 'https_proxy', 'no_proxy']:
-            if append_env(environment, env_var):
-                imported_vars.append(env_var)
+            # Append optional environment variables..
+            for env_var in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN', 'AWS_PROFILE',
+                            'TF_ARGS', 'http_proxy', 'https_proxy', 'no_proxy']:
+                if append_env(environment, env_var):
+                    imported_vars.append(env_var)
 
         if self.verbose:
             print(f"Imported environment variables: {imported_vars}\n")
@@ -86,29 +182,52 @@ class TerraformSpec:
             environment.append(f'TF_VAR_{cvar[0]}={cvar[1]}')
 
         # Configure variables..
-        workspace = current_workspace(self.blueprint_id, self.blueprint_home)
-
-        if self.args[0] in ['plan', 'apply', 'refresh', 'destroy']:
-            if self.var_file is not None:
-                run_command = ' '.join(self.args) + f' -var-file="{os.path.basename(self.var_file)}" /blueprint'
-            else:
-                run_command = ' '.join(self.args) + f' -var-file="{workspace}.tfvars.json" /blueprint'
-
-        elif self.args[0] in ['import']:
-            if self.var_file is not None:
-                run_command = self.args[0] + f' -config=/blueprint -var-file="{os.path.basename(self.var_file)}" ' + ' '.join(self.args[1:])
-            else:
-                run_command = self.args[0] + f' -config=/blueprint -var-file="{workspace}.tfvars.json" ' + ' '.join(self.args[1:])
-        elif self.args[0] not in ['output', 'show', 'state', 'taint', 'untaint', 'version', 'workspace']:
-            run_command = ' '.join(self.args) + ' /blueprint'
+        if self.workspace is not None:
+            workspace = self.workspace
+            environment.append(f'TF_WORKSPACE={workspace}')
         else:
-            run_command = ' '.join(self.args)
+            workspace = current_workspace(self.blueprint_id, self.blueprint_home)
+
+        # raw output values are written unchanged (i.e. without a trailing newline)..
+        raw = self.args[0] == 'output' and '-raw' in self.args
+        if self.native_state and not self.dry_run and NativeStateSpec.supports(self.args):
+            output = OutputStream(self.output_prefix, out=self.output_file, output_format=self.output_format, raw=raw)
+            with span('native_state'):
+                exit_code = NativeStateSpec(self.blueprint_id, self.blueprint_home, workspace,
+                                            verbose=self.verbose).run(self.args, output)
+            if exit_code is not None:
+                return exit_code
+
+        role_arn = role_for(workspace, self.role_arn, self.workspace_roles)
+        if role_arn is not None:
+            if self.verbose:
+                print(f"Assuming role: {role_arn}\n")
+            if not self.dry_run:
+                try:
+                    with span('credentials'):
+                        credentials = (self.credential_cache or CredentialCache()).get(
+                            role_arn, session_name=f"bedrock-{self.blueprint_id.replace('/', '-')}"[:64])
+                except Exception as e:
+                    print(f"{ANSIColors.FAIL}Unable to assume role {role_arn}: {e}{ANSIColors.ENDC}")
+                    return 1
+                role_environment(environment, credentials)
 
         # Initialise working directory
         if self.verbose:
             print(f"Initialising current workspace: {workspace}\n")
 
-        init_config(self.blueprint_id, self.blueprint_home, workspace)
+        with span('init_config'):
+            init_config(self.blueprint_id, self.blueprint_home, workspace)
+
+        # Resolve references to outputs of other blueprints..
+        var_file = None
+        if self.args[0] in ['plan', 'apply', 'refresh', 'destroy', 'import']:
+            try:
+                with span('outputs.resolve'):
+                    var_file = self.resolve_outputs(workspace)
+            except ValueError as e:
+                print(f"{ANSIColors.FAIL}Unable to resolve blueprint outputs:\n{e}{ANSIColors.ENDC}")
+                return 1
 
         # Configure container volumes..
         volumes = {
@@ -137,52 +256,300 @@ class TerraformSpec:
                 'bind': f'/work/{os.path.basename(self.var_file)}',
                 'mode': 'ro'
             }
+        if self.plugin_cache is not None:
+            # share downloaded providers across blueprints and workspaces..
+            environment.append(f'TF_PLUGIN_CACHE_DIR={PluginCache.container_path}')
+            volumes[self.plugin_cache.path] = {
+                'bind': PluginCache.container_path,
+                'mode': 'rw'
+            }
 
         # Run container..
         if not self.dry_run:
-            container = None
+            # docker client libraries are slow to import, so only load them when a container is required..
+            with span('docker.import'):
+                import docker
+                import docker.errors
+
+            # Generate a unique instance name to avoid collisions with concurrent runs..
+            instance_name = self.instance_name or container_name(self.blueprint_id, workspace)
+
+            if self.plugin_cache is not None:
+                self.plugin_cache.init()
+
+            client = None
+            image_manager = None
+            image_ref = image_name(self.image, self.image_registry)
+            image_key = f"{image_ref}:{self.image_tag or 'latest'}"
+            cached_plan = None
+            plan_log = None
+            run_log = None
+            run_duration = None
+            executing = False
+            exit_code = 1
             try:
                 print("Initialising Docker..")
 
-                client = docker.from_env()
+                with span('docker.from_env'):
+                    client = self.client or docker.from_env()
 
                 # container = client.containers.run(spec.image, spec.command, privileged=True, network_mode='host',
                 #                   remove=True, environment=environment, volumes=volumes, stdin_open=True, tty=True, detach=True)
 
-                if self.image_registry is not None:
-                    image_ref = self.image_registry + "/" + self.image
-                else:
-                    image_ref = self.image
-
-                if self.pull_image:
-                    client.api.pull(image_ref, self.image_tag)
+                # pull image if missing locally (or out of date when pull is requested)..
+                with span('image.ensure', image=image_ref):
+                    image_manager = ImageManager(client)
+                    pulled = image_manager.ensure(image_ref, self.image_tag, pull=self.pull_image)
+                if pulled and self.verbose:
+                    print(f"Pulled image: {image_ref}\n")
 
                 if self.image_tag is not None:
                     image_ref += ":" + self.image_tag
 
+                with span('resources'):
+                    limits, parallelism = self.resource_budget(client)
+                args = with_parallelism(self.args, parallelism)
+                run_command = self.build_command(workspace, args, var_file)
+
+                if self.validate_variables and self.args[0] in VALIDATED_COMMANDS and not plan_file_arg(self.args):
+                    try:
+                        with span('variables.validate'):
+                            self.check_variables(client, image_ref, workspace, environment, var_file)
+                    except ValueError as e:
+                        print(f"{ANSIColors.FAIL}Invalid variables:\n{e}{ANSIColors.ENDC}")
+                        return exit_code
+
+                tty = self.tty
+                output = OutputStream(self.output_prefix, out=self.output_file, output_format=self.output_format,
+                                      raw=raw)
+                if self.ledger is not None and self.record_log and not tty:
+                    run_log = io.BytesIO()
+                    output.log = run_log
+
+                if self.plan_cache is not None and self.args[0] in ['plan', 'apply'] \
+                        and not any(arg.startswith('-out') for arg in self.args):
+                    with span('plan_cache.lookup'):
+                        fingerprint = self.plan_cache.fingerprint(client.api.inspect_image(image_ref)['Id'],
+                                                                  self.plan_inputs(workspace, var_file), environment,
+                                                                  workspace,
+                                                                  self.args)
+                        serial = state_serial(self.blueprint_id, self.blueprint_home, workspace)
+                        cached_plan = self.plan_cache.get(fingerprint, serial)
+
+                    if self.args[0] == 'plan' and cached_plan is not None:
+                        print(f"Inputs and state unchanged, using cached plan: {fingerprint[:12]}")
+                        self.plan_cache.replay(fingerprint, output)
+                        exit_code = cached_plan['exit_code']
+                        return exit_code
+                    elif self.args[0] == 'plan' and serial is not None:
+                        # save plan for reuse (output is streamed, as TTY output can't be recorded for replay)..
+                        tty = False
+                        self.plan_cache.init(fingerprint)
+                        plan_log = open(self.plan_cache.log_file(fingerprint), 'wb')
+                        output.log = plan_log if run_log is None else TeeFile(plan_log, run_log)
+                        run_command = self.build_command(workspace, args + [
+                            f'-out={self.plan_cache.plan_file(fingerprint)}'], var_file)
+                    elif self.args[0] == 'apply' and cached_plan is not None:
+                        if '-auto-approve' in self.args:
+                            print(f"Inputs and state unchanged, applying cached plan: {fingerprint[:12]}")
+                            run_command = ' '.join(arg for arg in args if not arg.startswith('-var')) \
+                                + f' {self.plan_cache.plan_file(fingerprint)}'
+                        else:
+                            # a saved plan is applied without confirmation, so an interactive apply plans again..
+                            cached_plan = None
+
+                    volumes[self.plan_cache.path] = {
+                        'bind': PlanCache.container_path,
+                        'mode': 'rw'
+                    }
+
                 print(f"Running Terraform command: {run_command}")
 
                 if self.verbose:
-                    print(f"Creating container from image: {image_ref}\n")
-
-                container = client.api.create_container(image_ref, run_command, self.instance_name,
-                                                        working_dir='/work',
-                                                        host_config=client.api.create_host_config(binds=volumes,
-                                                                                                  network_mode='host'),
-                                                        stdin_open=True, tty=True, environment=environment)
-
-                dockerpty.start(client.api, container)
-
-                # logs = container.logs(stream=True)
-                # for log in logs:
-                #     try:
-                #         print(log.decode('utf-8'), end='')
-                #     except UnicodeDecodeError:
-                #         print(log)
+                    print(f"Executing with engine: {self.engine} ({image_ref})\n")
+
+                # Propagate the Terraform exit code..
+                executor = create_executor(self.engine, client, remote=self.remote)
+                run_start = time.perf_counter()
+                executing = True
+                # providers in the plugin cache must not be evicted while the container may use them..
+                with self.plugin_cache.in_use() if self.plugin_cache is not None else contextlib.nullcontext():
+                    exit_code = executor.run(Execution(
+                        image_ref, run_command, instance_name, environment, volumes,
+                        labels=container_labels(self.blueprint_id, workspace), tty=tty, output=output,
+                        limits=limits))
+                    run_duration = time.perf_counter() - run_start
+
+                    if exit_code == 0 and self.capture_outputs and self.args[0] in ['apply', 'destroy']:
+                        with span('outputs.capture'):
+                            self.save_outputs(executor, Execution(
+                                image_ref, 'output -json', instance_name, environment, volumes,
+                                labels=container_labels(self.blueprint_id, workspace), limits=limits), workspace)
+
+                if plan_log is not None:
+                    plan_log.close()
+                    if exit_code in [0, 2]:
+                        self.plan_cache.save(fingerprint, serial, exit_code, workspace, self.args)
+                    else:
+                        self.plan_cache.remove(fingerprint)
+                elif self.plan_cache is not None and cached_plan is not None:
+                    # a saved plan can only be applied once..
+                    self.plan_cache.remove(fingerprint)
 
             except KeyboardInterrupt:
                 print(f"Aborting {self.blueprint_id}..")
-                if container is not None:
-                    container.stop()
+                exit_code = 130
             except docker.errors.ImageNotFound:
-                print(f"Blueprint image not found {image_ref}.. did you run with --pull option?")
+                print(f"{ANSIColors.FAIL}Blueprint image could not be pulled: {image_ref} (check the image name, "
+                      f"tag and registry credentials){ANSIColors.ENDC}")
+            except connection_errors() as e:
+                if executing:
+                    raise
+                # nothing has run, so the run may be retried with another Docker host..
+                raise HostUnavailable(str(e)) from e
+            finally:
+                if plan_log is not None and not plan_log.closed:
+                    plan_log.close()
+                    self.plan_cache.remove(fingerprint)
+                if self.ledger is not None:
+                    duration = time.perf_counter() - start
+                    self.ledger.record('terraform', self.blueprint_id, workspace, self.args, started, duration,
+                                       exit_code, engine=self.engine, image=image_ref,
+                                       image_id=image_manager.image_ids.get(image_key) if image_manager else None,
+                                       setup_duration=duration - run_duration if run_duration is not None else None,
+                                       run_duration=run_duration,
+                                       log=run_log.getvalue() if run_log is not None else None,
+                                       docker_host=self.docker_host)
+
+            with span('cache.prune'):
+                if self.plan_cache is not None:
+                    self.plan_cache.prune()
+
+                if self.plugin_cache is not None:
+                    self.plugin_cache.touch(f'{self.blueprint_home}/{self.blueprint_id}')
+                    evicted = self.plugin_cache.prune(wait=False)
+                    if self.verbose and evicted:
+                        print(f"Evicted {len(evicted)} providers from plugin cache\n")
+
+            return exit_code
+
+        return 0
+
+    def resource_budget(self, client):
+        """
+        Container limits and Terraform parallelism for the run, dividing host resources between concurrent runs (and
+        applying per-blueprint overrides). Returns ({}, None) if resource limits are disabled.
+        """
+        from .resources import daemon_resources, host_resources, limits_enabled, resource_budget
+
+        if not limits_enabled(self.resources):
+            return {}, None
+        if self.host_resources is not None:
+            cpus, memory = self.host_resources
+        elif self.engine == 'docker':
+            cpus, memory = daemon_resources(client)
+        else:
+            cpus, memory = host_resources()
+        limits, parallelism = resource_budget(cpus, memory, self.concurrency, self.resources)
+        if self.verbose:
+            print(f"Resource limits: {limits} (parallelism: {parallelism})\n")
+        return limits, parallelism
+
+    def check_variables(self, client, image_ref, workspace, environment, var_file=None):
+        """
+        Validate variables against the variables declared by the blueprint (schemas are cached by image digest),
+        following Terraform precedence: auto-loaded var files, TF_VAR_* environment variables, the var file, then
+        -var-file and -var arguments. Raises ValueError listing all errors.
+        """
+        from .executors import BlueprintCache
+        from .variables import SchemaCache, auto_var_files, read_var_file, validate_variables, var_file_args, \
+            variable_args
+
+        labels = container_labels(self.blueprint_id, workspace)
+        # declarations are read from configuration extracted for native runs (rather than with another container)..
+        with BlueprintCache().use(client, image_ref, labels) if self.engine == 'native' else contextlib.nullcontext():
+            schema = SchemaCache().get(client, image_ref, labels)
+        if schema is None:
+            return
+
+        def declared(variables):
+            # Terraform ignores (or only warns of) undeclared variables in the environment and other var files..
+            return {name: value for name, value in variables.items() if name in schema}
+
+        blueprint_path = os.path.expanduser(f'{self.blueprint_home}/{self.blueprint_id}')
+        sources = [(os.path.basename(path), declared(read_var_file(path)), False)
+                   for path in auto_var_files(blueprint_path)]
+        sources.append(('TF_VAR', declared({env_var.partition('=')[0][len('TF_VAR_'):]: env_var.partition('=')[2]
+                                            for env_var in environment if env_var.startswith('TF_VAR_')}), True))
+        host_var_file = self.plan_inputs(workspace, var_file)[0]
+        sources.append((os.path.basename(host_var_file), read_json(host_var_file, {}), False))
+        check_required = True
+        for path in var_file_args(self.args):
+            # var files are relative to the working directory (/work)..
+            host_path = os.path.join(blueprint_path, os.path.relpath(path, '/work')) if path.startswith('/work/') \
+                else os.path.join(blueprint_path, path) if not os.path.isabs(path) else None
+            if host_path is None or not os.path.isfile(host_path):
+                # variables of a var file that can't be read may be required..
+                check_required = False
+                continue
+            sources.append((os.path.basename(path), declared(read_var_file(host_path)), False))
+        sources.append(('-var', variable_args(self.args), True))
+        validate_variables(schema, sources, check_required)
+
+    def plan_inputs(self, workspace, var_file=None):
+        """
+        Files that determine the content of a plan (in addition to the blueprint image).
+        """
+        blueprint_path = os.path.expanduser(f'{self.blueprint_home}/{self.blueprint_id}')
+        if var_file is not None:
+            # resolved var file (container path)..
+            var_file = f'{blueprint_path}/{os.path.relpath(var_file, "/work")}'
+        elif self.var_file is not None:
+            var_file = os.path.abspath(self.var_file)
+        else:
+            var_file = f'{blueprint_path}/{workspace}.tfvars.json'
+        return [var_file, f'{blueprint_path}/backend.tf']
+
+    def resolve_outputs(self, workspace):
+        """
+        Resolve references to blueprint outputs in the var file, returning the location of the resolved var file
+        (container path), or None if the var file has no references.
+        """
+        from .outputs import OutputIndex, resolve_var_file
+
+        blueprint_path = os.path.expanduser(f'{self.blueprint_home}/{self.blueprint_id}')
+        var_file = os.path.abspath(self.var_file) if self.var_file is not None \
+            else f'{blueprint_path}/{workspace}.tfvars.json'
+        resolved_file = f'{blueprint_path}/.bedrock/resolved/{workspace}.tfvars.json'
+
+        variables = resolve_var_file(var_file, workspace, OutputIndex(self.blueprint_home))
+        if variables is None:
+            if os.path.exists(resolved_file) and not self.dry_run:
+                os.remove(resolved_file)
+            return None
+
+        if self.verbose:
+            print(f"Resolved blueprint outputs: {resolved_file}\n")
+        if not self.dry_run:
+            atomic_write(resolved_file, f'{json.dumps(variables, indent=2)}\n', mode=0o600)
+        return f'/work/.bedrock/resolved/{workspace}.tfvars.json'
+
+    def save_outputs(self, executor, execution, workspace):
+        """
+        Capture outputs after a successful apply, from local state if possible (otherwise with `terraform output`).
+        """
+        from .outputs import OutputIndex
+        from .stream import OutputStream
+
+        index = OutputIndex(self.blueprint_home)
+        if index.capture(self.blueprint_id, workspace):
+            return
+
+        # warnings (on stderr) are reported rather than captured, such that only the JSON document is parsed..
+        out = io.StringIO()
+        execution.output = OutputStream(self.output_prefix, out=out)
+        if executor.run(execution) == 0:
+            try:
+                index.save(self.blueprint_id, workspace, None, json.loads(out.getvalue()))
+            except ValueError:
+                print(f"{ANSIColors.WARNING}Unable to capture outputs for {self.blueprint_id}{ANSIColors.ENDC}")
@@ -1,7 +1,20 @@
 #!/usr/bin/env python3
+import fnmatch
+import glob
 import os
 import pathlib
 import json
+import re
+import uuid
+
+from .storage import atomic_write, locked, modify_json, read_json, update_json, write_json
+
+# Label applied to all containers managed by bedrock (used to reap orphaned containers)..
+MANAGED_LABEL = 'bedrock.managed'
+
+# Terraform commands run by blueprints (known to the CLI without importing the Terraform executor)..
+TF_COMMANDS = ['apply', 'destroy', 'force-unlock', 'graph', 'import', 'init', 'output', 'plan', 'providers', 'refresh',
+               'show', 'state', 'taint', 'untaint', 'version', 'workspace']
 
 
 def init_path(path, root):
@@ -13,35 +26,54 @@ def init_config(path, root, workspace='default'):
     init_path(path, root)
     config_path = f'{os.path.expanduser(f"{root}/{path}")}/{workspace}.tfvars.json'
     if not os.path.exists(config_path):
-        with open(config_path, 'w') as config_file:
-            config_file.write('{}\n')
+        try:
+            # exclusive create, such that concurrent runs never truncate existing config..
+            with open(config_path, 'x') as config_file:
+                config_file.write('{}\n')
+        except FileExistsError:
+            pass
 
 
 def write_backend(path, root, backend):
     init_path(path, root)
 
-    with open(f'{os.path.expanduser(f"{root}/{path}")}/backend.tf', 'w') as config_file:
-        config_file.write(backend + '\n')
+    atomic_write(f'{os.path.expanduser(f"{root}/{path}")}/backend.tf', backend + '\n')
 
 
-def write_config(path, root, id, config):
+def write_config(path, root, id, config, merge=True):
+    """
+    Write workspace variable config. By default config is merged with existing config (as a JSON merge patch, such
+    that null values remove variables), otherwise existing config is replaced.
+    """
     init_path(path, root)
 
-    with open(f'{os.path.expanduser(f"{root}/{path}")}/{id}.tfvars.json', 'w') as config_file:
-        config_file.write(f'{json.dumps(config, indent=2)}\n')
+    config_path = f'{os.path.expanduser(f"{root}/{path}")}/{id}.tfvars.json'
+    if merge:
+        return update_json(config_path, config)
+    else:
+        with locked(config_path):
+            write_json(config_path, config)
+        return config
+
+
+def blueprints_path(root='~/.bedrock'):
+    return f'{os.path.expanduser(f"{root}")}/blueprints.json'
 
 
 def read_blueprints(root='~/.bedrock'):
-    try:
-        with open(f'{os.path.expanduser(f"{root}")}/blueprints.json', 'r') as blueprint_file:
-            return json.load(blueprint_file)
-    except IOError:
-        return {}
+    return read_json(blueprints_path(root))
 
 
 def save_blueprints(blueprints, root='~/.bedrock'):
-    with open(f'{os.path.expanduser(f"{root}")}/blueprints.json', 'w') as blueprint_file:
-        blueprint_file.write(f'{json.dumps(blueprints, indent=2)}\n')
+    with locked(blueprints_path(root)):
+        write_json(blueprints_path(root), blueprints)
+
+
+def update_blueprints(patch, root='~/.bedrock'):
+    """
+    Apply a JSON merge patch to registered blueprints, serialised with concurrent updates.
+    """
+    return update_json(blueprints_path(root), patch)
 
 
 def current_workspace(path, root):
@@ -52,6 +84,102 @@ def current_workspace(path, root):
         return 'default'
 
 
+def backend_type(path, root):
+    """
+    Return the type of backend configured for a blueprint (defaults to local).
+    """
+    try:
+        with open(f'{os.path.expanduser(f"{root}/{path}")}/backend.tf', 'r') as backend_file:
+            match = re.search(r'^\s*backend\s+"([^"]+)"', backend_file.read(), re.MULTILINE)
+            return match.group(1) if match else 'local'
+    except IOError:
+        return 'local'
+
+
+def state_path(path, root, workspace='default'):
+    """
+    Return the location of local state for a blueprint workspace.
+    """
+    if workspace == 'default':
+        return f'{os.path.expanduser(f"{root}/{path}")}/terraform.tfstate'
+    return f'{os.path.expanduser(f"{root}/{path}")}/terraform.tfstate.d/{workspace}/terraform.tfstate'
+
+
+def state_serial(path, root, workspace='default'):
+    """
+    Return the serial of local state for a blueprint workspace (0 if no state exists), or None for remote backends.
+    """
+    if backend_type(path, root) != 'local':
+        return None
+    return read_serial(state_path(path, root, workspace))
+
+
+def read_serial(state_file):
+    """
+    Return the serial of a state file (0 if the file doesn't exist).
+    """
+    try:
+        # serial is declared at the start of the state file, so avoid reading the entire file..
+        with open(state_file, 'r') as f:
+            match = re.search(r'"serial"\s*:\s*(\d+)', f.read(4096))
+            return int(match.group(1)) if match else None
+    except IOError:
+        return 0
+
+
+def list_workspaces(path, root):
+    """
+    List known workspaces for a blueprint, as identified by local state or variable configuration.
+    """
+    blueprint_path = os.path.expanduser(f'{root}/{path}')
+    workspaces = {'default'}
+    workspaces.update(os.path.basename(p) for p in glob.glob(f'{blueprint_path}/terraform.tfstate.d/*')
+                      if os.path.isdir(p))
+    workspaces.update(os.path.basename(p)[:-len('.tfvars.json')] for p in glob.glob(f'{blueprint_path}/*.tfvars.json'))
+    return sorted(workspaces)
+
+
+def match_workspaces(patterns, workspaces):
+    """
+    Resolve a list of workspace names and/or glob patterns against known workspaces.
+    """
+    matched = []
+    for pattern in patterns:
+        if any(c in pattern for c in '*?['):
+            matched += [ws for ws in fnmatch.filter(workspaces, pattern) if ws not in matched]
+        elif pattern not in matched:
+            matched.append(pattern)
+    return matched
+
+
+def container_name(blueprint_id, workspace, prefix='bedrock'):
+    """
+    Generate a unique container name for a blueprint run, such that concurrent runs don't collide.
+    """
+    name = re.sub(r'[^a-zA-Z0-9_.-]', '_', f'{prefix}_{blueprint_id}_{workspace}')
+    return f'{name}_{uuid.uuid4().hex[:8]}'
+
+
+def container_labels(blueprint_id, workspace):
+    return {
+        MANAGED_LABEL: 'true',
+        'bedrock.blueprint': blueprint_id,
+        'bedrock.workspace': workspace
+    }
+
+
+def remove_container(client, container):
+    """
+    Remove a container, ignoring containers that have already been removed.
+    """
+    import docker.errors
+
+    try:
+        client.api.remove_container(container, force=True)
+    except docker.errors.NotFound:
+        pass
+
+
 def append_env(environment, env_var, warn_missing=False):
     if env_var in os.environ:
         environment.append(f'{env_var}={os.environ[env_var]}')
@@ -62,16 +190,6 @@ def append_env(environment, env_var, warn_missing=False):
     return False
 
 
-# def assume_role(role_arn, role_session_name, role_duration):
-#     sts = boto3.client('sts')
-#     response = sts.assume_role(RoleArn=role_arn, RoleSessionName=role_session_name, DurationSeconds=role_duration)
-#     credentials = response['Credentials']
-#
-#     os.putenv('AWS_ACCESS_KEY_ID', credentials['AccessKeyId'])
-#     os.putenv('AWS_SECRET_ACCESS_KEY', credentials['SecretAccessKey'])
-#     os.putenv('AWS_SESSION_TOKEN', credentials['SessionToken'])
-#
-
 class ANSIColors:
     HEADER = '\033[95m'
     OKBLUE = '\033[94m'
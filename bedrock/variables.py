@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+
+"""
+Extract variable declarations from blueprint configuration, and validate variables against them before a run.
+"""
+import difflib
+import glob
+import tarfile
+
+from .archive import IterStream, member_path
+from .storage import atomic_write, read_json, update_json
+from .utils import *
+
+# Version of the cached schema format (schemas of an older version are re-extracted)
+SCHEMA_VERSION = 1
+
+# Commands that read variables
+VALIDATED_COMMANDS = ['plan', 'apply', 'refresh', 'destroy']
+
+# Options of these commands that don't take a value (i.e. a following argument is positional)
+BOOLEAN_OPTIONS = ['auto-approve', 'compact-warnings', 'destroy', 'detailed-exitcode', 'input', 'json', 'lock',
+                   'no-color', 'refresh', 'refresh-only']
+
+PRIMITIVE_TYPES = ['string', 'number', 'bool', 'any']
+COLLECTION_TYPES = ['list', 'set', 'map']
+
+# Value of a variable in a var file that isn't a JSON-compatible literal (i.e. specified, but not type checked)
+UNKNOWN = object()
+
+HEREDOC_PATTERN = re.compile(r'<<-?([A-Za-z_][\w-]*)[ \t]*\n')
+VARIABLE_PATTERN = re.compile(r'(?:^|\n)\s*variable\s+"([^"]+)"\s*\{')
+TOKEN_PATTERN = re.compile(r'\s*(?:("(?:[^"\\]|\\.)*")|([A-Za-z_][\w-]*)|(-?\d+(?:\.\d+)?)|(\S))')
+
+
+class SchemaCache:
+    """
+    Variable schemas of blueprint images, keyed by image digest such that configuration is only read when an image
+    changes. A schema maps each variable to its type, and whether it is required (i.e. has no default).
+    """
+
+    def __init__(self, root='~/.bedrock'):
+        # Location of cached schemas
+        self.path = os.path.expanduser(f'{root}/schemas')
+
+        # Location of configuration extracted by the native engine (read instead of the image where available)
+        self.extracted_path = os.path.expanduser(f'{root}/extracted')
+
+        # Image digest each image reference last resolved to (such that schemas are found without a Docker daemon)
+        self.images_path = f'{self.path}/images.json'
+
+    def entry_path(self, image_id):
+        return os.path.join(self.path, re.sub(r'[^\w.-]', '_', image_id) + '.json')
+
+    def cached(self, image_ref):
+        """
+        Return the cached variable schema of the image an image reference last resolved to (without a Docker daemon),
+        or None if not cached.
+        """
+        image_id = read_json(self.images_path).get(tagged(image_ref))
+        entry = read_json(self.entry_path(image_id)) if image_id is not None else {}
+        return entry['variables'] if entry.get('version') == SCHEMA_VERSION else None
+
+    def get(self, client, image_ref, labels=None):
+        """
+        Return the variable schema of an image, reading blueprint configuration if not already cached. Returns None if
+        the image has no blueprint configuration.
+        """
+        image_id = client.api.inspect_image(image_ref)['Id']
+        if read_json(self.images_path).get(tagged(image_ref)) != image_id:
+            update_json(self.images_path, {tagged(image_ref): image_id})
+        entry_path = self.entry_path(image_id)
+        entry = read_json(entry_path)
+        if entry is not None and entry.get('version') == SCHEMA_VERSION:
+            return entry['variables']
+
+        extracted_path = os.path.join(self.extracted_path, re.sub(r'[^\w.-]', '_', image_id))
+        if os.path.isdir(extracted_path):
+            variables = read_schema(extracted_path)
+        else:
+            variables = extract_schema(client, image_ref, container_name('schema', 'default', prefix='bedrock_schema'),
+                                       labels)
+
+        atomic_write(entry_path, json.dumps({'version': SCHEMA_VERSION, 'image': image_ref,
+                                             'variables': variables}, separators=(',', ':')))
+        return variables
+
+
+def tagged(image_ref):
+    """
+    Qualify an image reference with the latest tag, if untagged (as resolved by the Docker daemon).
+    """
+    return image_ref if ':' in image_ref.rsplit('/', 1)[-1] or '@' in image_ref else f'{image_ref}:latest'
+
+
+def extract_schema(client, image_ref, name, labels=None):
+    """
+    Read variable declarations from the blueprint configuration (/blueprint) of an image, using a container that is
+    never started. Returns None if the image has no blueprint configuration.
+    """
+    import docker.errors
+
+    container = client.api.create_container(image_ref, ['true'], name, entrypoint=[], labels=labels or {})
+    try:
+        try:
+            chunks, _ = client.api.get_archive(container, '/blueprint')
+        except docker.errors.NotFound:
+            return None
+
+        variables = {}
+        with tarfile.open(fileobj=IterStream(chunks), mode='r|') as archive:
+            for member in archive:
+                path = member_path(member)
+                # only the root module declares the blueprint's input variables..
+                if member.isfile() and path is not None and os.path.dirname(path) == '' \
+                        and path.endswith(('.tf', '.tf.json')):
+                    content = archive.extractfile(member).read().decode('utf-8', errors='replace')
+                    variables.update(parse_variables(content, json_syntax=path.endswith('.json')))
+        return variables
+    finally:
+        remove_container(client, container)
+
+
+def read_schema(config_path):
+    """
+    Read variable declarations from blueprint configuration in a directory.
+    """
+    variables = {}
+    for entry in sorted(os.listdir(config_path)):
+        if entry.endswith(('.tf', '.tf.json')):
+            with open(os.path.join(config_path, entry), 'r', errors='replace') as config_file:
+                variables.update(parse_variables(config_file.read(), json_syntax=entry.endswith('.json')))
+    return variables
+
+
+def parse_variables(content, json_syntax=False):
+    """
+    Parse variable declarations (type, and whether a default is specified) from Terraform configuration.
+    """
+    if json_syntax:
+        try:
+            declarations = json.loads(content).get('variable') or {}
+        except (ValueError, AttributeError):
+            return {}
+        return {name: schema_entry(parse_type(str(block.get('type', 'any'))), 'default' not in block,
+                                   block.get('nullable', True))
+                for name, block in declarations.items() if isinstance(block, dict)}
+
+    content = strip_comments(content)
+    variables = {}
+    for match in VARIABLE_PATTERN.finditer(content):
+        body = content[match.end():matching_brace(content, match.end() - 1)]
+        attributes = {}
+        for statement in split_statements(body):
+            key, separator, value = statement.partition('=')
+            if separator and re.fullmatch(r'\s*\w+\s*', key):
+                attributes[key.strip()] = value.strip()
+        variables[match.group(1)] = schema_entry(parse_type(attributes.get('type', 'any')), 'default' not in attributes,
+                                                 attributes.get('nullable') != 'false')
+    return variables
+
+
+def schema_entry(type_, required, nullable=True):
+    entry = {'type': type_, 'required': required}
+    if not nullable:
+        entry['nullable'] = False
+    return entry
+
+
+def skip_literal(content, i):
+    """
+    Return the index following a string (including template interpolations) or heredoc starting at an index, or the
+    index itself if no literal starts there.
+    """
+    if content[i] == '"':
+        i += 1
+        depth = 0
+        while i < len(content):
+            if depth == 0 and content[i] == '\\':
+                i += 2
+                continue
+            if depth == 0 and content[i] == '"':
+                return i + 1
+            if content[i] == '"':
+                i = skip_literal(content, i)
+                continue
+            if depth == 0 and content[i] in '$%' and content.startswith('{', i + 1):
+                depth, i = 1, i + 2
+                continue
+            if depth > 0 and content[i] in '{}':
+                depth += 1 if content[i] == '{' else -1
+            i += 1
+        return i
+
+    heredoc = HEREDOC_PATTERN.match(content, i) if content.startswith('<<', i) else None
+    if heredoc is not None:
+        end = re.compile(rf'\n[ \t]*{re.escape(heredoc.group(1))}[ \t]*(?=\n|$)').search(content, heredoc.end() - 1)
+        return end.end() if end is not None else len(content)
+    return i
+
+
+def strip_comments(content):
+    """
+    Remove comments (i.e. #, // and /* */) from configuration, retaining strings and heredocs.
+    """
+    result = []
+    i = 0
+    while i < len(content):
+        end = skip_literal(content, i)
+        if end > i:
+            result.append(content[i:end])
+            i = end
+        elif content.startswith(('#', '//'), i):
+            i = content.find('\n', i) if '\n' in content[i:] else len(content)
+        elif content.startswith('/*', i):
+            i = content.find('*/', i + 2) + 2 if '*/' in content[i + 2:] else len(content)
+            result.append(' ')
+        else:
+            result.append(content[i])
+            i += 1
+    return ''.join(result)
+
+
+def matching_brace(content, i):
+    """
+    Return the index of the bracket closing the bracket at an index (or the end of the content if unbalanced).
+    """
+    depth = 0
+    while i < len(content):
+        end = skip_literal(content, i)
+        if end > i:
+            i = end
+            continue
+        if content[i] in '{[(':
+            depth += 1
+        elif content[i] in '}])':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return len(content)
+
+
+def split_statements(body):
+    """
+    Split a block body into attributes and nested blocks (separated by newlines outside of brackets and literals).
+    """
+    statements = []
+    start = i = 0
+    while i < len(body):
+        end = skip_literal(body, i)
+        if end > i:
+            i = end
+        elif body[i] in '{[(':
+            i = matching_brace(body, i) + 1
+        elif body[i] == '\n':
+            statements.append(body[start:i])
+            start = i = i + 1
+        else:
+            i += 1
+    statements.append(body[start:])
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def parse_type(expression):
+    """
+    Parse a type constraint (e.g. list(string), map(object({ name = string, port = optional(number) }))) into a
+    compact form: a primitive type name, or a list of [kind, element type(s)]. Unsupported syntax parses as any.
+    """
+    expression = expression.strip()
+    if expression.startswith('"') and expression.endswith('"'):
+        # legacy (0.11) quoted type keywords..
+        expression = expression[1:-1]
+        if expression in COLLECTION_TYPES:
+            return [expression, 'any']
+
+    tokens = [next(value for value in match.groups() if value is not None)
+              for match in TOKEN_PATTERN.finditer(expression) if any(match.groups())]
+    try:
+        type_, position = _parse_type(tokens, 0)
+    except (IndexError, ValueError):
+        return 'any'
+    return type_ if position == len(tokens) else 'any'
+
+
+def _expect(tokens, position, token):
+    if tokens[position] != token:
+        raise ValueError(f"Expected {token}: {tokens[position]}")
+    return position + 1
+
+
+def _parse_type(tokens, position):
+    kind = tokens[position]
+    position += 1
+    if kind in PRIMITIVE_TYPES:
+        return kind, position
+
+    position = _expect(tokens, position, '(')
+    if kind in COLLECTION_TYPES:
+        element, position = _parse_type(tokens, position)
+        return [kind, element], _expect(tokens, position, ')')
+    elif kind == 'tuple':
+        position = _expect(tokens, position, '[')
+        elements = []
+        while tokens[position] != ']':
+            element, position = _parse_type(tokens, position)
+            elements.append(element)
+            if tokens[position] == ',':
+                position += 1
+        return ['tuple', elements], _expect(tokens, position + 1, ')')
+    elif kind == 'object':
+        position = _expect(tokens, position, '{')
+        attributes, optional = {}, []
+        while tokens[position] != '}':
+            name = tokens[position].strip('"')
+            position += 1
+            if tokens[position] not in ['=', ':']:
+                raise ValueError(f"Expected attribute type: {name}")
+            position += 1
+            if tokens[position] == 'optional':
+                attributes[name], position = _parse_optional(tokens, position + 1)
+                optional.append(name)
+            else:
+                attributes[name], position = _parse_type(tokens, position)
+            if tokens[position] == ',':
+                position += 1
+        return ['object', attributes, optional], _expect(tokens, position + 1, ')')
+    raise ValueError(f"Unsupported type: {kind}")
+
+
+def _parse_optional(tokens, position):
+    position = _expect(tokens, position, '(')
+    type_, position = _parse_type(tokens, position)
+    # skip the default value (if any)..
+    depth = 1
+    while depth:
+        depth += {'(': 1, '[': 1, '{': 1, ')': -1, ']': -1, '}': -1}.get(tokens[position], 0)
+        position += 1
+    return type_, position
+
+
+def format_type(type_):
+    if isinstance(type_, str):
+        return type_
+    if type_[0] == 'tuple':
+        return f"tuple([{', '.join(format_type(element) for element in type_[1])}])"
+    if type_[0] == 'object':
+        return f"object({{{', '.join(f'{name} = {format_type(attr)}' for name, attr in type_[1].items())}}})"
+    return f'{type_[0]}({format_type(type_[1])})'
+
+
+def type_errors(value, type_, path):
+    """
+    Return errors converting a (JSON) value to a type, following Terraform conversion rules (e.g. "3" is a number).
+    """
+    if value is None or type_ == 'any':
+        return []
+    kind = type_ if isinstance(type_, str) else type_[0]
+    if kind == 'string':
+        valid = not isinstance(value, (dict, list))
+    elif kind == 'number':
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool) or \
+            isinstance(value, str) and re.fullmatch(r'\s*-?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*', value) is not None
+    elif kind == 'bool':
+        valid = isinstance(value, bool) or value in ['true', 'false']
+    elif kind in ['list', 'set', 'tuple']:
+        if not isinstance(value, list):
+            return [f"{path}: expected {format_type(type_)}, got {json.dumps(value)}"]
+        if kind == 'tuple':
+            if len(value) != len(type_[1]):
+                return [f"{path}: expected {len(type_[1])} elements, got {len(value)}"]
+            return [error for index, (element, element_type) in enumerate(zip(value, type_[1]))
+                    for error in type_errors(element, element_type, f'{path}[{index}]')]
+        return [error for index, element in enumerate(value) for error in type_errors(element, type_[1],
+                                                                                      f'{path}[{index}]')]
+    else:
+        if not isinstance(value, dict):
+            return [f"{path}: expected {format_type(type_)}, got {json.dumps(value)}"]
+        if kind == 'map':
+            return [error for key, element in value.items() for error in type_errors(element, type_[1],
+                                                                                     f'{path}.{key}')]
+        errors = [f"{path}: missing attribute {name}" for name in type_[1] if name not in value
+                  and name not in type_[2]]
+        return errors + [error for name, attr in type_[1].items() if name in value
+                         for error in type_errors(value[name], attr, f'{path}.{name}')]
+    return [] if valid else [f"{path}: expected {kind}, got {json.dumps(value)}"]
+
+
+def parse_raw(value, type_):
+    """
+    Parse a variable specified as a string (i.e. TF_VAR_<name> or -var), which is a literal for primitive types and an
+    expression otherwise. Returns None if the expression can't be evaluated (i.e. isn't JSON compatible).
+    """
+    if isinstance(type_, str):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+def validate_variables(schema, sources, check_required=True):
+    """
+    Validate variables against a schema. Sources are (description, variables, raw) tuples, where raw variables are
+    strings (i.e. environment or command-line variables). Raises ValueError listing all errors.
+    """
+    errors = []
+    for description, variables, raw in sources:
+        for name, value in variables.items():
+            if name not in schema:
+                suggestion = difflib.get_close_matches(name, schema, n=1)
+                errors.append(f"{description}: undeclared variable {name}" +
+                              (f" (did you mean {suggestion[0]}?)" if suggestion else ''))
+                continue
+            if value is UNKNOWN:
+                continue
+            if raw:
+                value = parse_raw(value, schema[name]['type'])
+            elif value is None and not schema[name].get('nullable', True):
+                errors.append(f"{description}: {name} must not be null")
+            errors.extend(f"{description}: {error}" for error in type_errors(value, schema[name]['type'], name))
+
+    if check_required:
+        specified = {name for _, variables, _ in sources for name in variables}
+        errors.extend(f"Missing required variable: {name}" for name, entry in sorted(schema.items())
+                      if entry['required'] and name not in specified)
+
+    if errors:
+        raise ValueError('\n'.join(dict.fromkeys(errors)))
+
+
+def read_var_file(path):
+    """
+    Read variables from a var file (.tfvars or .tfvars.json). Values of .tfvars files that aren't JSON-compatible
+    literals (e.g. HCL objects or heredocs) are UNKNOWN. Returns an empty dict if the file doesn't exist.
+    """
+    if path.endswith('.json'):
+        return read_json(path, {})
+    try:
+        with open(path, 'r', errors='replace') as var_file:
+            content = strip_comments(var_file.read())
+    except IOError:
+        return {}
+
+    variables = {}
+    for statement in split_statements(content):
+        name, separator, value = statement.partition('=')
+        if separator and re.fullmatch(r'\s*[A-Za-z_][\w-]*\s*', name):
+            try:
+                variables[name.strip()] = json.loads(value)
+            except ValueError:
+                variables[name.strip()] = UNKNOWN
+    return variables
+
+
+def auto_var_files(path):
+    """
+    Return var files in a directory that Terraform loads automatically (terraform.tfvars and *.auto.tfvars, with their
+    JSON variants), in the order they are loaded.
+    """
+    var_files = [f'{path}/{name}' for name in ['terraform.tfvars', 'terraform.tfvars.json']
+                 if os.path.isfile(f'{path}/{name}')]
+    return var_files + sorted(glob.glob(f'{path}/*.auto.tfvars') + glob.glob(f'{path}/*.auto.tfvars.json'))
+
+
+def var_file_args(args):
+    """
+    Return var files specified as command-line arguments (i.e. -var-file path, -var-file=path).
+    """
+    var_files = []
+    for index, arg in enumerate(args):
+        if arg.startswith('-var-file='):
+            var_files.append(arg[len('-var-file='):].strip('\'"'))
+        elif arg == '-var-file' and index + 1 < len(args):
+            var_files.append(args[index + 1].strip('\'"'))
+    return var_files
+
+
+def variable_args(args):
+    """
+    Return variables specified as command-line arguments (i.e. -var name=value, -var=name=value).
+    """
+    variables = {}
+    for index, arg in enumerate(args):
+        value = None
+        if arg.startswith('-var='):
+            value = arg[len('-var='):]
+        elif arg == '-var' and index + 1 < len(args):
+            value = args[index + 1]
+        if value is not None and '=' in value:
+            name, _, value = value.partition('=')
+            variables[name] = value.strip('\'"')
+    return variables
+
+
+def plan_file_arg(args):
+    """
+    Return the saved plan applied by an apply command (e.g. apply tfplan), if any (variables are then read from the
+    plan). Options other than boolean flags take a value, which may follow as a separate argument (e.g. -out tfplan).
+    """
+    if not args or args[0] != 'apply':
+        return None
+    index = 1
+    while index < len(args):
+        arg = args[index]
+        if not arg.startswith('-'):
+            return arg
+        if '=' not in arg and arg.lstrip('-') not in BOOLEAN_OPTIONS:
+            index += 1
+        index += 1
+    return None
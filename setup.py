@@ -25,6 +25,10 @@ setup(
         'dockerpty',
         'simple-term-menu'
     ],
+    extras_require={
+        # role assumption (see bedrock.credentials)
+        'aws': ['boto3']
+    },
     python_requires='>=3.7',
     entry_points={
         'console_scripts': [
@@ -0,0 +1,31 @@
+import argparse
+import json
+import sys
+
+from tests.benchmarks.suite import BENCHMARKS, load_thresholds, print_results, run
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run bedrock performance benchmarks')
+    parser.add_argument('names', metavar='<benchmark>', nargs='*',
+                        help=f"benchmarks to run (default: all): {', '.join(name for name, _ in BENCHMARKS)}")
+    parser.add_argument('--quick', action='store_true', help='run with fewer iterations and smaller datasets')
+    parser.add_argument('--output', metavar='<file>', help='write results as JSON')
+    parser.add_argument('--thresholds', metavar='<file>', help='regression thresholds (default: thresholds.json)')
+    args = parser.parse_args()
+
+    report = run(args.names, quick=args.quick,
+                 thresholds=load_thresholds(args.thresholds) if args.thresholds else None)
+    print_results(report, sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    return 0 if all(result['ok'] for result in report['results'].values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
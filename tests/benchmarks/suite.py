@@ -0,0 +1,289 @@
+"""
+Benchmarks of bedrock overhead, driven end to end through the CLI with an in-process fake Docker daemon.
+"""
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import docker
+import dockerpty
+
+from tests.fakes import FakeDockerClient, fake_dockerpty_start, tar_archive
+
+# Default regression thresholds
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thresholds.json')
+
+# Registered benchmarks, in order of execution
+BENCHMARKS = []
+
+BLUEPRINT_ID = 'aws/ecr-repository'
+BLUEPRINT_IMAGE = 'bedrock/aws-ecr-repository'
+
+
+def benchmark(name):
+    """
+    Register a benchmark function, which returns a map of measurement names (prefixed with the benchmark name) to
+    (value, unit) tuples.
+    """
+    def decorator(fn):
+        BENCHMARKS.append((name, fn))
+        return fn
+    return decorator
+
+
+def measure(fn, iterations):
+    """
+    Return the median duration (in seconds) of repeated calls.
+    """
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+class FakeEnvironment:
+    """
+    An isolated bedrock environment (home and blueprint home directories) with Docker replaced by an in-process fake.
+    """
+
+    def __init__(self, latency=0):
+        self.client = FakeDockerClient(output=[b'Refreshing state...\n', b'No changes.\n'], latency=latency)
+        self.client.api.archives[BLUEPRINT_IMAGE] = tar_archive({
+            'main.tf': b'resource "aws_ecr_repository" "this" {}\n',
+            'variables.tf': b'variable "name" {\n  default = "test"\n}\n',
+        })
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = contextlib.ExitStack()
+        self.path = self._stack.enter_context(tempfile.TemporaryDirectory())
+        self.home = os.path.join(self.path, 'home')
+        self.blueprint_home = os.path.join(self.path, 'blueprints')
+        os.makedirs(self.home)
+        os.makedirs(self.blueprint_home)
+        self._stack.enter_context(mock.patch.dict(os.environ, {'HOME': self.home, 'BLUEPRINT_HOME': self.blueprint_home,
+                                                                'PWD': self.blueprint_home}))
+        self._stack.enter_context(mock.patch.object(docker, 'from_env', lambda **kwargs: self.client))
+        self._stack.enter_context(mock.patch.object(dockerpty, 'start', fake_dockerpty_start))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def cli(self, *args):
+        """
+        Run a bedrock command (discarding output), returning the exit code.
+        """
+        from bedrock.cli import BedrockCli
+
+        with mock.patch.object(sys, 'argv', ['bedrock'] + list(args)), \
+                contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            try:
+                BedrockCli()
+            except SystemExit as e:
+                return e.code
+        return None
+
+
+@benchmark('startup')
+def startup_import_time(quick):
+    """
+    Accumulated import time of the CLI (excluding interpreter startup).
+    """
+    def import_times(code):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        modules = {}
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:') and '|' in line:
+                self_time, _, name = line[len('import time:'):].split('|')
+                if self_time.strip().isdigit():
+                    modules[name.strip()] = int(self_time)
+        return modules
+
+    samples = []
+    for _ in range(1 if quick else 5):
+        startup_modules = import_times('pass')
+        samples.append(sum(t for name, t in import_times('import bedrock.cli').items() if name not in startup_modules))
+    return {'import_time': (statistics.median(samples) / 1000, 'ms')}
+
+
+@benchmark('cli')
+def cli_overhead(quick):
+    """
+    Per-command overhead of the CLI, with containers executed by the fake daemon.
+    """
+    iterations = 5 if quick else 25
+    results = {}
+    with FakeEnvironment() as env:
+        # first run pulls the image and initialises the registry index..
+        assert env.cli('plan', '-t', BLUEPRINT_ID) == 0
+        state_path = os.path.join(env.blueprint_home, BLUEPRINT_ID, 'terraform.tfstate')
+        with open(state_path, 'w') as state_file:
+            json.dump({'version': 4, 'serial': 1, 'outputs': {'url': {'value': 'test', 'type': 'string'}},
+                       'resources': []}, state_file)
+
+        commands = {
+            'plan': ['plan', '-t', BLUEPRINT_ID],
+            'output': ['output', '-t', BLUEPRINT_ID],
+            'config': ['config', 'name=test', '-t', BLUEPRINT_ID],
+            'export': ['export', '-t', BLUEPRINT_ID],
+            'blueprint_pull': ['blueprint', 'pull', '-t', BLUEPRINT_ID],
+        }
+        for name, args in commands.items():
+            exit_code = env.cli(*args)
+            assert exit_code in [0, None], f"Command failed: {args} ({exit_code})"
+            results[name] = (measure(lambda: env.cli(*args), iterations) * 1000, 'ms')
+    return results
+
+
+@benchmark('registry')
+def registry_lookup(quick):
+    """
+    Blueprint lookup latency with a large number of registered blueprints.
+    """
+    from bedrock.registry import BlueprintRegistry
+
+    count = 10000 if quick else 100000
+    with FakeEnvironment() as env:
+        os.makedirs(f'{env.home}/.bedrock/blueprints.d')
+        with open(f'{env.home}/.bedrock/blueprints.d/bench.json', 'w') as registry_file:
+            json.dump({f'team{i % 100}/blueprint{i}': {'image': f'bedrock/blueprint{i}'} for i in range(count)},
+                      registry_file)
+
+        registry = BlueprintRegistry()
+        start = time.perf_counter()
+        registry.db()
+        build = time.perf_counter() - start
+
+        blueprint = count // 2 + 7
+        get = measure(lambda: registry.get(f'team7/blueprint{blueprint}'), 200)
+        search = measure(lambda: registry.search(f'team7/blueprint{blueprint // 10}', limit=10), 50)
+        registry.close()
+    return {'index_build': (build * 1000, 'ms'), 'get': (get * 1e6, 'us'), 'search': (search * 1e6, 'us')}
+
+
+@benchmark('config')
+def config_throughput(quick):
+    """
+    Throughput of merged config writes, and latency of a bulk update.
+    """
+    from bedrock.config import ConfigSpec
+
+    writes = 50 if quick else 200
+    with FakeEnvironment() as env:
+        def write(cvars, from_files=()):
+            spec = ConfigSpec(BLUEPRINT_ID)
+            spec.blueprint_home = env.blueprint_home
+            spec.cvars = cvars
+            spec.from_files = list(from_files)
+            with contextlib.redirect_stdout(io.StringIO()):
+                spec.run()
+
+        start = time.perf_counter()
+        for i in range(writes):
+            write({f'var{i}': str(i)})
+        throughput = writes / (time.perf_counter() - start)
+
+        bulk_path = os.path.join(env.path, 'bulk.json')
+        with open(bulk_path, 'w') as bulk_file:
+            json.dump({f'bulk{i}': str(i) for i in range(10000)}, bulk_file)
+        bulk = measure(lambda: write({}, [bulk_path]), 3 if quick else 10)
+    return {'writes_per_second': (throughput, 'writes/s'), 'bulk_10k': (bulk * 1000, 'ms')}
+
+
+@benchmark('fanout')
+def fanout_scaling(quick):
+    """
+    Fan-out duration across workspaces with increasing worker counts (containers take a fixed time to run).
+    """
+    latency = 0.02 if quick else 0.05
+    workspaces = 16
+    results = {}
+    with FakeEnvironment(latency=latency) as env:
+        assert env.cli('plan', '-t', BLUEPRINT_ID) == 0
+        durations = {}
+        for jobs in [1, 2, 4, 8]:
+            start = time.perf_counter()
+            exit_code = env.cli('plan', '-t', BLUEPRINT_ID, '--jobs', str(jobs),
+                                '--workspaces', ','.join(f'ws{i}' for i in range(workspaces)))
+            durations[jobs] = time.perf_counter() - start
+            assert exit_code == 0
+            results[f'jobs_{jobs}'] = (durations[jobs] * 1000, 'ms')
+        results['speedup_8'] = (durations[1] / durations[8], 'x')
+        # per-workspace overhead in excess of the simulated container run time..
+        results['overhead_per_workspace'] = ((durations[1] / workspaces - latency) * 1000, 'ms')
+    return results
+
+
+@benchmark('engine')
+def engine_overhead(quick):
+    """
+    Per-command overhead of each execution engine (native runs a trivial fake Terraform binary).
+    """
+    iterations = 5 if quick else 25
+    results = {}
+    with FakeEnvironment() as env:
+        terraform = os.path.join(env.path, 'terraform')
+        with open(terraform, 'w') as terraform_file:
+            terraform_file.write('#!/bin/sh\necho "No changes."\n')
+        os.chmod(terraform, 0o755)
+
+        with mock.patch.dict(os.environ, {'BEDROCK_TERRAFORM': terraform}):
+            for engine in ['docker', 'native']:
+                args = ['plan', '-t', BLUEPRINT_ID, '--output', 'stream', '--engine', engine]
+                # first run pulls the image (and extracts configuration for native execution)..
+                assert env.cli(*args) == 0
+                results[engine] = (measure(lambda: env.cli(*args), iterations) * 1000, 'ms')
+    return results
+
+
+def run(names=None, quick=False, thresholds=None):
+    """
+    Run benchmarks (optionally filtered by name), returning machine-readable results. Each measurement with a
+    threshold (a min and/or max value) is checked for regression.
+    """
+    thresholds = thresholds if thresholds is not None else load_thresholds()
+    results = {}
+    for name, fn in BENCHMARKS:
+        if names and name not in names:
+            continue
+        for measurement, (value, unit) in fn(quick).items():
+            key = f'{name}.{measurement}'
+            threshold = thresholds.get(key)
+            ok = threshold is None or (value <= threshold.get('max', float('inf'))
+                                       and value >= threshold.get('min', float('-inf')))
+            results[key] = {'value': round(value, 3), 'unit': unit, 'threshold': threshold, 'ok': ok}
+
+    return {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': quick,
+        'results': results,
+    }
+
+
+def load_thresholds(path=THRESHOLDS_PATH):
+    with open(path, 'r') as thresholds_file:
+        return json.load(thresholds_file)
+
+
+def print_results(report, out=None):
+    print(f"{'BENCHMARK':<40} {'VALUE':>12} {'UNIT':<9} THRESHOLD", file=out)
+    for key, result in report['results'].items():
+        threshold = result['threshold'] or {}
+        limit = ' '.join(f'{k}={v}' for k, v in threshold.items())
+        status = '' if result['ok'] else '  REGRESSION'
+        print(f"{key:<40} {result['value']:>12.3f} {result['unit']:<9} {limit}{status}", file=out)
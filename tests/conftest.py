@@ -0,0 +1,14 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def bedrock_home(tmp_path, monkeypatch):
+    """
+    Isolate bedrock user configuration (i.e. ~/.bedrock) for each test. The run ledger is disabled unless a test
+    enables it.
+    """
+    home = tmp_path / 'home'
+    home.mkdir()
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.setenv('BEDROCK_LEDGER', '0')
+    return home
@@ -0,0 +1,219 @@
+"""
+In-process fakes for the Docker client used by bedrock specs.
+"""
+import io
+import itertools
+import os
+import tarfile
+import threading
+import time
+
+
+class FakeAPIClient:
+
+    def __init__(self, exit_code=0, output=(b'',), latency=0):
+        self.exit_code = exit_code
+        self.output = list(output)
+        # Simulated container run time (in seconds)
+        self.latency = latency
+        self.containers_by_id = {}
+        self.images = {}
+        self.registry = {}
+        self.archives = {}
+        self.exit_codes = {}
+        # Files written to /work by containers (as a map of relative paths to content)
+        self.generated = {}
+        # Simulate an unreachable daemon
+        self.unreachable = False
+        # Error raised when copying /work from a container (e.g. a network failure)
+        self.archive_error = None
+        # Error raised when pulling an image (e.g. pull access denied)
+        self.pull_error = None
+        # Simulate long-running containers (output is streamed until a container is stopped)
+        self.block = False
+        self.info_calls = 0
+        self.created = []
+        self.calls = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def runs(self):
+        """
+        Containers created to run a command (excluding containers that are never started, e.g. to read configuration).
+        """
+        return [container for container in self.created if container['Config'].get('entrypoint') != []]
+
+    def create_host_config(self, **kwargs):
+        return kwargs
+
+    def info(self):
+        self.info_calls += 1
+        return {'NCPU': 8, 'MemTotal': 16 * 1024 ** 3}
+
+    def ping(self):
+        if self.unreachable:
+            raise ConnectionError('Connection refused')
+        return True
+
+    def create_container(self, image, command=None, name=None, **kwargs):
+        self.ping()
+        with self._lock:
+            container_id = f'container{next(self._ids)}'
+        self.containers_by_id[container_id] = {
+            'Id': container_id,
+            'Names': [f'/{name}'],
+            'Image': image,
+            'Command': command,
+            'Labels': kwargs.get('labels') or {},
+            'State': 'created',
+            'Config': kwargs,
+            'Uploads': {},
+            'Stopped': threading.Event(),
+        }
+        self.created.append(self.containers_by_id[container_id])
+        self.calls.append(('create_container', container_id))
+        return {'Id': container_id, 'Warnings': []}
+
+    def attach(self, container, stdout=True, stderr=True, stream=False, logs=False, demux=False):
+        self.calls.append(('attach', _id(container)))
+
+        # output may include exceptions, raised while streaming (e.g. KeyboardInterrupt)..
+        def stream():
+            for chunk in self.output:
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                yield chunk if isinstance(chunk, tuple) else (chunk, None)
+            if self.block:
+                self.containers_by_id[_id(container)]['Stopped'].wait()
+        return stream()
+
+    def logs(self, container, stdout=True, stderr=True, stream=False, follow=False, **kwargs):
+        self.calls.append(('logs', _id(container)))
+        chunks = [chunk for chunk in self.output if not isinstance(chunk, BaseException)]
+        data = b''.join(b''.join(part for part in chunk if part) if isinstance(chunk, tuple) else chunk
+                        for chunk in chunks)
+        return iter([data]) if stream else data
+
+    def put_archive(self, container, path, data):
+        self.calls.append(('put_archive', _id(container), path))
+        data = data if isinstance(data, bytes) else data.read()
+        with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+            for member in archive:
+                if member.isfile():
+                    name = os.path.join(path, member.name).lstrip('/')
+                    self.containers_by_id[_id(container)]['Uploads'][name] = archive.extractfile(member).read()
+        return True
+
+    def get_archive(self, container, path, chunk_size=2097152):
+        self.calls.append(('get_archive', _id(container), path))
+        uploads = self.containers_by_id[_id(container)]['Uploads']
+        if path == '/work':
+            if self.archive_error is not None:
+                raise self.archive_error
+            files = {name[len('work/'):]: content for name, content in uploads.items() if name.startswith('work/')}
+            data = tar_archive(dict(files, **self.generated), root='work')
+        else:
+            import docker.errors
+
+            image = self.containers_by_id[_id(container)]['Image']
+            if image not in self.archives and ':' not in image.rsplit('/', 1)[-1]:
+                image += ':latest'
+            if image not in self.archives:
+                raise docker.errors.NotFound(f'Could not find the file {path} in container {_id(container)}')
+            data = self.archives[image]
+        return iter([data[i:i + 512] for i in range(0, len(data), 512)]), {'name': os.path.basename(path)}
+
+    def start(self, container):
+        self.containers_by_id[_id(container)]['State'] = 'running'
+        self.calls.append(('start', _id(container)))
+
+    def wait(self, container):
+        if self.latency:
+            time.sleep(self.latency)
+        self.containers_by_id[_id(container)]['State'] = 'exited'
+        self.calls.append(('wait', _id(container)))
+        return {'StatusCode': self.exit_codes.get(self.containers_by_id[_id(container)]['Image'], self.exit_code)}
+
+    def stop(self, container):
+        self.containers_by_id[_id(container)]['State'] = 'exited'
+        self.containers_by_id[_id(container)]['Stopped'].set()
+        self.calls.append(('stop', _id(container)))
+
+    def remove_container(self, container, force=False):
+        import docker.errors
+
+        if _id(container) not in self.containers_by_id:
+            raise docker.errors.NotFound(f'No such container: {_id(container)}')
+        del self.containers_by_id[_id(container)]
+        self.calls.append(('remove_container', _id(container)))
+
+    def containers(self, all=False, filters=None):
+        filters = filters or {}
+        result = []
+        for container in self.containers_by_id.values():
+            if 'status' in filters and container['State'] not in filters['status']:
+                continue
+            if 'label' in filters:
+                key, _, value = filters['label'].partition('=')
+                if container['Labels'].get(key) != value:
+                    continue
+            if not all and container['State'] != 'running':
+                continue
+            result.append(container)
+        return result
+
+    def pull(self, repository, tag=None, **kwargs):
+        self.calls.append(('pull', repository, tag))
+        if self.pull_error is not None:
+            raise self.pull_error
+        image_ref = f'{repository}:{tag or "latest"}'
+        self.images[image_ref] = self.registry.get(image_ref, 'sha256:0')
+
+    def inspect_image(self, image):
+        import docker.errors
+
+        # untagged references resolve to the latest tag (as with the Docker daemon)..
+        if ':' not in image.rsplit('/', 1)[-1]:
+            image += ':latest'
+        if image not in self.images:
+            raise docker.errors.ImageNotFound(f'No such image: {image}')
+        return {'Id': image, 'RepoDigests': [f'{image.rsplit(":", 1)[0]}@{self.images[image]}']}
+
+    def inspect_distribution(self, image):
+        import docker.errors
+
+        self.calls.append(('inspect_distribution', image))
+        if image not in self.registry:
+            raise docker.errors.NotFound(f'manifest unknown: {image}')
+        return {'Descriptor': {'digest': self.registry[image]}}
+
+
+class FakeDockerClient:
+
+    def __init__(self, exit_code=0, output=(b'',), latency=0):
+        self.api = FakeAPIClient(exit_code, output, latency)
+
+
+def _id(container):
+    return container['Id'] if isinstance(container, dict) else container
+
+
+def fake_dockerpty_start(client, container, **kwargs):
+    client.start(container)
+
+
+def tar_archive(files, root='blueprint'):
+    """
+    Create an archive (as returned by the Docker archive API) from a map of relative paths to content.
+    """
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w') as archive:
+        directory = tarfile.TarInfo(root)
+        directory.type = tarfile.DIRTYPE
+        archive.addfile(directory)
+        for path, content in files.items():
+            info = tarfile.TarInfo(f'{root}/{path}')
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return data.getvalue()
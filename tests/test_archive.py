@@ -0,0 +1,19 @@
+
+import bedrock.archive
+from tests.fakes import tar_archive
+
+
+class TestArchive:
+
+    def test_extract_archive(self, tmp_path):
+        data = tar_archive({'main.tf': b'# main\n', '../escape.tf': b'# escape\n'})
+        manifest = {}
+
+        written, skipped = bedrock.archive.extract_archive([data[:100], data[100:]], str(tmp_path / 'out'), manifest)
+        assert written == ['main.tf']
+        assert skipped == []
+        assert not (tmp_path / 'escape.tf').exists()
+
+        written, skipped = bedrock.archive.extract_archive([data], str(tmp_path / 'out'), manifest)
+        assert written == []
+        assert skipped == ['main.tf']
@@ -1,4 +1,25 @@
+import json
+
 import bedrock.backend
+from tests.fakes import FakeDockerClient
+
+POLICY = """
+defaults:
+  type: s3
+  config:
+    bucket: acme-state
+    key: "{namespace}/{name}/terraform.tfstate"
+    dynamodb_table: terraform-lock
+rules:
+  - match: "legacy/*"
+    config:
+      bucket: acme-legacy-state
+  - match: "local/*"
+    type: local
+    replace: true
+  - match: "excluded/*"
+    type: none
+"""
 
 
 class TestBackendSpec:
@@ -6,3 +27,87 @@ class TestBackendSpec:
     def test_init(self):
         spec = bedrock.backend.BackendSpec('1')
         assert spec.blueprint_id == '1'
+
+    def test_run(self, tmp_path):
+        spec = bedrock.backend.BackendSpec('aws/ecr-repository', s3_bucket='acme-state')
+        spec.blueprint_home = str(tmp_path)
+        spec.run()
+        assert (tmp_path / 'aws/ecr-repository/backend.tf').read_text() == '\n'.join([
+            'terraform {',
+            '  backend "s3" {',
+            '    bucket = "acme-state"',
+            '    dynamodb_table = "terraform-lock"',
+            '    key = "blueprint/aws/ecr-repository/terraform.tfstate"',
+            '  }',
+            '}',
+        ]) + '\n'
+
+
+class TestBackendPolicy:
+
+    def test_resolve(self, tmp_path):
+        (tmp_path / 'policy.yaml').write_text(POLICY)
+        policy = bedrock.backend.BackendPolicy.load(str(tmp_path / 'policy.yaml'))
+        assert policy.resolve('aws/ecr-repository') == ('s3', {
+            'bucket': 'acme-state', 'key': 'aws/ecr-repository/terraform.tfstate', 'dynamodb_table': 'terraform-lock'})
+        assert policy.resolve('legacy/vpc')[1]['bucket'] == 'acme-legacy-state'
+        assert policy.resolve('local/test') == ('local', {})
+        assert policy.resolve('excluded/test') is None
+        assert 'backend "remote"' in bedrock.backend.render_backend('remote', {
+            'organization': 'acme', 'workspaces': {'prefix': 'test-'}})
+
+
+class TestBackendApplySpec:
+
+    def test_run(self, tmp_path, capsys):
+        home = tmp_path / 'blueprints'
+        (home / 'aws/vpc/.terraform').mkdir(parents=True)
+        (home / 'aws/vpc/backend.tf').write_text('terraform {\n  backend "local" {}\n}\n')
+        (tmp_path / 'policy.yaml').write_text(POLICY)
+        blueprint_ids = ['aws/vpc', 'aws/ecr-repository', 'excluded/test']
+
+        spec = bedrock.backend.BackendApplySpec(str(tmp_path / 'policy.yaml'), blueprint_ids, max_workers=2)
+        spec.blueprint_home = str(home)
+        spec.client = FakeDockerClient(exit_code=1)
+
+        # backends are rendered, and state of initialised blueprints is migrated..
+        assert spec.run() == 1
+        assert 'acme-state' in (home / 'aws/ecr-repository/backend.tf').read_text()
+        assert 'aws/vpc/terraform.tfstate' in (home / 'aws/vpc/backend.tf').read_text()
+        assert not (home / 'excluded/test').exists()
+        container, = spec.client.api.created
+        assert container['Command'] == 'init -migrate-state -force-copy -input=false /blueprint'
+        assert json.loads(open(spec.journal_path).read())['aws/vpc']['status'] == 'failed'
+
+        # failed migrations are resumed (although configuration is unchanged)..
+        capsys.readouterr()
+        spec.client = FakeDockerClient()
+        assert spec.run() == 0
+        assert 'Backend configuration: 0 changed, 2 unchanged, 1 excluded' in capsys.readouterr().out
+        assert len(spec.client.api.created) == 1
+
+        spec.client = FakeDockerClient()
+        assert spec.run() == 0
+        assert spec.client.api.created == []
+
+    def test_run_no_migrate(self, tmp_path):
+        home = tmp_path / 'blueprints'
+        (home / 'aws/vpc/.terraform').mkdir(parents=True)
+        (home / 'aws/vpc/backend.tf').write_text('terraform {\n  backend "local" {}\n}\n')
+        (tmp_path / 'policy.yaml').write_text(POLICY)
+
+        # migrations are recorded (with the previous backend) before configuration is written..
+        spec = bedrock.backend.BackendApplySpec(str(tmp_path / 'policy.yaml'), ['aws/vpc'])
+        spec.blueprint_home = str(home)
+        spec.migrate = False
+        assert spec.run() == 0
+        entry = json.loads(open(spec.journal_path).read())['aws/vpc']
+        assert entry['status'] == 'pending'
+        assert 'backend "local"' in entry['previous']
+
+        # ..such that a later run migrates state (although configuration is unchanged)..
+        spec.migrate = True
+        spec.client = FakeDockerClient()
+        assert spec.run() == 0
+        assert len(spec.client.api.created) == 1
+        assert json.loads(open(spec.journal_path).read())['aws/vpc']['status'] == 'succeeded'
@@ -0,0 +1,11 @@
+import tests.benchmarks.suite
+
+
+class TestBenchmarks:
+
+    def test_run(self):
+        # quick run to ensure benchmarks don't rot (thresholds are checked by `make bench`)..
+        report = tests.benchmarks.suite.run(['cli', 'config', 'fanout', 'engine'], quick=True)
+        assert {'cli.plan', 'cli.output', 'config.bulk_10k', 'fanout.speedup_8', 'engine.native'} <= set(report['results'])
+        for result in report['results'].values():
+            assert result['value'] > 0
@@ -1,4 +1,9 @@
+import json
+
+import docker
+
 import bedrock.blueprint
+from tests.fakes import FakeDockerClient
 
 
 class TestBlueprintSpec:
@@ -6,3 +11,27 @@ class TestBlueprintSpec:
     def test_init(self):
         spec = bedrock.blueprint.BlueprintSpec('1', 'bedrock/test-blueprint')
         assert spec.blueprint_id == '1'
+
+    def test_pull_images(self, monkeypatch, capsys):
+        client = FakeDockerClient()
+        monkeypatch.setattr(docker, 'from_env', lambda **kwargs: client)
+
+        spec = bedrock.blueprint.BlueprintSpec(None, None)
+        spec.pull = True
+        assert spec.run() == 0
+
+        images = {image for image, _ in (image_ref.rsplit(':', 1) for image_ref in client.api.images)}
+        assert images == {blueprint['image'] for blueprint in bedrock.blueprint.BlueprintSpec.default_blueprints.values()}
+        assert f'[{len(images)}/{len(images)}]' in capsys.readouterr().out
+
+    def test_run_list(self, monkeypatch, tmp_path, capsys):
+        monkeypatch.setenv('HOME', str(tmp_path))
+        (tmp_path / '.bedrock' / 'blueprints.d').mkdir(parents=True)
+        (tmp_path / '.bedrock' / 'blueprints.d' / 'aws.json').write_text(
+            json.dumps({'aws/vpc': {'image': 'bedrock/aws-vpc'}}))
+        (tmp_path / '.bedrock' / 'blueprints.json').write_text(json.dumps({'ecs/task': {'image': 'bedrock/ecs-task'}}))
+
+        # namespaced blueprints are listed with blueprints.json..
+        bedrock.blueprint.BlueprintSpec(None, None).run()
+        assert json.loads(capsys.readouterr().out) == {'aws/vpc': {'image': 'bedrock/aws-vpc'},
+                                                       'ecs/task': {'image': 'bedrock/ecs-task'}}
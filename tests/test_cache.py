@@ -0,0 +1,56 @@
+import os
+
+import bedrock.cache
+
+
+def add_provider(root, version, size, mtime):
+    path = root / 'registry.terraform.io' / 'hashicorp' / 'aws' / version / 'linux_amd64'
+    path.mkdir(parents=True)
+    (path / 'terraform-provider-aws').write_bytes(b'0' * size)
+    os.utime(path.parent, (mtime, mtime))
+    return path.parent
+
+
+class TestPluginCache:
+
+    def test_init(self, tmp_path):
+        cache = bedrock.cache.PluginCache(root=str(tmp_path), max_size=1)
+        assert cache.path == f'{tmp_path}/plugin-cache'
+        assert cache.max_size == 1024 * 1024
+
+    def test_prune(self, tmp_path):
+        cache = bedrock.cache.PluginCache(root=str(tmp_path), max_size=1)
+        cache_path = tmp_path / 'plugin-cache'
+        oldest = add_provider(cache_path, '1.0.0', 600 * 1024, 1000)
+        newest = add_provider(cache_path, '3.0.0', 600 * 1024, 3000)
+        used = add_provider(cache_path, '2.0.0', 600 * 1024, 2000)
+
+        # mark provider as recently used by a blueprint..
+        (tmp_path / 'blueprint' / '.terraform' / 'providers' / 'registry.terraform.io' / 'hashicorp' / 'aws'
+         / '2.0.0').mkdir(parents=True)
+        cache.touch(str(tmp_path / 'blueprint'))
+
+        assert cache.prune() == [str(oldest), str(newest)]
+        assert used.exists()
+        assert cache.stats()['providers'] == 1
+
+    def test_prune_in_use(self, tmp_path):
+        cache = bedrock.cache.PluginCache(root=str(tmp_path), max_size=0)
+        provider = add_provider(tmp_path / 'plugin-cache', '1.0.0', 1024, 1000)
+
+        with cache.in_use():
+            assert cache.prune(wait=False) == []
+        assert provider.exists()
+
+        assert cache.prune(wait=False) == [str(provider)]
+        assert not provider.exists()
+
+    def test_prune_failed(self, tmp_path, monkeypatch):
+        cache = bedrock.cache.PluginCache(root=str(tmp_path), max_size=0)
+        add_provider(tmp_path / 'plugin-cache', '1.0.0', 1024, 1000)
+
+        def rmtree(path):
+            raise PermissionError(13, 'Permission denied', path)
+
+        monkeypatch.setattr(bedrock.cache.shutil, 'rmtree', rmtree)
+        assert cache.prune() == []
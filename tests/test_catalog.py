@@ -0,0 +1,90 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import bedrock.catalog
+
+REPOSITORIES = {
+    'bedrock/aws-vpc': ['1.0', 'latest'],
+    'bedrock/ecs-task-definition': ['latest'],
+    'other/image': ['latest'],
+}
+
+
+class FakeRegistryHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_GET(self):
+        if self.path.startswith('/v2/_catalog'):
+            # paginate catalog responses..
+            if 'last=' in self.path:
+                link, body = None, {'repositories': list(REPOSITORIES)[2:]}
+            else:
+                link, body = '</v2/_catalog?last=b&n=2>; rel="next"', {'repositories': list(REPOSITORIES)[:2]}
+        else:
+            repository = self.path[len('/v2/'):-len('/tags/list')]
+            link, body = None, {'name': repository, 'tags': REPOSITORIES[repository]}
+
+        data = json.dumps(body).encode('utf-8')
+        etag = f'"{hashlib.sha256(data).hexdigest()}"'
+        FakeRegistryHandler.requests.append((self.path, self.headers.get('If-None-Match') == etag))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        if link:
+            self.send_header('Link', link)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def registry():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeRegistryHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    FakeRegistryHandler.requests = []
+    yield f'127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+class TestRegistryCatalog:
+
+    def test_init(self):
+        assert bedrock.catalog.RegistryCatalog('localhost:5000').registry_url == 'http://localhost:5000'
+        assert bedrock.catalog.RegistryCatalog('registry.example.com').registry_url == 'https://registry.example.com'
+
+    def test_sync(self, registry, tmp_path):
+        catalog = bedrock.catalog.RegistryCatalog(registry, root=str(tmp_path))
+        assert catalog.sync('bedrock/') == {'bedrock/aws-vpc': ['1.0', 'latest'], 'bedrock/ecs-task-definition': ['latest']}
+        assert catalog.stats == {'modified': 4, 'not_modified': 0}
+
+        # repeated sync uses conditional requests..
+        catalog = bedrock.catalog.RegistryCatalog(registry, root=str(tmp_path))
+        catalog.sync('bedrock/')
+        assert catalog.stats == {'modified': 0, 'not_modified': 4}
+
+    def test_merge_catalog(self):
+        blueprints = {'aws/vpc': {'image': 'bedrock/aws-vpc'}}
+        added = bedrock.catalog.merge_catalog(blueprints, {'bedrock/aws-vpc': ['1.0'], 'bedrock/ecs-task': ['latest']},
+                                              'bedrock/')
+        assert added == ['ecs-task']
+        assert blueprints == {
+            'aws/vpc': {'image': 'bedrock/aws-vpc', 'tags': ['1.0']},
+            'ecs-task': {'image': 'bedrock/ecs-task', 'tags': ['latest']},
+        }
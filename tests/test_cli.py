@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Maximum accumulated import time (in microseconds) permitted for each command..
+STARTUP_BUDGET = 150000
+
+HEAVY_MODULES = ['docker', 'dockerpty', 'simple_term_menu']
+
+
+def import_times(args, home, module=('-m', 'bedrock.cli')):
+    """
+    Run the CLI with `python -X importtime` and return the exit code, and a map of imported module names to self
+    import times.
+    """
+    env = dict(os.environ, HOME=str(home), BLUEPRINT_HOME=str(home), PWD=str(home))
+    result = subprocess.run([sys.executable, '-X', 'importtime', *module, *args],
+                            env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            self_time, _, name = line[len('import time:'):].split('|')
+            if self_time.strip().isdigit():
+                modules[name.strip()] = int(self_time)
+    return result.returncode, modules
+
+
+class TestBedrockCli:
+
+    @pytest.mark.parametrize('args', [
+        ['blueprint'],
+        ['-t', 'aws/ecr-repository', '--dryrun', 'config', 'name=test'],
+        ['export', '-t', 'aws/ecr-repository', '--dryrun'],
+        ['plan', '-t', 'aws/ecr-repository', '--dryrun'],
+    ])
+    def test_startup_budget(self, args, tmp_path):
+        # exclude modules imported during interpreter startup..
+        _, startup_modules = import_times([], tmp_path, module=('-c', 'pass'))
+        exit_code, modules = import_times(args, tmp_path)
+        # a failed parse would exit before the command is run..
+        assert exit_code == 0, f"Command failed: {args}"
+        modules = {name: time for name, time in modules.items() if name not in startup_modules}
+        # command modules (e.g. the Terraform executor) are only imported by the commands that use them..
+        assert ('bedrock.terraform' in modules) == ('plan' in args), f"Unexpected imports for command: {args}"
+
+        for heavy_module in HEAVY_MODULES:
+            assert heavy_module not in modules, f"{heavy_module} imported for command: {args}"
+
+        assert sum(modules.values()) < STARTUP_BUDGET, f"Startup budget exceeded for command: {args}"
@@ -1,3 +1,9 @@
+import json
+import sys
+
+import pytest
+
+import bedrock.cli
 import bedrock.config
 
 
@@ -6,3 +12,61 @@ class TestConfigSpec:
     def test_init(self):
         spec = bedrock.config.ConfigSpec('1')
         assert spec.blueprint_id == '1'
+
+    def test_run_merge(self, tmp_path):
+        variables = tmp_path / 'variables.json'
+        variables.write_text(json.dumps({f'var{i}': str(i) for i in range(1000)}))
+
+        spec = bedrock.config.ConfigSpec('1')
+        spec.blueprint_home = str(tmp_path)
+        spec.from_files = [str(variables)]
+        assert spec.run() == 0
+
+        spec = bedrock.config.ConfigSpec('1')
+        spec.blueprint_home = str(tmp_path)
+        spec.cvars = {'var0': 'updated'}
+        spec.unset = ['var1']
+        assert spec.run() == 0
+
+        config = json.loads((tmp_path / '1' / 'default.tfvars.json').read_text())
+        assert len(config) == 999
+        assert config['var0'] == 'updated'
+        assert 'var1' not in config
+        assert config['var2'] == '2'
+
+    def test_run_invalid_file(self, tmp_path, capsys):
+        invalid = tmp_path / 'invalid.json'
+        invalid.write_text('{"name": ')
+
+        for from_file in [str(tmp_path / 'missing.json'), str(invalid)]:
+            spec = bedrock.config.ConfigSpec('1')
+            spec.blueprint_home = str(tmp_path)
+            spec.from_files = [from_file]
+            assert spec.run() == 1
+            assert from_file in capsys.readouterr().out
+
+        # config is unchanged..
+        assert not (tmp_path / '1').exists()
+
+
+class TestConfigCli:
+
+    def run(self, monkeypatch, args):
+        monkeypatch.setattr(sys, 'argv', ['bedrock', 'config'] + args)
+        with pytest.raises(SystemExit) as e:
+            bedrock.cli.BedrockCli()
+        return e.value.code
+
+    def test_run(self, monkeypatch, tmp_path, capsys):
+        monkeypatch.setenv('BLUEPRINT_HOME', str(tmp_path))
+        monkeypatch.setenv('BEDROCK_VALIDATE_VARIABLES', '0')
+        config_path = tmp_path / 'aws' / 'ecr-repository' / 'default.tfvars.json'
+
+        # global options may follow variables..
+        assert self.run(monkeypatch, ['name=test', '-t', 'aws/ecr-repository', '-v']) == 0
+        assert json.loads(config_path.read_text()) == {'name': 'test'}
+
+        # arguments that aren't variables are rejected (rather than ignored)..
+        assert self.run(monkeypatch, ['name', 'tag=1', '-t', 'aws/ecr-repository']) == 1
+        assert 'Invalid variable: name' in capsys.readouterr().out
+        assert json.loads(config_path.read_text()) == {'name': 'test'}
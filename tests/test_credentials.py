@@ -0,0 +1,102 @@
+import multiprocessing
+import time
+
+import docker
+import dockerpty
+
+import bedrock.credentials
+import bedrock.terraform
+from tests.fakes import FakeDockerClient, fake_dockerpty_start
+
+
+class FakeSTS:
+    """
+    A local STS stand-in, recording each request (optionally to a file shared across processes).
+    """
+
+    def __init__(self, expires_in=3600, log=None, latency=0):
+        self.expires_in = expires_in
+        self.log = log
+        self.latency = latency
+        self.requests = []
+
+    def __call__(self):
+        return self
+
+    def assume_role(self, **params):
+        time.sleep(self.latency)
+        self.requests.append(params)
+        if self.log is not None:
+            with open(self.log, 'a') as log_file:
+                log_file.write(f"{params['RoleArn']}\n")
+        return {'Credentials': {
+            'AccessKeyId': f'ASIA{len(self.requests)}',
+            'SecretAccessKey': 'secret',
+            'SessionToken': 'token',
+            'Expiration': time.time() + self.expires_in,
+        }}
+
+
+def get_credentials(log):
+    cache = bedrock.credentials.CredentialCache(sts_client=FakeSTS(log=log, latency=0.05))
+    cache.get('arn:aws:iam::123456789012:role/deploy')
+
+
+class TestCredentialCache:
+
+    def test_get(self):
+        sts = FakeSTS()
+        cache = bedrock.credentials.CredentialCache(sts_client=sts)
+        credentials = cache.get('arn:aws:iam::123456789012:role/deploy', duration=900)
+        assert credentials['AccessKeyId'] == 'ASIA1'
+        assert sts.requests[0]['DurationSeconds'] == 900
+
+        # cached credentials are reused (including by other instances)..
+        assert bedrock.credentials.CredentialCache(sts_client=sts).get('arn:aws:iam::123456789012:role/deploy') \
+            == credentials
+        assert len(sts.requests) == 1
+
+    def test_refresh(self):
+        # credentials expiring within the refresh margin are refreshed..
+        sts = FakeSTS(expires_in=60)
+        cache = bedrock.credentials.CredentialCache(refresh_margin=300, sts_client=sts)
+        cache.get('arn:aws:iam::123456789012:role/deploy')
+        assert cache.get('arn:aws:iam::123456789012:role/deploy')['AccessKeyId'] == 'ASIA2'
+
+    def test_concurrent_processes(self, tmp_path):
+        log = tmp_path / 'sts.log'
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=get_credentials, args=(str(log),)) for _ in range(8)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            assert process.exitcode == 0
+
+        assert log.read_text().splitlines() == ['arn:aws:iam::123456789012:role/deploy']
+
+    def test_role_for(self, monkeypatch):
+        roles = {'prod': 'arn:aws:iam::1:role/prod'}
+        assert bedrock.credentials.role_for('prod', 'arn:aws:iam::1:role/dev', roles) == 'arn:aws:iam::1:role/prod'
+        assert bedrock.credentials.role_for('test', 'arn:aws:iam::1:role/dev', roles) == 'arn:aws:iam::1:role/dev'
+        assert bedrock.credentials.role_for('test') is None
+
+        monkeypatch.setenv('BEDROCK_ROLE_ARN', 'arn:aws:iam::1:role/override')
+        assert bedrock.credentials.role_for('prod', None, roles) == 'arn:aws:iam::1:role/override'
+
+    def test_terraform_run(self, monkeypatch, tmp_path):
+        client = FakeDockerClient()
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+        monkeypatch.setattr(dockerpty, 'start', fake_dockerpty_start)
+        monkeypatch.setenv('AWS_PROFILE', 'source')
+
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.args = ['plan']
+        spec.role_arn = 'arn:aws:iam::123456789012:role/deploy'
+        spec.credential_cache = bedrock.credentials.CredentialCache(sts_client=FakeSTS())
+        assert spec.run() == 0
+
+        environment = client.api.runs[0]['Config']['environment']
+        assert 'AWS_ACCESS_KEY_ID=ASIA1' in environment
+        assert 'AWS_PROFILE=source' not in environment
@@ -0,0 +1,171 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import bedrock.drift
+import bedrock.executors
+import bedrock.ledger
+from tests.fakes import FakeDockerClient
+
+S3_BACKEND = 'terraform {\n  backend "s3" {\n    bucket = "state"\n    key    = "aws/a"\n  }\n}\n'
+
+
+def blueprint_home(tmp_path):
+    for blueprint_id, backend in [('aws/a', S3_BACKEND), ('aws/b', 'terraform {}\n')]:
+        (tmp_path / blueprint_id).mkdir(parents=True)
+        (tmp_path / blueprint_id / 'backend.tf').write_text(backend)
+    (tmp_path / 'aws/a' / 'prod.tfvars.json').write_text('{}')
+    return str(tmp_path)
+
+
+class TestDriftScheduler:
+
+    def test_find_targets(self, tmp_path):
+        home = blueprint_home(tmp_path)
+        blueprints = {'aws/a': {'image': 'a'}, 'aws/b': {'image': 'b', 'drift': {'interval': '1h'}},
+                      'aws/c': {'image': 'c'}, 'aws/d': {'image': 'd', 'drift': False}}
+        targets = bedrock.drift.find_targets(home, blueprints)
+        assert [(t.blueprint_id, t.workspace, t.backend, t.interval) for t in targets] == [
+            ('aws/a', 'default', 's3:state', 21600), ('aws/a', 'prod', 's3:state', 21600),
+            ('aws/b', 'default', 'local', 3600)]
+        assert len(bedrock.drift.find_targets(home, blueprints, 'aws/*', ['prod'])) == 1
+
+        # drift may be enabled explicitly, but other values are rejected..
+        assert len(bedrock.drift.find_targets(home, {'aws/b': {'image': 'b', 'drift': True}})) == 1
+        with pytest.raises(ValueError, match='Invalid drift configuration for aws/b'):
+            bedrock.drift.find_targets(home, {'aws/b': {'image': 'b', 'drift': '1h'}})
+
+    def test_serve(self, tmp_path):
+        targets = [bedrock.drift.DriftTarget(f'aws/{i}', 'default', {}) for i in range(6)]
+        store = bedrock.drift.DriftStore(str(tmp_path))
+        lock = threading.Lock()
+        active = {'current': 0, 'max': 0}
+
+        def check(target):
+            with lock:
+                active['current'] += 1
+                active['max'] = max(active['max'], active['current'])
+            time.sleep(0.02)
+            with lock:
+                active['current'] -= 1
+            return (2, (1, 0, 0)) if target.blueprint_id == 'aws/0' else (0, (0, 0, 0))
+
+        scheduler = bedrock.drift.DriftScheduler(targets, store, check, max_concurrency=2)
+        assert asyncio.run(scheduler.serve(once=True)) == 6
+
+        # concurrency is capped, and results are recorded..
+        assert active['max'] == 2
+        status = {row['blueprint']: row for row in store.status()}
+        assert status['aws/0']['status'] == 'drifted' and status['aws/0']['additions'] == 1
+        assert status['aws/1']['status'] == 'in-sync'
+        assert [row['blueprint'] for row in store.status(status='drifted')] == ['aws/0']
+        store.close()
+
+    def test_serve_record_failed(self, tmp_path, capsys):
+        class LockedStore(bedrock.drift.DriftStore):
+            def record(self, *args, **kwargs):
+                raise sqlite3.OperationalError('database is locked')
+
+        targets = [bedrock.drift.DriftTarget(f'aws/{i}', 'default', {}) for i in range(2)]
+        scheduler = bedrock.drift.DriftScheduler(targets, LockedStore(str(tmp_path)), lambda target: (2, None))
+
+        # checks continue when results can't be recorded..
+        assert asyncio.run(scheduler.serve(once=True)) == 2
+        out = capsys.readouterr().out
+        assert 'Failed to record check: database is locked' in out and '[aws/1:default] drifted' in out
+
+    def test_serve_interrupt(self, tmp_path):
+        targets = [bedrock.drift.DriftTarget(f'aws/{i}', 'default', {}) for i in range(3)]
+        started = threading.Semaphore(0)
+        stopped = []
+
+        def check(target):
+            finished = threading.Event()
+            with bedrock.executors.active_runs.track(lambda: (stopped.append(target.blueprint_id), finished.set())):
+                started.release()
+                finished.wait(5)
+            return 1, None
+
+        async def serve():
+            # interrupt once both checks have started (asyncio.run() cancels the scheduler on Ctrl-C)..
+            task = asyncio.ensure_future(scheduler.serve(once=True))
+            await asyncio.to_thread(lambda: (started.acquire(), started.acquire()))
+            task.cancel()
+            await task
+
+        # running checks are stopped, and queued checks are cancelled..
+        scheduler = bedrock.drift.DriftScheduler(targets, bedrock.drift.DriftStore(str(tmp_path)), check,
+                                                 max_concurrency=2)
+        with pytest.raises(KeyboardInterrupt):
+            asyncio.run(serve())
+        assert sorted(stopped) == ['aws/0', 'aws/1']
+        assert not bedrock.executors.active_runs.interrupted
+
+    def test_rate_limiter(self):
+        limiter = bedrock.drift.RateLimiter(2, period=0.2)
+
+        async def acquire():
+            for _ in range(4):
+                await limiter.acquire()
+
+        # a burst of 2 is allowed, then 1 per 0.1s..
+        start = time.monotonic()
+        asyncio.run(acquire())
+        assert time.monotonic() - start >= 0.19
+
+    def test_next_check(self):
+        target = bedrock.drift.DriftTarget('aws/a', 'default', {}, interval=1000)
+        scheduler = bedrock.drift.DriftScheduler([target], None, None, jitter=0.1)
+        assert 1900 <= scheduler.next_check(target, 1000) <= 2100
+        assert time.time() <= scheduler.next_check(target) <= time.time() + 100
+
+
+class TestDriftStore:
+
+    def test_record(self, tmp_path):
+        store = bedrock.drift.DriftStore(str(tmp_path), history_size=3)
+        for checked, exit_code in enumerate([0, 2, 2, 1, 2]):
+            store.record('aws/a', 'default', checked, exit_code, 1.0)
+
+        # history is bounded, and drift is tracked from the first drifted check..
+        assert [check['status'] for check in store.checks('aws/a', 'default')] == ['drifted', 'failed', 'drifted']
+        row, = store.status()
+        assert row['status'] == 'drifted' and row['drifted_since'] == 4
+        store.close()
+
+
+class TestDriftSpec:
+
+    def test_check(self, tmp_path, capsys):
+        home = blueprint_home(tmp_path / 'blueprints')
+        spec = bedrock.drift.DriftSpec('serve', home, max_workers=2)
+        spec.client = FakeDockerClient(exit_code=2, output=[b'Plan: 1 to add, 2 to change, 0 to destroy.\n'])
+        spec.once = True
+        spec.blueprint_pattern = 'aws/ecr-repository'
+        (tmp_path / 'blueprints' / 'aws' / 'ecr-repository').mkdir()
+        (tmp_path / 'blueprints' / 'aws' / 'ecr-repository' / 'backend.tf').write_text(S3_BACKEND)
+
+        # drift is reported by exit code, and plan is run without locking state..
+        assert spec.run() == 2
+        assert spec.client.api.runs[0]['Command'].startswith('plan -detailed-exitcode -lock=false')
+
+        capsys.readouterr()
+        assert bedrock.drift.DriftSpec('status', home).run() == 0
+        out = capsys.readouterr().out
+        assert 'aws/ecr-repository' in out and 'drifted' in out and '+1 ~2 -0' in out
+
+    def test_check_ledger(self, tmp_path, monkeypatch):
+        monkeypatch.delenv('BEDROCK_LEDGER')
+        monkeypatch.setenv('HOME', str(tmp_path))
+        home = blueprint_home(tmp_path / 'blueprints')
+        spec = bedrock.drift.DriftSpec('serve', home)
+        spec.client = FakeDockerClient(exit_code=0)
+        target = bedrock.drift.DriftTarget('aws/a', 'default', {'image': 'a'})
+
+        # runs are written to the ledger after each check..
+        assert spec.check(target) == (0, None)
+        run, = bedrock.ledger.RunLedger(str(tmp_path / '.bedrock')).runs()
+        assert run['blueprint'] == 'aws/a' and run['args'].startswith('plan -detailed-exitcode')
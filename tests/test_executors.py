@@ -0,0 +1,179 @@
+import io
+import os
+import stat
+
+import docker
+import pytest
+
+import bedrock.executors
+import bedrock.stream
+import bedrock.terraform
+from tests.fakes import FakeDockerClient, tar_archive
+
+IMAGE = 'bedrock/test:latest'
+
+# Fake terraform binary reporting the translated command, working directory and configuration..
+TERRAFORM = '''#!/bin/sh
+echo "args: $*"
+echo "cwd: $(pwd)"
+echo "plugins: $TF_PLUGIN_CACHE_DIR"
+echo "name: $TF_VAR_name"
+for arg in "$@"; do
+  case "$arg" in
+    -*) ;;
+    *) ls "$arg" ;;
+  esac
+done
+echo "error" >&2
+exit 2
+'''
+
+
+@pytest.fixture
+def terraform(tmp_path, monkeypatch):
+    path = tmp_path / 'terraform'
+    path.write_text(TERRAFORM)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('BEDROCK_TERRAFORM', str(path))
+    return path
+
+
+def native_spec(tmp_path, args):
+    spec = bedrock.terraform.TerraformSpec('1', None)
+    spec.blueprint_home = str(tmp_path / 'blueprints')
+    spec.image = 'bedrock/test'
+    spec.image_tag = 'latest'
+    spec.engine = 'native'
+    spec.native_state = False
+    spec.tty = False
+    spec.output_file = io.StringIO()
+    spec.args = args
+    return spec
+
+
+class TestNativeExecutor:
+
+    def test_init(self):
+        executor = bedrock.executors.create_executor('native', None)
+        assert executor.terraform == os.environ.get('BEDROCK_TERRAFORM', 'terraform')
+        with pytest.raises(ValueError):
+            bedrock.executors.create_executor('podman', None)
+
+    def test_run(self, monkeypatch, tmp_path, bedrock_home, terraform):
+        client = FakeDockerClient()
+        client.api.images[IMAGE] = 'sha256:1'
+        client.api.archives[IMAGE] = tar_archive({'main.tf': b'resource "null_resource" "this" {}\n'})
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        spec = native_spec(tmp_path, ['plan'])
+        spec.cvars = ['name=test']
+        assert spec.run() == 2
+        output = spec.output_file.getvalue()
+
+        # container paths are translated to host paths, and backend.tf is overlaid on the extracted configuration..
+        blueprint_path = tmp_path / 'blueprints' / '1'
+        assert f'cwd: {blueprint_path}' in output
+        assert f'-var-file=default.tfvars.json {bedrock_home}/.bedrock/extracted/' in output
+        assert f'plugins: {bedrock_home}/.bedrock/plugin-cache' in output
+        assert 'name: test' in output
+        assert 'backend.tf\nmain.tf\n' in output
+        assert 'error' not in output
+
+        # configuration is extracted once per image, with a container that is never started..
+        assert spec.run() == 2
+        assert len(client.api.created) == 1
+        assert not any(call[0] == 'start' for call in client.api.calls)
+        assert client.api.containers_by_id == {}
+        extracted = os.listdir(f'{bedrock_home}/.bedrock/extracted')
+        assert [entry for entry in extracted if not entry.endswith('.lock')] == ['bedrock_test_latest']
+
+    def test_var_file(self, monkeypatch, tmp_path, terraform):
+        client = FakeDockerClient()
+        client.api.images[IMAGE] = 'sha256:1'
+        client.api.archives[IMAGE] = tar_archive({'main.tf': b''})
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        var_file = tmp_path / 'prod.tfvars.json'
+        var_file.write_text('{}')
+        spec = native_spec(tmp_path, ['apply'])
+        spec.var_file = str(var_file)
+        spec.run()
+        assert f'-var-file={var_file} ' in spec.output_file.getvalue()
+
+
+class TestBlueprintCache:
+
+    def test_prune(self, tmp_path):
+        client = FakeDockerClient()
+        cache = bedrock.executors.BlueprintCache(str(tmp_path), max_entries=2)
+        for i in range(3):
+            image = f'bedrock/test:{i}'
+            client.api.images[image] = f'sha256:{i}'
+            client.api.archives[image] = tar_archive({'main.tf': b''})
+            path = cache.ensure(client, image)
+            os.utime(path, (i, i))
+
+        assert sorted(entry for entry in os.listdir(cache.path) if not entry.endswith('.lock')) == \
+            ['bedrock_test_1', 'bedrock_test_2']
+
+    def test_prune_in_use(self, tmp_path):
+        client = FakeDockerClient()
+        cache = bedrock.executors.BlueprintCache(str(tmp_path), max_entries=1)
+        for i in range(2):
+            client.api.images[f'bedrock/test:{i}'] = f'sha256:{i}'
+            client.api.archives[f'bedrock/test:{i}'] = tar_archive({'main.tf': b''})
+
+        with cache.use(client, 'bedrock/test:0') as path:
+            os.utime(path, (0, 0))
+            # the least recently used image isn't evicted while in use..
+            cache.ensure(client, 'bedrock/test:1')
+            assert os.path.isfile(os.path.join(path, 'main.tf'))
+        assert cache.prune() == [path]
+
+
+def test_translate_arg():
+    paths = {'/work': '/home/blueprints/1', '/work/prod.tfvars.json': '/tmp/prod.tfvars.json'}
+    assert bedrock.executors.translate_arg('-var-file=/work/prod.tfvars.json', paths) == \
+        '-var-file=/tmp/prod.tfvars.json'
+    assert bedrock.executors.translate_arg('/work/plan', paths) == '/home/blueprints/1/plan'
+    assert bedrock.executors.translate_arg('/workspace', paths) == '/workspace'
+    assert bedrock.executors.translate_arg('-lock=false', paths) == '-lock=false'
+
+
+class TestRemoteDockerExecutor:
+
+    def execution(self, tmp_path):
+        work_path = tmp_path / 'work'
+        work_path.mkdir(parents=True)
+        (work_path / 'terraform.tfstate').write_text('{"serial": 1}')
+        return bedrock.executors.Execution(IMAGE, 'apply', 'bedrock_1_default_abc', [],
+                                           {str(work_path): {'bind': '/work', 'mode': 'rw'}},
+                                           output=bedrock.stream.OutputStream(out=io.StringIO()))
+
+    def test_interrupt(self, tmp_path):
+        client = FakeDockerClient(output=[b'Applying..\n', KeyboardInterrupt()])
+        client.api.generated = {'terraform.tfstate': b'{"serial": 2}'}
+        executor = bedrock.executors.RemoteDockerExecutor(client)
+
+        # state updated before the interrupt is copied back after the container is stopped..
+        with pytest.raises(KeyboardInterrupt):
+            executor.run(self.execution(tmp_path))
+        assert [call[0] for call in client.api.calls][-3:] == ['stop', 'get_archive', 'remove_container']
+        assert (tmp_path / 'work' / 'terraform.tfstate').read_text() == '{"serial": 2}'
+        assert client.api.containers_by_id == {}
+
+    def test_download_failure(self, tmp_path, capsys):
+        client = FakeDockerClient()
+        client.api.archive_error = ConnectionError('Connection reset')
+        executor = bedrock.executors.RemoteDockerExecutor(client)
+
+        # the container is retained (and reported) such that state can be recovered..
+        assert executor.run(self.execution(tmp_path)) == 1
+        assert len(client.api.containers_by_id) == 1
+        assert 'docker cp bedrock_1_default_abc:/work' in capsys.readouterr().out
+
+        client = FakeDockerClient(output=[KeyboardInterrupt()])
+        client.api.archive_error = ConnectionError('Connection reset')
+        with pytest.raises(KeyboardInterrupt):
+            bedrock.executors.RemoteDockerExecutor(client).run(self.execution(tmp_path / 'interrupted'))
+        assert len(client.api.containers_by_id) == 1
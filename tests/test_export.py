@@ -0,0 +1,60 @@
+import sys
+
+import docker
+import pytest
+
+import bedrock.cli
+import bedrock.export
+from tests.fakes import FakeDockerClient, tar_archive
+
+
+class TestExportSpec:
+
+    def test_init(self):
+        spec = bedrock.export.ExportSpec('1', 'test')
+        assert spec.blueprint_id == '1'
+        assert spec.instance_name == 'test'
+
+    def test_run(self, monkeypatch, tmp_path):
+        client = FakeDockerClient()
+        client.api.archives['hashicorp/terraform:latest'] = tar_archive({
+            'main.tf': b'variable "name" {}\n',
+            'modules/vpc/main.tf': b'resource "aws_vpc" "vpc" {}\n',
+        })
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        spec = bedrock.export.ExportSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.image_tag = 'latest'
+        assert spec.run() == 0
+        assert (tmp_path / '1' / 'main.tf').read_text() == 'variable "name" {}\n'
+        assert (tmp_path / '1' / 'modules' / 'vpc' / 'main.tf').exists()
+
+        # container is never started, and is removed after export..
+        assert 'start' not in [call[0] for call in client.api.calls]
+        assert client.api.containers_by_id == {}
+
+        # unchanged files are skipped..
+        (tmp_path / '1' / 'main.tf').write_text('variable "name" {}\n')
+        mtime = (tmp_path / '1' / 'main.tf').stat().st_mtime_ns
+        assert spec.run() == 0
+        assert (tmp_path / '1' / 'main.tf').stat().st_mtime_ns == mtime
+
+
+class TestExportAll:
+
+    def test_run(self, monkeypatch, tmp_path, capsys):
+        client = FakeDockerClient()
+        client.api.archives['bedrock/aws-ecr-repository:latest'] = tar_archive({'main.tf': b''})
+        monkeypatch.setattr(docker, 'from_env', lambda **kwargs: client)
+        monkeypatch.setenv('BLUEPRINT_HOME', str(tmp_path))
+        monkeypatch.setattr(sys, 'argv', ['bedrock', 'export', '--all'])
+
+        # a failed export (e.g. no configuration in the image) is reported without aborting other exports..
+        with pytest.raises(SystemExit) as e:
+            bedrock.cli.BedrockCli()
+        assert e.value.code == 1
+        assert (tmp_path / 'aws' / 'ecr-repository' / 'main.tf').exists()
+        output = capsys.readouterr().out
+        assert '[ecs/task-definition] ' in output
+        assert 'BLUEPRINT' in output
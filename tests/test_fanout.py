@@ -0,0 +1,62 @@
+import signal
+import threading
+
+import docker
+
+import bedrock.executors
+import bedrock.fanout
+import bedrock.terraform
+from tests.fakes import FakeDockerClient
+
+
+class TestFanoutSpec:
+
+    def test_init(self):
+        spec = bedrock.fanout.FanoutSpec(bedrock.terraform.TerraformSpec('1', None), ['a', 'b'], max_workers=2)
+        assert spec.workspaces == ['a', 'b']
+        assert spec.max_workers == 2
+
+    def test_run(self, monkeypatch, tmp_path, capsys):
+        client = FakeDockerClient(output=[b'Plan: 0 to add\n'])
+        monkeypatch.setattr(docker, 'from_env', lambda **kwargs: client)
+
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.args = ['plan']
+
+        assert bedrock.fanout.FanoutSpec(spec, ['a', 'b', 'c'], max_workers=2).run() == 0
+
+        output = capsys.readouterr().out
+        for workspace in ['a', 'b', 'c']:
+            assert f'[{workspace}] Plan: 0 to add' in output
+            assert (tmp_path / '1' / f'{workspace}.tfvars.json').exists()
+
+        workspaces = sorted(e for c in client.api.runs for e in c['Config']['environment'] if e.startswith('TF_WORKSPACE='))
+        assert workspaces == ['TF_WORKSPACE=a', 'TF_WORKSPACE=b', 'TF_WORKSPACE=c']
+        assert client.api.containers_by_id == {}
+
+    def test_run_interrupt(self, monkeypatch, tmp_path):
+        client = FakeDockerClient()
+        client.api.block = True
+        monkeypatch.setattr(docker, 'from_env', lambda **kwargs: client)
+
+        # interrupt the main thread once both workers have started containers..
+        main_thread = threading.main_thread().ident
+        start = client.api.start
+
+        def start_and_interrupt(container):
+            start(container)
+            if sum(call[0] == 'start' for call in client.api.calls) == 2:
+                signal.pthread_kill(main_thread, signal.SIGINT)
+        monkeypatch.setattr(client.api, 'start', start_and_interrupt)
+
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.args = ['plan']
+
+        # running containers are stopped and removed, and queued workspaces are cancelled..
+        assert bedrock.fanout.FanoutSpec(spec, ['a', 'b', 'c'], max_workers=2).run() == 130
+        assert sum(call[0] == 'stop' for call in client.api.calls) == 2
+        assert len(client.api.runs) == 2
+        assert client.api.containers_by_id == {}
+        assert not bedrock.executors.active_runs.interrupted
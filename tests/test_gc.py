@@ -0,0 +1,25 @@
+import docker
+
+import bedrock.gc
+from bedrock.utils import container_labels
+from tests.fakes import FakeDockerClient
+
+
+class TestGcSpec:
+
+    def test_init(self):
+        spec = bedrock.gc.GcSpec(force=True)
+        assert spec.force
+
+    def test_run(self, monkeypatch):
+        client = FakeDockerClient()
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        orphan = client.api.create_container('test', name='orphan', labels=container_labels('1', 'default'))
+        running = client.api.create_container('test', name='running', labels=container_labels('1', 'default'))
+        client.api.start(running)
+        unmanaged = client.api.create_container('test', name='unmanaged')
+
+        assert bedrock.gc.GcSpec().run() == 0
+        assert set(client.api.containers_by_id.keys()) == {running['Id'], unmanaged['Id']}
+        assert ('remove_container', orphan['Id']) in client.api.calls
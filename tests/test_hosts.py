@@ -0,0 +1,115 @@
+import io
+import threading
+
+import bedrock.hosts
+import bedrock.terraform
+from tests.fakes import FakeDockerClient
+
+IMAGE = 'bedrock/test:latest'
+
+
+def fake_pool(urls, max_runs=2):
+    clients = {url: FakeDockerClient() for url in urls}
+    pool = bedrock.hosts.HostPool(urls, max_runs=max_runs, client_factory=lambda url: clients[url])
+    return pool, clients
+
+
+def terraform_spec(tmp_path, workspace='default'):
+    spec = bedrock.terraform.TerraformSpec('1', None)
+    spec.blueprint_home = str(tmp_path / 'blueprints')
+    spec.image = 'bedrock/test'
+    spec.workspace = workspace
+    spec.tty = False
+    spec.output_file = io.StringIO()
+    spec.args = ['apply']
+    return spec
+
+
+class TestHostPool:
+
+    def test_init(self, monkeypatch):
+        assert bedrock.hosts.HostPool.from_env() is None
+        monkeypatch.setenv('BEDROCK_DOCKER_HOSTS', 'unix:///var/run/docker.sock, tcp://build2:2375')
+        pool = bedrock.hosts.HostPool.from_env(max_runs=3)
+        assert [host.url for host in pool.hosts] == ['unix:///var/run/docker.sock', 'tcp://build2:2375']
+        assert [host.remote for host in pool.hosts] == [False, True]
+        assert pool.capacity == 6
+
+    def test_acquire(self):
+        pool, clients = fake_pool(['tcp://a:2375', 'tcp://b:2375', 'tcp://c:2375'])
+        clients['tcp://b:2375'].api.images[IMAGE] = 'sha256:1'
+        clients['tcp://c:2375'].api.unreachable = True
+        a, b, c = pool.hosts
+
+        # hosts with the image are preferred, then the host previously used by the blueprint, then the least loaded..
+        assert pool.acquire('1', IMAGE) is b
+        assert pool.acquire('1', IMAGE) is b
+        assert pool.acquire('1', IMAGE) is a
+        assert pool.acquire('2', 'bedrock/other:latest') is a
+        pool.release(b)
+        assert pool.acquire('2', 'bedrock/other:latest') is b
+
+        # unreachable hosts are excluded..
+        assert c.failed_at is not None
+        assert pool.acquire('1', IMAGE, exclude=[a, b]) is None
+
+    def test_acquire_probe(self):
+        pool, clients = fake_pool(['tcp://a:2375', 'tcp://b:2375'], max_runs=1)
+        clients['tcp://b:2375'].api.images[IMAGE] = 'sha256:1'
+        a, b = pool.hosts
+        assert pool.acquire('1', IMAGE) is b
+
+        # a slow image probe (on a) doesn't block runs releasing hosts..
+        probing, probed = threading.Event(), threading.Event()
+        inspect_image = clients['tcp://a:2375'].api.inspect_image
+
+        def slow_inspect_image(image):
+            probing.set()
+            probed.wait(5)
+            return inspect_image(image)
+        clients['tcp://a:2375'].api.inspect_image = slow_inspect_image
+
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(pool.acquire('2', 'bedrock/other:latest')))
+        thread.start()
+        assert probing.wait(5)
+        release = threading.Thread(target=pool.release, args=(b,))
+        release.start()
+        release.join(1)
+        assert not release.is_alive()
+
+        probed.set()
+        thread.join(5)
+        assert acquired == [a]
+
+    def test_run_failover(self, tmp_path):
+        pool, clients = fake_pool(['tcp://a:2375', 'tcp://b:2375'])
+        for client in clients.values():
+            client.api.images[IMAGE] = 'sha256:1'
+        clients['tcp://b:2375'].api.generated = {'terraform.tfstate': b'{"version": 4, "serial": 1}'}
+
+        # host becomes unreachable after it was checked..
+        pool.available()
+        clients['tcp://a:2375'].api.unreachable = True
+        assert pool.run(terraform_spec(tmp_path)) == 0
+        assert clients['tcp://a:2375'].api.created == []
+        assert pool.hosts[0].failed_at is not None
+
+        # blueprint files are copied to and from the remote host (instead of being bind mounted)..
+        container = clients['tcp://b:2375'].api.runs[0]
+        assert list(container['Config']['host_config']['binds'].values()) == [
+            {'bind': '/var/run/docker.sock', 'mode': 'ro'}]
+        assert {'work/default.tfvars.json', 'blueprint/backend.tf'} <= set(container['Uploads'])
+        assert 'TF_PLUGIN_CACHE_DIR' not in ' '.join(container['Config']['environment'])
+        assert (tmp_path / 'blueprints' / '1' / 'terraform.tfstate').read_bytes() == b'{"version": 4, "serial": 1}'
+
+    def test_run_registry(self, tmp_path):
+        pool, clients = fake_pool(['tcp://a:2375', 'tcp://b:2375'])
+        clients['tcp://b:2375'].api.images['registry.example.com/bedrock/test:latest'] = 'sha256:1'
+
+        # runs are placed by availability of the image in the blueprint registry..
+        spec = terraform_spec(tmp_path)
+        spec.image_registry = 'registry.example.com'
+        assert pool.run(spec) == 0
+        assert clients['tcp://a:2375'].api.created == []
+        assert pool.hosts[1].images == {'registry.example.com/bedrock/test:latest': True}
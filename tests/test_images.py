@@ -0,0 +1,29 @@
+import bedrock.images
+from tests.fakes import FakeDockerClient
+
+
+class TestImageManager:
+
+    def test_init(self, tmp_path):
+        manager = bedrock.images.ImageManager(None, root=str(tmp_path), ttl=10)
+        assert manager.manifest_path == f'{tmp_path}/manifests.json'
+        assert manager.ttl == 10
+
+    def test_ensure(self):
+        client = FakeDockerClient()
+        client.api.registry['bedrock/test:latest'] = 'sha256:1'
+        manager = bedrock.images.ImageManager(client)
+
+        # missing images are always pulled..
+        assert manager.ensure('bedrock/test')
+        # local images are not checked unless pull is requested..
+        assert not manager.ensure('bedrock/test')
+        assert not manager.ensure('bedrock/test', pull=True)
+
+        # registry digest is cached..
+        client.api.registry['bedrock/test:latest'] = 'sha256:2'
+        assert not manager.ensure('bedrock/test', pull=True)
+
+        manager.ttl = 0
+        assert manager.ensure('bedrock/test', pull=True)
+        assert [call for call in client.api.calls if call[0] == 'pull'] == [('pull', 'bedrock/test', 'latest')] * 2
@@ -0,0 +1,95 @@
+import json
+import os
+import time
+
+import bedrock.inventory
+
+
+def write_state(path, serial, resources, outputs=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({
+        'version': 4,
+        'serial': serial,
+        'outputs': outputs or {},
+        'resources': [{'mode': 'managed', 'type': resource_type, 'name': name, 'instances': [{'attributes': {}}]}
+                      for resource_type, name in resources]
+    }))
+
+
+class TestInventoryIndex:
+
+    def test_update(self, tmp_path):
+        home = tmp_path / 'blueprints'
+        write_state(home / 'aws' / 'ecr-repository' / 'terraform.tfstate', 1, [('aws_ecr_repository', 'this')],
+                    {'url': {'value': 'test'}, 'token': {'value': 'secret', 'sensitive': True}})
+        write_state(home / 'aws' / 'ecr-repository' / 'terraform.tfstate.d' / 'dev' / 'terraform.tfstate', 1,
+                    [('aws_ecr_repository', 'this'), ('aws_s3_bucket', 'logs')])
+        write_state(home / 'aws' / 'ecr-repository' / '.terraform' / 'terraform.tfstate', 1, [('ignored', 'this')])
+        write_state(home / 's3' / 'terraform.tfstate', 1, [('aws_s3_bucket', 'this')])
+        # state in the blueprint home itself isn't indexed..
+        write_state(home / 'terraform.tfstate', 1, [('aws_s3_bucket', 'root')])
+
+        index = bedrock.inventory.InventoryIndex(str(home), max_workers=2)
+        assert index.update() == (3, 0, 0)
+        assert index.resources('aws_s3_bucket.*') == [
+            ('aws/ecr-repository', 'dev', 'aws_s3_bucket.logs', 'aws_s3_bucket'),
+            ('s3', 'default', 'aws_s3_bucket.this', 'aws_s3_bucket')
+        ]
+        assert len(index.resources(resource_type='aws_ecr_repository')) == 2
+        assert index.outputs() == [('aws/ecr-repository', 'default', 'token', None, 1),
+                                   ('aws/ecr-repository', 'default', 'url', '"test"', 0)]
+
+        # only modified state is read..
+        state_file = home / 's3' / 'terraform.tfstate'
+        write_state(state_file, 2, [('aws_s3_bucket', 'renamed')])
+        os.utime(state_file, ns=(time.time_ns(), time.time_ns() + 1000))
+        (home / 'aws' / 'ecr-repository' / 'terraform.tfstate.d' / 'dev' / 'terraform.tfstate').unlink()
+        assert index.update() == (1, 1, 1)
+        assert index.resources('s3_bucket') == [('s3', 'default', 'aws_s3_bucket.renamed', 'aws_s3_bucket')]
+        index.close()
+
+    def test_update_registered(self, tmp_path):
+        home = tmp_path / 'blueprints'
+        write_state(home / 'aws' / 'ecr-repository' / 'terraform.tfstate', 1, [('aws_ecr_repository', 'this')])
+        write_state(home / 'unregistered' / 'terraform.tfstate', 1, [('aws_s3_bucket', 'this')])
+
+        # only the directories of registered blueprints are searched..
+        index = bedrock.inventory.InventoryIndex(str(home), blueprint_ids=['aws/ecr-repository', 'aws/missing'])
+        assert index.update() == (1, 0, 0)
+        assert index.resources() == [('aws/ecr-repository', 'default', 'aws_ecr_repository.this',
+                                      'aws_ecr_repository')]
+        index.close()
+
+    def test_query_latency(self, tmp_path):
+        home = tmp_path / 'blueprints'
+        for blueprint in range(20):
+            for workspace in range(10):
+                write_state(home / f'blueprint{blueprint}' / 'terraform.tfstate.d' / f'ws{workspace}' /
+                            'terraform.tfstate', 1, [('aws_instance', f'instance{i}') for i in range(50)])
+
+        index = bedrock.inventory.InventoryIndex(str(home))
+        assert index.update() == (200, 0, 0)
+
+        start = time.perf_counter()
+        assert index.update() == (0, 200, 0)
+        assert len(index.resources('instance42')) == 200
+        assert time.perf_counter() - start < 0.5
+        index.close()
+
+
+class TestInventorySpec:
+
+    def test_init(self):
+        spec = bedrock.inventory.InventorySpec('.', max_workers=2)
+        assert spec.max_workers == 2
+        assert spec.refresh
+
+    def test_run(self, tmp_path, capsys, bedrock_home):
+        (bedrock_home / '.bedrock').mkdir()
+        (bedrock_home / '.bedrock' / 'blueprints.json').write_text(json.dumps({'1': {'image': 'bedrock/test'}}))
+        write_state(tmp_path / '1' / 'terraform.tfstate', 1, [('aws_s3_bucket', 'this')])
+
+        spec = bedrock.inventory.InventorySpec(str(tmp_path))
+        spec.query = 'bucket'
+        assert spec.run() == 0
+        assert capsys.readouterr().out == '1\tdefault\taws_s3_bucket.this\n'
@@ -0,0 +1,93 @@
+import io
+import time
+
+import docker
+
+import bedrock.ledger
+import bedrock.terraform
+from tests.fakes import FakeDockerClient
+
+
+def record(ledger, blueprint_id, duration, exit_code=0, started=None, args=('plan',)):
+    ledger.record('terraform', blueprint_id, 'default', list(args), started or time.time(), duration, exit_code)
+
+
+class TestRunLedger:
+
+    def test_init(self, bedrock_home):
+        ledger = bedrock.ledger.RunLedger()
+        assert ledger.path == f'{bedrock_home}/.bedrock/ledger.db'
+        assert ledger.retention_days == 90
+
+    def test_runs(self, tmp_path):
+        ledger = bedrock.ledger.RunLedger(str(tmp_path))
+        for i in range(20):
+            record(ledger, f'aws/blueprint{i % 2}', i, exit_code=1 if i == 7 else 0, started=1000 + i,
+                   args=('apply',) if i % 5 == 0 else ('plan', '-lock=false'))
+
+        # runs are buffered until flushed..
+        assert not (tmp_path / 'ledger.db').exists()
+        assert len(ledger.runs()) == 20
+
+        assert [run['id'] for run in ledger.runs(limit=2)] == [20, 19]
+        assert len(ledger.runs('aws/blueprint1')) == 10
+        assert len(ledger.runs('aws/*', command='apply')) == 4
+        assert [run['duration'] for run in ledger.runs(failed=True)] == [7]
+        assert ledger.runs(limit=1)[0]['args'] == 'plan -lock=false'
+
+        stats = {row['blueprint']: row for row in ledger.stats()}
+        assert stats['aws/blueprint0']['count'] == 10
+        assert stats['aws/blueprint0']['p50'] == 8
+        assert stats['aws/blueprint0']['p95'] == 18
+        assert stats['aws/blueprint1']['failures'] == 1
+        assert [row['command'] for row in ledger.stats('command')] == ['apply', 'plan']
+        ledger.close()
+
+    def test_spool(self, tmp_path):
+        # runs are spooled when the ledger is unavailable, and written on the next flush..
+        (tmp_path / 'ledger.db').mkdir()
+        ledger = bedrock.ledger.RunLedger(str(tmp_path))
+        record(ledger, 'aws/blueprint', 1)
+        ledger.record('terraform', 'aws/blueprint', 'default', ['plan'], time.time(), 2, 0, log=b'test\n')
+        assert ledger.flush() == 0
+        assert (tmp_path / 'ledger.spool').exists()
+
+        (tmp_path / 'ledger.db').rmdir()
+        ledger = bedrock.ledger.RunLedger(str(tmp_path))
+        record(ledger, 'aws/blueprint', 3)
+        assert ledger.flush() == 3
+        assert not (tmp_path / 'ledger.spool').exists()
+        assert ledger.log(2) == 'test\n'
+        ledger.close()
+
+    def test_compact(self, tmp_path):
+        ledger = bedrock.ledger.RunLedger(str(tmp_path), retention_days=30)
+        record(ledger, 'aws/blueprint', 1, started=time.time() - 31 * 86400)
+        record(ledger, 'aws/blueprint', 1)
+        assert ledger.compact() == 1
+        assert len(ledger.runs()) == 1
+        ledger.close()
+
+
+class TestTerraformLedger:
+
+    def test_run(self, monkeypatch, tmp_path):
+        client = FakeDockerClient(exit_code=2, output=[b'Plan: 1 to add\n'])
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.ledger = bedrock.ledger.RunLedger(str(tmp_path))
+        spec.tty = False
+        spec.output_file = io.StringIO()
+        spec.record_log = True
+        spec.args = ['plan']
+        assert spec.run() == 2
+
+        run, = spec.ledger.runs()
+        assert run['blueprint'] == '1' and run['workspace'] == 'default' and run['command'] == 'plan'
+        assert run['exit_code'] == 2
+        assert run['image_id'] == 'hashicorp/terraform:latest'
+        assert run['duration'] >= run['run_duration'] > 0
+        assert spec.ledger.log(run['id']) == 'Plan: 1 to add\n'
+        spec.ledger.close()
@@ -0,0 +1,63 @@
+import docker
+import pytest
+
+import bedrock.manifest
+from tests.fakes import FakeDockerClient
+
+MANIFEST = """
+steps:
+  - name: ecr
+    blueprint: aws/ecr-repository
+    command: apply -auto-approve
+  - name: task
+    blueprint: ecs/task-definition
+    command: apply -auto-approve
+    depends_on: [ecr]
+  - name: service
+    blueprint: aws/ecr-repository
+    workspace: other
+    command: plan
+    depends_on: [task]
+  - name: independent
+    blueprint: aws/ecr-repository
+    command: plan
+"""
+
+
+class TestManifestSpec:
+
+    def test_init(self):
+        spec = bedrock.manifest.ManifestSpec('manifest.yaml', max_workers=2, resume=True)
+        assert spec.manifest_path == 'manifest.yaml'
+        assert spec.resume
+
+    def test_load_manifest(self, tmp_path):
+        (tmp_path / 'manifest.yaml').write_text(MANIFEST)
+        steps = bedrock.manifest.load_manifest(str(tmp_path / 'manifest.yaml'))
+        assert list(steps) == ['ecr', 'independent', 'task', 'service']
+        assert steps['ecr']['command'] == ['apply', '-auto-approve']
+
+        (tmp_path / 'cycle.yaml').write_text(MANIFEST.replace('depends_on: [ecr]', 'depends_on: [service]'))
+        with pytest.raises(bedrock.manifest.ManifestError):
+            bedrock.manifest.load_manifest(str(tmp_path / 'cycle.yaml'))
+
+    def test_run(self, monkeypatch, tmp_path):
+        client = FakeDockerClient()
+        client.api.exit_codes['bedrock/ecs-task-definition'] = 1
+        monkeypatch.setattr(docker, 'from_env', lambda **kwargs: client)
+        (tmp_path / 'manifest.yaml').write_text(MANIFEST)
+
+        spec = bedrock.manifest.ManifestSpec(str(tmp_path / 'manifest.yaml'), max_workers=2)
+        spec.blueprint_home = str(tmp_path)
+        assert spec.run() == 1
+        # dependents of failed steps are not run..
+        assert sorted(c['Image'] for c in client.api.runs) == ['bedrock/aws-ecr-repository'] * 2 + [
+            'bedrock/ecs-task-definition']
+
+        # resume from failed step..
+        client.api.exit_codes.clear()
+        client.api.created.clear()
+        spec.resume = True
+        assert spec.run() == 0
+        assert sorted(c['Image'] for c in client.api.runs) == ['bedrock/aws-ecr-repository',
+                                                                  'bedrock/ecs-task-definition']
@@ -0,0 +1,132 @@
+import json
+
+import docker
+import pytest
+
+import bedrock.outputs
+import bedrock.terraform
+from tests.fakes import FakeDockerClient
+
+
+def write_state(path, serial, outputs):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({'version': 4, 'serial': serial, 'outputs': outputs, 'resources': []}))
+
+
+def output(value, sensitive=False):
+    return {'value': value, 'type': 'string', 'sensitive': sensitive}
+
+
+class TestOutputIndex:
+
+    def test_init(self, tmp_path, bedrock_home):
+        index = bedrock.outputs.OutputIndex(str(tmp_path))
+        assert index.path.startswith(f'{bedrock_home}/.bedrock/outputs/')
+
+    def test_get(self, tmp_path):
+        index = bedrock.outputs.OutputIndex(str(tmp_path))
+        assert index.get('aws/ecr-repository', 'default') is None
+
+        # outputs of local state are refreshed when the serial changes..
+        state_file = tmp_path / 'aws' / 'ecr-repository' / 'terraform.tfstate'
+        write_state(state_file, 1, {'url': output('a')})
+        assert index.get('aws/ecr-repository', 'default') == {'url': output('a')}
+        write_state(state_file, 2, {'url': output('b')})
+        assert index.get('aws/ecr-repository', 'default') == {'url': output('b')}
+
+        # captured outputs of remote backends are returned as is..
+        (tmp_path / 's3').mkdir()
+        (tmp_path / 's3' / 'backend.tf').write_text('terraform {\n  backend "s3" {}\n}\n')
+        index.save('s3', 'prod', None, {'bucket': output('test')})
+        assert index.get('s3', 'prod') == {'bucket': output('test')}
+        assert index.get('s3', 'default') is None
+
+
+class TestResolveVarFile:
+
+    def test_resolve(self, tmp_path):
+        index = bedrock.outputs.OutputIndex(str(tmp_path))
+        index.save('aws/ecr-repository', 'default', 1, {'url': output('123.dkr.ecr/app'),
+                                                        'tags': {'value': ['a', 'b'], 'type': 'list'}})
+        index.save('aws/ecr-repository', 'prod', 1, {'url': output('456.dkr.ecr/app')})
+        var_file = tmp_path / 'default.tfvars.json'
+        var_file.write_text(json.dumps({
+            'image': '${bedrock:aws/ecr-repository/url}:latest',
+            'prod_image': '${bedrock:aws/ecr-repository@prod/url}',
+            'tags': '${bedrock:aws/ecr-repository/tags}',
+            'name': 'test'
+        }))
+        assert bedrock.outputs.resolve_var_file(str(var_file), 'default', index) == {
+            'image': '123.dkr.ecr/app:latest', 'prod_image': '456.dkr.ecr/app', 'tags': ['a', 'b'], 'name': 'test'}
+
+        # all unresolved references are reported..
+        var_file.write_text(json.dumps({'a': '${bedrock:aws/ecr-repository/arn}', 'b': '${bedrock:aws/vpc/id}'}))
+        with pytest.raises(ValueError) as e:
+            bedrock.outputs.resolve_var_file(str(var_file), 'default', index)
+        assert str(e.value).count('\n') == 1
+
+        var_file.write_text(json.dumps({'name': 'test'}))
+        assert bedrock.outputs.resolve_var_file(str(var_file), 'default', index) is None
+
+
+class TestTerraformOutputs:
+
+    def test_run(self, monkeypatch, tmp_path):
+        client = FakeDockerClient()
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        def run(blueprint_id, args):
+            spec = bedrock.terraform.TerraformSpec(blueprint_id, None)
+            spec.blueprint_home = str(tmp_path)
+            spec.tty = False
+            spec.args = args
+            return spec.run()
+
+        # dependent blueprint fails before a container is created if outputs aren't available..
+        (tmp_path / 'app').mkdir()
+        (tmp_path / 'app' / 'default.tfvars.json').write_text('{"image": "${bedrock:repo/url}"}')
+        assert run('app', ['plan']) == 1
+        assert client.api.created == []
+
+        # outputs are captured after apply..
+        write_state(tmp_path / 'repo' / 'terraform.tfstate', 1, {'url': output('test')})
+        assert run('repo', ['apply']) == 0
+        assert bedrock.outputs.OutputIndex(str(tmp_path)).get('repo', 'default') == {'url': output('test')}
+
+        assert run('app', ['plan']) == 0
+        assert '-var-file="/work/.bedrock/resolved/default.tfvars.json"' in client.api.created[-1]['Command']
+        assert json.loads((tmp_path / 'app' / '.bedrock' / 'resolved' / 'default.tfvars.json').read_text()) == {
+            'image': 'test'}
+
+    def test_run_remote_backend(self, monkeypatch, tmp_path):
+        client = FakeDockerClient(output=[b'{"url": {"value": "test", "type": "string", "sensitive": false}}\n'])
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+        (tmp_path / 'repo').mkdir()
+        (tmp_path / 'repo' / 'backend.tf').write_text('terraform {\n  backend "s3" {}\n}\n')
+
+        spec = bedrock.terraform.TerraformSpec('repo', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.tty = False
+        spec.args = ['apply']
+        assert spec.run() == 0
+
+        # outputs are read with an additional container..
+        assert client.api.created[-1]['Command'] == 'output -json'
+        assert bedrock.outputs.OutputIndex(str(tmp_path)).get('repo', 'default') == {'url': output('test')}
+
+    def test_run_remote_backend_warning(self, monkeypatch, tmp_path, capsys):
+        client = FakeDockerClient(output=[(None, b'Warning: deprecated attribute\n'),
+                                          (b'{"url": {"value": "test", "type": "string", "sensitive": false}}\n', None)])
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+        (tmp_path / 'repo').mkdir()
+        (tmp_path / 'repo' / 'backend.tf').write_text('terraform {\n  backend "s3" {}\n}\n')
+
+        spec = bedrock.terraform.TerraformSpec('repo', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.tty = False
+        spec.args = ['apply']
+        assert spec.run() == 0
+
+        # warnings are reported, rather than parsed with outputs..
+        assert bedrock.outputs.OutputIndex(str(tmp_path)).get('repo', 'default') == {'url': output('test')}
+        assert 'Warning: deprecated attribute' in capsys.readouterr().err
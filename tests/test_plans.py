@@ -0,0 +1,127 @@
+import io
+import os
+import time
+
+import docker
+import dockerpty
+
+import bedrock.plans
+import bedrock.terraform
+from tests.fakes import FakeDockerClient, fake_dockerpty_start
+
+
+class TestPlanCache:
+
+    def test_init(self, tmp_path):
+        cache = bedrock.plans.PlanCache(root=str(tmp_path), max_size=1, max_age=2)
+        assert cache.path == f'{tmp_path}/plans'
+        assert cache.max_size == 1024 * 1024
+        assert cache.max_age == 7200
+
+    def test_fingerprint(self, tmp_path):
+        var_file = tmp_path / 'default.tfvars.json'
+        var_file.write_text('{"name": "a"}')
+        fingerprint = bedrock.plans.PlanCache.fingerprint('sha256:1', [str(var_file)], [], 'default', ['plan'])
+
+        assert bedrock.plans.PlanCache.fingerprint('sha256:1', [str(var_file)], ['AWS_PROFILE=x'], 'default',
+                                                   ['plan', '-input=false']) == fingerprint
+        assert bedrock.plans.PlanCache.fingerprint('sha256:1', [str(var_file)], ['TF_VAR_name=b'], 'default',
+                                                   ['plan']) != fingerprint
+        var_file.write_text('{"name": "b"}')
+        assert bedrock.plans.PlanCache.fingerprint('sha256:1', [str(var_file)], [], 'default', ['plan']) != fingerprint
+
+    def test_prune(self, tmp_path):
+        cache = bedrock.plans.PlanCache(root=str(tmp_path), max_age=1)
+        cache.init('expired')
+        cache.init('current')
+        expired = time.time() - 7200
+        os.utime(cache.entry_path('expired'), (expired, expired))
+
+        assert cache.prune() == [cache.entry_path('expired')]
+
+
+class TestTerraformSpecPlanCache:
+
+    def test_run(self, monkeypatch, tmp_path):
+        client = FakeDockerClient(exit_code=2, output=[b'Plan: 1 to add\n'])
+        client.api.images['hashicorp/terraform:latest'] = 'sha256:1'
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        def run_plan():
+            out = io.StringIO()
+            spec = bedrock.terraform.TerraformSpec('1', None)
+            spec.blueprint_home = str(tmp_path)
+            spec.image_tag = 'latest'
+            spec.args = ['plan', '-detailed-exitcode']
+            spec.tty = False
+            spec.output_file = out
+            spec.plan_cache = bedrock.plans.PlanCache()
+            return spec.run(), out.getvalue()
+
+        assert run_plan() == (2, 'Plan: 1 to add\n')
+        assert '-out=/bedrock/plans/' in client.api.runs[0]['Command']
+
+        # simulate plan file written by terraform..
+        for entry in (tmp_path / 'home' / '.bedrock' / 'plans').iterdir():
+            (entry / 'plan.tfplan').write_bytes(b'plan')
+
+        # plan is not executed when inputs are unchanged..
+        assert run_plan() == (2, 'Plan: 1 to add\n')
+        assert len(client.api.runs) == 1
+
+        (tmp_path / '1' / 'default.tfvars.json').write_text('{"name": "changed"}\n')
+        run_plan()
+        assert len(client.api.runs) == 2
+
+    def test_run_tty(self, monkeypatch, tmp_path):
+        client = FakeDockerClient(exit_code=2, output=[b'Plan: 1 to add\n'])
+        client.api.images['hashicorp/terraform:latest'] = 'sha256:1'
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+        monkeypatch.setattr(dockerpty, 'start', fake_dockerpty_start)
+
+        def run_plan():
+            out = io.StringIO()
+            spec = bedrock.terraform.TerraformSpec('1', None)
+            spec.blueprint_home = str(tmp_path)
+            spec.image_tag = 'latest'
+            spec.args = ['plan', '-detailed-exitcode']
+            spec.output_file = out
+            spec.plan_cache = bedrock.plans.PlanCache()
+            return spec.run(), out.getvalue()
+
+        # output of a cached plan is streamed (not attached to a TTY), such that it's recorded for replay..
+        assert run_plan() == (2, 'Plan: 1 to add\n')
+        assert client.api.runs[0]['Config']['tty'] is False
+        for entry in (tmp_path / 'home' / '.bedrock' / 'plans').iterdir():
+            (entry / 'plan.tfplan').write_bytes(b'plan')
+
+        assert run_plan() == (2, 'Plan: 1 to add\n')
+        assert len(client.api.runs) == 1
+
+    def test_run_apply(self, monkeypatch, tmp_path):
+        client = FakeDockerClient(exit_code=2, output=[b'Plan: 1 to add\n'])
+        client.api.images['hashicorp/terraform:latest'] = 'sha256:1'
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        def run(args):
+            spec = bedrock.terraform.TerraformSpec('1', None)
+            spec.blueprint_home = str(tmp_path)
+            spec.image_tag = 'latest'
+            spec.args = args
+            spec.tty = False
+            spec.output_file = io.StringIO()
+            spec.plan_cache = bedrock.plans.PlanCache()
+            return spec.run()
+
+        run(['plan'])
+        for entry in (tmp_path / 'home' / '.bedrock' / 'plans').iterdir():
+            (entry / 'plan.tfplan').write_bytes(b'plan')
+
+        # an interactive apply isn't replaced with the cached plan (which would be applied without confirmation)..
+        client.api.exit_code = 0
+        run(['apply'])
+        assert client.api.runs[-1]['Command'].startswith('apply ')
+        assert '/bedrock/plans/' not in client.api.runs[-1]['Command']
+
+        run(['apply', '-auto-approve'])
+        assert client.api.runs[-1]['Command'].endswith('/plan.tfplan')
@@ -0,0 +1,62 @@
+import json
+import time
+
+import docker
+import dockerpty
+
+import bedrock.profile
+import bedrock.terraform
+from tests.fakes import FakeDockerClient, fake_dockerpty_start
+
+
+class TestProfile:
+
+    def test_disabled(self):
+        assert bedrock.profile.span('test') is bedrock.profile.NULL_SPAN
+
+        # disabled spans should have negligible overhead..
+        start = time.perf_counter()
+        for _ in range(100000):
+            with bedrock.profile.span('test'):
+                pass
+        assert (time.perf_counter() - start) / 100000 < 5e-6
+
+    def test_recorder(self, tmp_path):
+        recorder = bedrock.profile.SpanRecorder()
+        bedrock.profile.add_hook(recorder)
+        try:
+            with bedrock.profile.span('outer'):
+                for _ in range(2):
+                    with bedrock.profile.span('inner', index=1):
+                        pass
+        finally:
+            bedrock.profile.remove_hook(recorder)
+
+        assert [(name, depth, count) for name, depth, count, _ in recorder.summary()] == [('outer', 0, 1),
+                                                                                        ('inner', 1, 2)]
+
+        recorder.write_trace(str(tmp_path / 'trace.json'))
+        trace = json.loads((tmp_path / 'trace.json').read_text())
+        assert [event['name'] for event in trace['traceEvents']] == ['outer', 'inner', 'inner']
+        assert trace['traceEvents'][1]['args'] == {'index': '1'}
+
+    def test_terraform_phases(self, monkeypatch, tmp_path):
+        client = FakeDockerClient()
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+        monkeypatch.setattr(dockerpty, 'start', fake_dockerpty_start)
+
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.args = ['plan']
+
+        recorder = bedrock.profile.SpanRecorder()
+        bedrock.profile.add_hook(recorder)
+        try:
+            assert spec.run() == 0
+        finally:
+            bedrock.profile.remove_hook(recorder)
+
+        phases = [name for name, _, _, _ in recorder.summary()]
+        assert phases[0] == 'terraform'
+        assert {'environment', 'init_config', 'docker.from_env', 'image.ensure', 'container.create', 'container.run',
+                'container.remove'} <= set(phases)
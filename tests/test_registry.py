@@ -0,0 +1,79 @@
+import json
+import os
+import time
+
+import bedrock.registry
+
+
+def write_registry(path, count):
+    blueprints = {f'ns{i % 100}/blueprint-{i:06d}': {'image': f'bedrock/blueprint-{i:06d}'} for i in range(count)}
+    path.write_text(json.dumps(blueprints))
+    return list(blueprints)
+
+
+def lookup_time(registry, blueprint_ids, lookups=2000):
+    registry.get(blueprint_ids[0])
+    start = time.perf_counter()
+    for i in range(lookups):
+        registry.get(blueprint_ids[(i * 7919) % len(blueprint_ids)])
+    return (time.perf_counter() - start) / lookups
+
+
+class TestBlueprintRegistry:
+
+    def test_init(self, tmp_path):
+        registry = bedrock.registry.BlueprintRegistry(root=str(tmp_path))
+        assert registry.index_path == f'{tmp_path}/blueprints.idx'
+
+    def test_get(self, tmp_path):
+        (tmp_path / 'blueprints.d').mkdir()
+        (tmp_path / 'blueprints.d' / 'aws.json').write_text(json.dumps({'aws/vpc': {'image': 'bedrock/aws-vpc'}}))
+        (tmp_path / 'blueprints.json').write_text(json.dumps({'ecs/task': {'image': 'bedrock/ecs-task'}}))
+        registry = bedrock.registry.BlueprintRegistry(root=str(tmp_path), defaults={'ecs/task': {'image': 'default'}})
+
+        assert registry.get('aws/vpc') == {'image': 'bedrock/aws-vpc'}
+        assert registry.get('ecs/task') == {'image': 'bedrock/ecs-task'}
+        assert registry.get('missing') is None
+
+        # index is rebuilt when a registry file is modified..
+        (tmp_path / 'blueprints.json').write_text(json.dumps({'ecs/service': {'image': 'bedrock/ecs-service'}}))
+        os.utime(tmp_path / 'blueprints.json', ns=(0, 0))
+        assert registry.ids() == ['aws/vpc', 'ecs/service', 'ecs/task']
+        assert registry.get('ecs/task') == {'image': 'default'}
+
+    def test_sources(self, tmp_path, monkeypatch):
+        (tmp_path / 'blueprints.d').mkdir()
+        (tmp_path / 'blueprints.d' / 'aws.json').write_text(json.dumps({'aws/vpc': {'image': 'bedrock/aws-vpc'}}))
+        registry = bedrock.registry.BlueprintRegistry(root=str(tmp_path))
+        globs = []
+        glob = bedrock.registry.glob.glob
+        monkeypatch.setattr(bedrock.registry.glob, 'glob', lambda pattern: globs.append(pattern) or glob(pattern))
+
+        # namespaced registry files are listed once, until the directory is modified..
+        assert registry.get('aws/vpc') is not None and registry.get('aws/vpc') is not None
+        assert len(globs) == 1
+
+        (tmp_path / 'blueprints.d' / 'ecs.json').write_text(json.dumps({'ecs/task': {'image': 'bedrock/ecs-task'}}))
+        os.utime(tmp_path / 'blueprints.d', ns=(0, 0))
+        assert registry.ids() == ['aws/vpc', 'ecs/task']
+        assert len(globs) == 2
+
+    def test_search(self, tmp_path):
+        write_registry(tmp_path / 'blueprints.json', 200)
+        registry = bedrock.registry.BlueprintRegistry(root=str(tmp_path))
+
+        assert [match[0] for match in registry.search('ns1/blueprint-00000')] == ['ns1/blueprint-000001']
+        assert [match[0] for match in registry.search('000101')] == ['ns1/blueprint-000101']
+        assert [match[0] for match in registry.search('ns99bp199')] == ['ns99/blueprint-000199']
+        assert registry.search('unknown') == []
+
+    def test_lookup_scaling(self, tmp_path):
+        (tmp_path / 'small').mkdir()
+        (tmp_path / 'large').mkdir()
+        small = bedrock.registry.BlueprintRegistry(root=str(tmp_path / 'small'))
+        large = bedrock.registry.BlueprintRegistry(root=str(tmp_path / 'large'))
+        small_ids = write_registry(tmp_path / 'small' / 'blueprints.json', 10)
+        large_ids = write_registry(tmp_path / 'large' / 'blueprints.json', 100000)
+
+        # lookup time remains flat as the registry grows..
+        assert lookup_time(large, large_ids) < lookup_time(small, small_ids) * 3
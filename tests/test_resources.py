@@ -0,0 +1,87 @@
+import io
+
+import docker
+
+import bedrock.resources
+import bedrock.terraform
+from tests.fakes import FakeDockerClient
+
+GB = 1024 ** 3
+
+
+class TestResourceBudget:
+
+    def test_host_resources(self):
+        cpus, memory = bedrock.resources.host_resources()
+        assert cpus > 0
+        assert memory is None or memory > 0
+
+    def test_parse_memory(self):
+        assert bedrock.resources.parse_memory('512m') == 512 * 1024 ** 2
+        assert bedrock.resources.parse_memory('4GiB') == 4 * GB
+        assert bedrock.resources.parse_memory(1024) == 1024
+
+    def test_resource_budget(self):
+        # a single run uses the whole host..
+        limits, parallelism = bedrock.resources.resource_budget(16, 64 * GB)
+        assert limits['cpu_quota'] == 16 * limits['cpu_period']
+        assert parallelism == 64
+
+        # concurrent runs divide the host..
+        limits, parallelism = bedrock.resources.resource_budget(8, 16 * GB, concurrency=4)
+        assert limits == {'cpu_period': 100000, 'cpu_quota': 200000, 'mem_limit': int(16 * GB * 0.9 / 4)}
+        assert parallelism == 8
+
+        # parallelism is bounded by memory..
+        assert bedrock.resources.resource_budget(8, 2 * GB, concurrency=4)[1] == 4
+
+        # a single run is never limited below Terraform's default..
+        assert bedrock.resources.resource_budget(1, GB)[1] == 10
+        assert bedrock.resources.resource_budget(1, GB, concurrency=2)[1] == 2
+
+        # overrides..
+        limits, parallelism = bedrock.resources.resource_budget(8, 16 * GB, 4, {'cpus': 4, 'memory': '1g',
+                                                                                 'parallelism': 20})
+        assert limits['cpu_quota'] == 400000 and limits['mem_limit'] == GB
+        assert parallelism == 20
+
+    def test_with_parallelism(self):
+        assert bedrock.resources.with_parallelism(['apply', '-auto-approve'], 8) == [
+            'apply', '-auto-approve', '-parallelism=8']
+        assert bedrock.resources.with_parallelism(['plan', '-parallelism=2'], 8) == ['plan', '-parallelism=2']
+        assert bedrock.resources.with_parallelism(['output'], 8) == ['output']
+
+
+class TestTerraformResources:
+
+    def test_run(self, monkeypatch, tmp_path):
+        client = FakeDockerClient()
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.tty = False
+        spec.output_file = io.StringIO()
+        spec.args = ['plan']
+        spec.concurrency = 2
+        assert spec.run() == 0
+
+        # limits are derived from the daemon resources (8 CPUs, 16GB)..
+        container = client.api.created[-1]
+        assert container['Config']['host_config']['cpu_quota'] == 400000
+        assert container['Config']['host_config']['mem_limit'] == int(16 * GB * 0.9 / 2)
+        assert container['Command'].startswith('plan -parallelism=16 ')
+        assert client.api.info_calls == 1
+
+        # per-blueprint overrides, or disabled..
+        spec.resources = {'parallelism': 5}
+        assert spec.run() == 0
+        assert client.api.created[-1]['Command'].startswith('plan -parallelism=5 ')
+
+        # daemon resources are queried once per client..
+        assert client.api.info_calls == 1
+
+        spec.resources = False
+        assert spec.run() == 0
+        assert 'cpu_quota' not in client.api.created[-1]['Config']['host_config']
+        assert '-parallelism' not in client.api.created[-1]['Command']
@@ -0,0 +1,128 @@
+import io
+import json
+import time
+import tracemalloc
+
+import pytest
+
+import bedrock.state
+from bedrock.stream import OutputStream
+
+STATE = {
+    'version': 4,
+    'terraform_version': '1.5.7',
+    'serial': 3,
+    'lineage': 'test',
+    'outputs': {
+        'name': {'value': 'test', 'type': 'string'},
+        'count': {'value': 2, 'type': 'number'},
+        'secret': {'value': 'hidden', 'type': 'string', 'sensitive': True}
+    },
+    'resources': [
+        {'mode': 'managed', 'type': 'aws_s3_bucket', 'name': 'this', 'instances': [{'attributes': {}}]},
+        {'mode': 'data', 'type': 'aws_caller_identity', 'name': 'current', 'instances': [{'attributes': {}}]},
+        {'module': 'module.vpc', 'mode': 'managed', 'type': 'aws_subnet', 'name': 'private',
+         'instances': [{'index_key': 'a', 'attributes': {}}, {'index_key': 0, 'attributes': {}}]}
+    ]
+}
+
+
+def run_native(tmp_path, args, workspace='default', raw=False):
+    out = io.StringIO()
+    exit_code = bedrock.state.NativeStateSpec('1', str(tmp_path), workspace).run(args, OutputStream(out=out, raw=raw))
+    return exit_code, out.getvalue()
+
+
+class TestJSONStream:
+
+    def test_stream(self):
+        data = '{"a": [1, 22, {"b": "c"}], "d": 12345, "e": {}, "f": []}'
+        stream = bedrock.state.JSONStream(io.StringIO(data), chunk_size=3)
+        values = {}
+        for key in stream.items():
+            if key == 'a':
+                values[key] = []
+                for _ in stream.elements():
+                    values[key].append(stream.value())
+            else:
+                values[key] = stream.value()
+        assert values == json.loads(data)
+
+    def test_stream_large_value(self):
+        # strings may contain delimiters and escapes (split across chunks)..
+        value = {'a': ['{[', '\\"]}', {'b': 'c\\\\'}] * 1000, 'd': '"' * 100}
+        data = json.dumps({'value': value, 'next': 1})
+        for chunk_size in [1, 2, 7, 64]:
+            stream = bedrock.state.JSONStream(io.StringIO(data), chunk_size=chunk_size)
+            assert [(key, stream.value()) for key in stream.items()] == [('value', value), ('next', 1)]
+
+        with pytest.raises(ValueError):
+            bedrock.state.JSONStream(io.StringIO(data[:-20])).value()
+
+    def test_stream_linear(self):
+        class CountingDecoder(json.JSONDecoder):
+            calls = 0
+
+            def raw_decode(self, s, idx=0):
+                CountingDecoder.calls += 1
+                return super().raw_decode(s, idx)
+
+        # a large value is decoded once, rather than each time a chunk is read..
+        stream = bedrock.state.JSONStream(io.StringIO(json.dumps(['x' * 100] * 10000)), chunk_size=1024)
+        stream.decoder = CountingDecoder()
+        assert len(stream.value()) == 10000
+        assert CountingDecoder.calls == 1
+
+
+class TestNativeStateSpec:
+
+    def test_init(self):
+        spec = bedrock.state.NativeStateSpec('1', '.', 'default')
+        assert spec.workspace == 'default'
+
+    def test_run(self, tmp_path):
+        (tmp_path / '1' / 'terraform.tfstate.d' / 'dev').mkdir(parents=True)
+        (tmp_path / '1' / 'terraform.tfstate').write_text(json.dumps(STATE))
+
+        assert run_native(tmp_path, ['workspace', 'list'], 'dev') == (0, '  default\n* dev\n\n')
+        assert run_native(tmp_path, ['workspace', 'show'], 'dev') == (0, 'dev\n')
+        assert run_native(tmp_path, ['output']) == (0, 'count = 2\nname = "test"\nsecret = <sensitive>\n')
+        assert run_native(tmp_path, ['output', '-raw', 'name'], raw=True) == (0, 'test')
+        assert json.loads(run_native(tmp_path, ['output', '-json'])[1]) == {
+            name: dict(output, sensitive=output.get('sensitive', False)) for name, output in STATE['outputs'].items()}
+        assert run_native(tmp_path, ['state', 'list']) == (0, 'aws_s3_bucket.this\ndata.aws_caller_identity.current\n'
+                                                              'module.vpc.aws_subnet.private["a"]\n'
+                                                              'module.vpc.aws_subnet.private[0]\n')
+        assert run_native(tmp_path, ['state', 'list', 'module.vpc'])[1].count('\n') == 2
+
+        # unsupported options and workspaces without state..
+        assert run_native(tmp_path, ['state', 'list', '-id=test']) == (None, '')
+        assert run_native(tmp_path, ['output'], 'dev') == (0, '')
+
+    def test_run_remote_backend(self, tmp_path):
+        (tmp_path / '1').mkdir()
+        (tmp_path / '1' / 'backend.tf').write_text('terraform {\n  backend "s3" {}\n}\n')
+        assert run_native(tmp_path, ['state', 'list']) == (None, '')
+
+    def test_large_state(self, tmp_path):
+        resource = {'mode': 'managed', 'type': 'aws_instance', 'name': 'this',
+                    'instances': [{'attributes': {'user_data': 'x' * 1024}}]}
+        state = dict(STATE, resources=[dict(resource, name=f'this{i}') for i in range(10000)])
+        (tmp_path / '1').mkdir()
+        state_file = tmp_path / '1' / 'terraform.tfstate'
+        state_file.write_text(json.dumps(state))
+
+        # outputs precede resources, so output doesn't read the entire state..
+        start = time.perf_counter()
+        assert run_native(tmp_path, ['output', 'name']) == (0, '"test"\n')
+        assert time.perf_counter() - start < 0.1
+
+        # resources are parsed one at a time..
+        tracemalloc.start()
+        try:
+            addresses = list(bedrock.state.state_resources(str(state_file)))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert len(addresses) == 10000
+        assert peak < state_file.stat().st_size / 4
@@ -0,0 +1,41 @@
+import json
+import multiprocessing
+
+import bedrock.storage
+
+
+def update_keys(path, worker, count):
+    for i in range(count):
+        bedrock.storage.update_json(path, {f'worker{worker}': {f'key{i}': i}})
+
+
+class TestStorage:
+
+    def test_merge_patch(self):
+        target = {'a': 1, 'b': {'c': 2, 'd': 3}, 'e': [1]}
+        patch = {'a': None, 'b': {'c': 4}, 'e': [2], 'f': 'g'}
+        assert bedrock.storage.merge_patch(target, patch) == {'b': {'c': 4, 'd': 3}, 'e': [2], 'f': 'g'}
+        assert target == {'a': 1, 'b': {'c': 2, 'd': 3}, 'e': [1]}
+
+    def test_atomic_write(self, tmp_path):
+        path = tmp_path / 'config' / 'config.json'
+        bedrock.storage.write_json(str(path), {'a': 1})
+        bedrock.storage.write_json(str(path), {'b': 2})
+        assert bedrock.storage.read_json(str(path)) == {'b': 2}
+        assert [p.name for p in path.parent.iterdir()] == ['config.json']
+
+    def test_concurrent_updates(self, tmp_path):
+        path = str(tmp_path / 'config.json')
+        workers, count = 8, 25
+
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=update_keys, args=(path, worker, count)) for worker in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            assert process.exitcode == 0
+
+        with open(path, 'r') as f:
+            config = json.load(f)
+        assert config == {f'worker{worker}': {f'key{i}': i for i in range(count)} for worker in range(workers)}
@@ -0,0 +1,53 @@
+import io
+import json
+
+import bedrock.stream
+
+
+class TestOutputStream:
+
+    def test_write(self):
+        out = io.StringIO()
+        stream = bedrock.stream.OutputStream('ws1', out)
+
+        # multi-byte character split across chunks..
+        data = 'Plan: 1 to add ✓\nNo changes'.encode('utf-8')
+        split = data.index('✓'.encode('utf-8')) + 1
+        stream.write(data[:split])
+        stream.write(data[split:])
+        assert out.getvalue() == '[ws1] Plan: 1 to add ✓\n'
+
+        stream.close()
+        assert out.getvalue() == '[ws1] Plan: 1 to add ✓\n[ws1] No changes\n'
+
+    def test_write_json(self):
+        out = io.StringIO()
+        stream = bedrock.stream.OutputStream('ws1', out, output_format='json')
+        stream.write(b'Error: invalid', 'stderr')
+        stream.write(b' value\n', 'stderr')
+
+        line = json.loads(out.getvalue())
+        assert line['stream'] == 'stderr'
+        assert line['source'] == 'ws1'
+        assert line['line'] == 'Error: invalid value'
+        assert 'ts' in line
+
+    def test_write_long_line(self):
+        out = io.StringIO()
+        stream = bedrock.stream.OutputStream(out=out)
+        stream.max_line_length = 10
+        stream.write(b'0123456789abcdef')
+
+        # partial line is flushed once it exceeds the maximum length..
+        assert out.getvalue() == '0123456789abcdef\n'
+
+    def test_write_raw(self):
+        out = io.StringIO()
+        stream = bedrock.stream.OutputStream(out=out, raw=True)
+        stream.write(b'partial')
+        assert out.getvalue() == 'partial'
+
+        # a partial final line is written unchanged (without a trailing newline)..
+        stream.write(b' value')
+        stream.close()
+        assert out.getvalue() == 'partial value'
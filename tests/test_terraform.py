@@ -1,4 +1,12 @@
+import io
+import json
+
+import docker
+import docker.errors
+import dockerpty
+
 import bedrock.terraform
+from tests.fakes import FakeDockerClient, fake_dockerpty_start
 
 
 class TestTerraformSpec:
@@ -7,3 +15,73 @@ class TestTerraformSpec:
         spec = bedrock.terraform.TerraformSpec('1', 'test')
         assert spec.blueprint_id == '1'
         assert spec.instance_name == 'test'
+
+    def test_run(self, monkeypatch, tmp_path):
+        client = FakeDockerClient(exit_code=2)
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+        monkeypatch.setattr(dockerpty, 'start', fake_dockerpty_start)
+
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.args = ['plan']
+
+        # exit code is propagated and container is removed..
+        assert spec.run() == 2
+        assert client.api.containers_by_id == {}
+
+        container_id = client.api.runs[0]['Id']
+        assert client.api.runs[0]['Names'][0].startswith('/bedrock_1_default_')
+        assert ('remove_container', container_id) in client.api.calls
+
+    def test_run_pull_failed(self, monkeypatch, tmp_path, capsys):
+        client = FakeDockerClient()
+        client.api.pull_error = docker.errors.ImageNotFound('pull access denied')
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.image = 'bedrock/missing'
+        spec.tty = False
+        spec.args = ['plan']
+        assert spec.run() == 1
+        assert 'Blueprint image could not be pulled: bedrock/missing' in capsys.readouterr().out
+        assert client.api.created == []
+
+    def test_run_native_state(self, monkeypatch, tmp_path):
+        client = FakeDockerClient()
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.args = ['state', 'list']
+
+        # local state is read without a container, otherwise the command runs in a container..
+        assert spec.run() == 0
+        assert client.api.created == []
+
+        (tmp_path / '1').mkdir()
+        (tmp_path / '1' / 'backend.tf').write_text('terraform {\n  backend "s3" {}\n}\n')
+        spec.tty = False
+        assert spec.run() == 0
+        assert len(client.api.runs) == 1
+
+    def test_run_output_raw(self, monkeypatch, tmp_path):
+        client = FakeDockerClient(output=[b'val', b'ue'])
+        monkeypatch.setattr(docker, 'from_env', lambda: client)
+
+        (tmp_path / '1').mkdir()
+        (tmp_path / '1' / 'terraform.tfstate').write_text(json.dumps({'outputs': {'name': {'value': 'test'}}}))
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.tty = False
+        spec.args = ['output', '-raw', 'name']
+
+        # raw values are written unchanged (without a trailing newline), both natively and from a container..
+        spec.output_file = io.StringIO()
+        assert spec.run() == 0
+        assert spec.output_file.getvalue() == 'test'
+
+        spec.native_state = False
+        spec.output_file = io.StringIO()
+        assert spec.run() == 0
+        assert spec.output_file.getvalue() == 'value'
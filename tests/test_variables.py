@@ -0,0 +1,190 @@
+import io
+import json
+
+import docker
+import pytest
+
+import bedrock.config
+import bedrock.terraform
+import bedrock.variables
+from tests.fakes import FakeDockerClient, tar_archive
+
+IMAGE = 'bedrock/test:latest'
+
+VARIABLES = b'''
+# variable "commented" {}
+variable "region" {
+  type        = string
+  description = "Region (e.g. \\"${local.default}\\")"
+}
+
+variable "instance_count" {
+  type    = number
+  default = 1 // single instance
+}
+
+variable "tags" {
+  type    = map(string)
+  default = {}
+
+  validation {
+    condition     = length(var.tags) < 10
+    error_message = "Too many tags."
+  }
+}
+
+variable "service" {
+  description = <<-EOT
+    Service { config }
+  EOT
+  type = object({
+    name  = string
+    ports = optional(list(number), [80])
+  })
+  default = null
+}
+'''
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeDockerClient()
+    client.api.images[IMAGE] = 'sha256:1'
+    client.api.archives[IMAGE] = tar_archive({'variables.tf': VARIABLES, 'modules/vpc/variables.tf':
+                                              b'variable "cidr" {}\n'})
+    monkeypatch.setattr(docker, 'from_env', lambda: client)
+    return client
+
+
+class TestVariableSchema:
+
+    def test_parse_variables(self):
+        variables = bedrock.variables.parse_variables(VARIABLES.decode())
+        assert variables == {
+            'region': {'type': 'string', 'required': True},
+            'instance_count': {'type': 'number', 'required': False},
+            'tags': {'type': ['map', 'string'], 'required': False},
+            'service': {'type': ['object', {'name': 'string', 'ports': ['list', 'number']}, ['ports']],
+                        'required': False},
+        }
+        assert bedrock.variables.parse_variables(
+            '{"variable": {"zones": {"type": "list(string)"}}}', json_syntax=True) == {
+            'zones': {'type': ['list', 'string'], 'required': True}}
+        assert bedrock.variables.parse_type('"list"') == ['list', 'any']
+        assert bedrock.variables.parse_type('list(string') == 'any'
+
+    def test_validate_variables(self):
+        schema = bedrock.variables.parse_variables(VARIABLES.decode())
+        with pytest.raises(ValueError) as e:
+            bedrock.variables.validate_variables(schema, [
+                ('default.tfvars.json', {'regoin': 'us-east-1', 'instance_count': 'two',
+                                         'service': {'ports': ['http']}}, False),
+                ('TF_VAR', {'instance_count': '2', 'tags': '{"a": "b"}'}, True),
+            ])
+
+        # all errors are reported..
+        assert str(e.value).splitlines() == [
+            'default.tfvars.json: undeclared variable regoin (did you mean region?)',
+            'default.tfvars.json: instance_count: expected number, got "two"',
+            'default.tfvars.json: service: missing attribute name',
+            'default.tfvars.json: service.ports[0]: expected number, got "http"',
+            'Missing required variable: region',
+        ]
+
+    def test_schema_cache(self, client):
+        cache = bedrock.variables.SchemaCache()
+        schema = cache.get(client, IMAGE)
+        assert set(schema) == {'region', 'instance_count', 'tags', 'service'}
+
+        # schemas are read once per image digest..
+        assert cache.get(client, IMAGE) == schema
+
+        # cached schemas are found by image reference (without a Docker daemon)..
+        assert cache.cached(IMAGE) == schema
+        assert cache.cached('bedrock/test') == schema
+        assert cache.cached('bedrock/other') is None
+        assert len(client.api.created) == 1
+        assert ('start', client.api.created[0]['Id']) not in client.api.calls
+
+
+class TestValidation:
+
+    def test_terraform_run(self, client, tmp_path):
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.image = 'bedrock/test'
+        spec.tty = False
+        spec.output_file = io.StringIO()
+        spec.args = ['plan', '-var=instance_count=x']
+        spec.cvars = ['region=us-east-1']
+
+        # invalid variables are reported before a container is started..
+        (tmp_path / '1').mkdir()
+        (tmp_path / '1' / 'default.tfvars.json').write_text(json.dumps({'tags': ['a']}))
+        assert spec.run() == 1
+        assert not any(call[0] == 'start' for call in client.api.calls)
+
+        (tmp_path / '1' / 'default.tfvars.json').write_text(json.dumps({'tags': {'a': 'b'}}))
+        spec.args = ['plan']
+        assert spec.run() == 0
+        assert any(call[0] == 'start' for call in client.api.calls)
+
+    def test_var_files(self, client, tmp_path, capsys):
+        spec = bedrock.terraform.TerraformSpec('1', None)
+        spec.blueprint_home = str(tmp_path)
+        spec.image = 'bedrock/test'
+        spec.tty = False
+        spec.output_file = io.StringIO()
+        spec.args = ['plan', '-var-file', 'prod.tfvars']
+        spec.cvars = ['undeclared=1']
+
+        # required variables may be specified by auto-loaded and command-line var files (undeclared environment
+        # variables are ignored, as with Terraform)..
+        (tmp_path / '1').mkdir()
+        (tmp_path / '1' / 'terraform.tfvars').write_text('# defaults\ntags = { team = "platform" }\n')
+        (tmp_path / '1' / 'prod.tfvars').write_text('region = "us-east-1"\ninstance_count = "two"\n')
+        assert spec.run() == 1
+        assert capsys.readouterr().out.count('prod.tfvars: instance_count: expected number, got "two"') == 1
+
+        (tmp_path / '1' / 'prod.tfvars').write_text('region = "us-east-1"\n')
+        assert spec.run() == 0
+
+        (tmp_path / '1' / 'prod.tfvars').unlink()
+        (tmp_path / '1' / 'region.auto.tfvars.json').write_text(json.dumps({'region': 'us-east-1'}))
+        spec.args = ['plan']
+        assert spec.run() == 0
+
+    def test_read_var_file(self, tmp_path):
+        var_file = tmp_path / 'terraform.tfvars'
+        var_file.write_text('region = "us-east-1" # default region\ncount = 2\ntags = {\n  team = "a"\n}\n')
+        assert bedrock.variables.read_var_file(str(var_file)) == {
+            'region': 'us-east-1', 'count': 2, 'tags': bedrock.variables.UNKNOWN}
+        assert bedrock.variables.read_var_file(str(tmp_path / 'missing.tfvars')) == {}
+        assert bedrock.variables.var_file_args(['plan', '-var-file', 'a.tfvars', '-var-file="b.tfvars"']) == [
+            'a.tfvars', 'b.tfvars']
+
+    def test_plan_file_arg(self):
+        assert bedrock.variables.plan_file_arg(['apply', '-auto-approve', 'tfplan']) == 'tfplan'
+        assert bedrock.variables.plan_file_arg(['apply', '-parallelism', '5', '-lock=false', 'tfplan']) == 'tfplan'
+        assert bedrock.variables.plan_file_arg(['apply', '-parallelism', '5']) is None
+        assert bedrock.variables.plan_file_arg(['plan', '-out', 'tfplan']) is None
+
+    def test_config_run(self, client, tmp_path, capsys):
+        spec = bedrock.config.ConfigSpec('1')
+        spec.blueprint_home = str(tmp_path)
+        spec.image = 'bedrock/test'
+        spec.cvars = {'instance_cuont': '2'}
+        spec.dry_run = True
+
+        # config never reads the image (variables are only validated once the schema is cached by a run)..
+        assert spec.run() == 0
+        assert 'Variables not validated' in capsys.readouterr().out
+        assert client.api.calls == []
+
+        bedrock.variables.SchemaCache().get(client, 'bedrock/test')
+        spec.dry_run = False
+        assert spec.run() == 1
+        assert not (tmp_path / '1' / 'default.tfvars.json').exists()
+
+        spec.cvars = {'instance_count': '2'}
+        assert spec.run() == 0